@@ -0,0 +1,61 @@
+class ChannelRules:
+    """
+    A class that decides whether the messages of a channel are monitored, in constant time.
+
+    The whitelist and blacklist hold integer ids of channels, categories or servers. Discord ids
+    are unique across all of them, so a message is matched by looking up the ids of its channel,
+    its parent channel (for threads), its category and its server in the same set. Rules are
+    added and removed one by one, so changing a rule never rebuilds the others.
+    """
+
+    def __init__(self, monitor_all=True):
+        """
+        Initializes a new ChannelRules instance, without any rule.
+
+        Args:
+            monitor_all (bool): Whether every channel is monitored except the blacklisted ones,
+                                rather than only the whitelisted ones.
+        """
+        self.monitor_all = monitor_all
+        self.whitelist = set()
+        self.blacklist = set()
+
+    def load(self, whitelist, blacklist):
+        """
+        Replaces all the rules.
+
+        Args:
+            whitelist (list): The ids, as strings or integers, monitored when not monitoring all channels.
+            blacklist (list): The ids, as strings or integers, not monitored when monitoring all channels.
+        """
+        self.whitelist = {int(target_id) for target_id in whitelist}
+        self.blacklist = {int(target_id) for target_id in blacklist}
+
+    def is_monitored(self, channel):
+        """
+        Returns whether the messages of the given channel are monitored.
+        """
+        rules = self.blacklist if self.monitor_all else self.whitelist
+        matched = bool(rules) and self.find_rule(channel, rules) is not None
+        return matched != self.monitor_all
+
+    @staticmethod
+    def find_rule(channel, rules):
+        """
+        Returns the id of the channel, its parent, its category or its server found in the given rules, or None.
+        """
+        if channel.id in rules:
+            return channel.id
+
+        parent_id = getattr(channel, "parent_id", None)
+        if parent_id is not None and parent_id in rules:
+            return parent_id
+
+        category_id = getattr(channel, "category_id", None)
+        if category_id is not None and category_id in rules:
+            return category_id
+
+        guild = getattr(channel, "guild", None)
+        if guild is not None and guild.id in rules:
+            return guild.id
+        return None
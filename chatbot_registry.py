@@ -0,0 +1,109 @@
+import logging
+import time
+
+import utils
+from single_flight import SingleFlight
+
+logger = logging.getLogger('discord')
+
+
+class ChatBotRegistry:
+    """
+    A class that holds one shared chatbot per (bot, model), created on first use.
+
+    Chatbots are shared by every guild and channel bound to the same bot and model, so
+    switching the model of one guild neither affects the others nor rebuilds their clients.
+    A chatbot that fails to be created isn't tried again for a while, backing off while it
+    keeps failing, so the messages of a channel with a broken binding don't each rebuild it.
+    """
+
+    def __init__(self, factory, retry_delay=30.0, max_retry_delay=600.0):
+        """
+        Initializes a new ChatBotRegistry instance.
+
+        Args:
+            factory: A coroutine function taking a bot name and a model name, returning a new chatbot,
+                     or None if it cannot be created.
+            retry_delay (float): The number of seconds before creating a chatbot again after it failed.
+            max_retry_delay (float): The maximum number of seconds before creating a chatbot that keeps failing again.
+        """
+        self.factory = factory
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.instances = {}  # (bot, normalized model) to chatbot
+        self.failures = {}  # (bot, normalized model) to the number of consecutive failures and the time to retry
+        self.creations = SingleFlight()  # Collapses concurrent creations of the same chatbot
+
+    @staticmethod
+    def make_key(bot, model):
+        """
+        Returns the key of the chatbot of the given bot and model.
+        """
+        return (bot, utils.normalize_text(model) if model else None)
+
+    async def get(self, bot, model):
+        """
+        Returns the chatbot of the given bot and model, creating it if needed.
+
+        Args:
+            bot (str): The name of the bot, e.g. "poe".
+            model (str): The name of the model.
+
+        Returns:
+            The shared chatbot, or None if it cannot be created, or failed to be created recently.
+        """
+        key = self.make_key(bot, model)
+        instance = self.instances.get(key)
+        if instance is not None:
+            return instance
+
+        failure = self.failures.get(key)
+        if failure is not None and time.monotonic() < failure[1]:
+            return None
+
+        instance, _ = await self.creations.do(key, lambda: self.__create(key, bot, model))
+        return instance
+
+    def peek(self, bot, model):
+        """
+        Returns the chatbot of the given bot and model if it has been created, without creating it.
+        """
+        return self.instances.get(self.make_key(bot, model))
+
+    async def prune(self, keys_in_use):
+        """
+        Closes and forgets the chatbots whose key is not in use anymore.
+
+        Args:
+            keys_in_use (set): The keys of the chatbots still bound somewhere.
+        """
+        for key in [key for key in self.instances if key not in keys_in_use]:
+            instance = self.instances.pop(key)
+            logger.info(f"Closing unused chatbot {key}")
+            await instance.close()
+
+    def get_all(self):
+        """
+        Returns the list of the chatbots created so far.
+        """
+        return list(self.instances.values())
+
+    async def __create(self, key, bot, model):
+        """
+        Creates the chatbot of the given bot and model and keeps it.
+        """
+        if key in self.instances:
+            return self.instances[key]
+
+        instance = await self.factory(bot, model)
+        if instance is not None:
+            self.instances[key] = instance
+            self.failures.pop(key, None)
+            logger.info(f"Created chatbot {key}")
+            return instance
+
+        failures = self.failures[key][0] + 1 if key in self.failures else 1
+        delay = min(self.retry_delay * 2 ** (failures - 1), self.max_retry_delay)
+        self.failures[key] = (failures, time.monotonic() + delay)
+        logger.warning(f"Failed to create chatbot {key}, retrying in {delay:.0f}s")
+        return instance
@@ -1,3 +1,5 @@
-from .chatbot import ChatBot
+from .chatbot import ChatBot, CircuitOpenError, QueryError, QueryTimeoutError
+from .conversation_window import ConversationWindow
 from .hugging_face_chatbot import HuggingFaceChatBot
+from .model_index import ModelIndex
 from .poe_chatbot import PoeChatBot
@@ -1,6 +1,33 @@
 import abc
 
 
+class QueryError(Exception):
+    """
+    Raised when a chatbot fails to generate a response.
+    """
+    pass
+
+
+class QueryTimeoutError(QueryError):
+    """
+    Raised when a chatbot query misses its deadline.
+
+    Attributes:
+        partial_text (str): The part of the response generated before the deadline.
+    """
+
+    def __init__(self, message="Query deadline exceeded", partial_text=""):
+        super().__init__(message)
+        self.partial_text = partial_text
+
+
+class CircuitOpenError(QueryError):
+    """
+    Raised when a chatbot fails fast because its model keeps failing.
+    """
+    pass
+
+
 class ChatBot(abc.ABC):
     """
     An abstract base class for chatbot implementations.
@@ -18,24 +45,54 @@ class ChatBot(abc.ABC):
         pass
 
     @abc.abstractmethod
-    async def query(self, input: str, debug=False):
+    async def query(self, input: str, debug=False, context_key=None, deadline=None):
         """
         Queries the model with the given input text and returns the generated response.
 
         Args:
             input (str): The user's input text.
             debug (bool): Whether to include debugging information in the response.
+            context_key: The key of the conversation context to use, e.g. (guild id, channel id).
+            deadline (float): The `time.monotonic()` time after which the query is abandoned, or None for no deadline.
 
         Returns:
             A tuple of two values:
             - success (bool): Whether the query was successful.
             - generated_text (str): The generated response text.
               If `success` is False, this will contain an error message instead.
+
+        Raises:
+            QueryTimeoutError: If the deadline is exceeded.
         """
         pass
 
+    async def query_stream(self, input: str, debug=False, context_key=None, deadline=None):
+        """
+        Queries the model with the given input text and yields the generated response in chunks.
+
+        The default implementation yields the whole response of `query` as a single chunk,
+        chatbots that can stream their responses should override it.
+
+        Args:
+            input (str): The user's input text.
+            debug (bool): Whether to include debugging information in the response.
+            context_key: The key of the conversation context to use, e.g. (guild id, channel id).
+            deadline (float): The `time.monotonic()` time after which the query is abandoned, or None for no deadline.
+
+        Yields:
+            str: The next chunk of the generated response text.
+
+        Raises:
+            QueryError: If the query was not successful.
+            QueryTimeoutError: If the deadline is exceeded.
+        """
+        success, generated_text = await self.query(input, debug=debug, context_key=context_key, deadline=deadline)
+        if not success:
+            raise QueryError(generated_text)
+        yield generated_text
+
     @abc.abstractmethod
-    def change_model(self, new_model):
+    async def change_model(self, new_model):
         """
         Changes the model used by the chatbot.
 
@@ -48,7 +105,7 @@ class ChatBot(abc.ABC):
         pass
 
     @abc.abstractmethod
-    def change_token(self, new_token):
+    async def change_token(self, new_token):
         """
         Changes the API token used by the chatbot.
 
@@ -61,9 +118,53 @@ class ChatBot(abc.ABC):
         pass
 
     @abc.abstractmethod
-    def clear_context(self):
+    def clear_context(self, context_key=None):
         """
         Clears the chatbot's context (i.e. past user inputs and generated responses).
+
+        Args:
+            context_key: The key of the conversation context to clear, or None to clear all contexts.
+        """
+        pass
+
+    def get_context_fingerprint(self, context_key=None):
+        """
+        Returns a hashable fingerprint of the given conversation context, or None if not tracked by the chatbot.
+
+        Args:
+            context_key: The key of the conversation context.
+        """
+        return None
+
+    def get_context_stats(self):
+        """
+        Returns a dictionary of conversation context statistics, or None if not tracked by the chatbot.
+        """
+        return None
+
+    def keeps_context_locally(self):
+        """
+        Returns whether the conversation contexts are kept by the chatbot, rather than by the service
+        it queries, so a response obtained without a query can be added to them.
+        """
+        return False
+
+    def add_to_context(self, input: str, response: str, context_key=None):
+        """
+        Adds a response obtained without a query, e.g. from the response cache, to the given conversation context.
+
+        Does nothing if the chatbot doesn't keep its contexts locally.
+
+        Args:
+            input (str): The user's input text.
+            response (str): The response to the input.
+            context_key: The key of the conversation context.
+        """
+        pass
+
+    async def close(self):
+        """
+        Releases the resources held by the chatbot, e.g. network connections.
         """
         pass
 
@@ -79,4 +180,17 @@ class ChatBot(abc.ABC):
         """
         Returns the name of the models available by the chatbot.
         """
-        pass
\ No newline at end of file
+        pass
+
+    def search_models(self, text, limit=25):
+        """
+        Returns the names of the available models best matching the given text, for suggestions.
+
+        The default implementation returns no suggestions, chatbots with a known list of models
+        should override it.
+
+        Args:
+            text (str): The text typed so far.
+            limit (int): The maximum number of names to return.
+        """
+        return []
\ No newline at end of file
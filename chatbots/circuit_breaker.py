@@ -0,0 +1,95 @@
+import time
+
+from enum import Enum
+
+
+class CircuitState(Enum):
+    CLOSED = "closed"  # Calls go through
+    OPEN = "open"  # Calls fail fast until the reset timeout has passed
+    HALF_OPEN = "half-open"  # A single trial call goes through to test the recovery
+
+
+class CircuitBreaker:
+    """
+    A class that stops calls to a failing service for a while, instead of piling up more failing calls.
+
+    The circuit opens after a number of consecutive failures. Once the reset timeout has
+    passed, a single trial call is let through: its success closes the circuit, its failure
+    opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=60.0):
+        """
+        Initializes a new CircuitBreaker instance, starting closed.
+
+        Args:
+            failure_threshold (int): The number of consecutive failures that opens the circuit.
+            reset_timeout (float): The number of seconds the circuit stays open before a trial call.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CircuitState.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_started_at = 0.0
+        self.opened = 0  # Number of times the circuit opened
+
+    def allow(self):
+        """
+        Returns whether a call may go through, starting a trial call if the circuit is ready for one.
+        """
+        now = time.monotonic()
+
+        if self.state == CircuitState.OPEN:
+            if now - self.opened_at < self.reset_timeout:
+                return False
+            self.state = CircuitState.HALF_OPEN
+            self.trial_started_at = now
+            return True
+
+        if self.state == CircuitState.HALF_OPEN:
+            # Let another trial through if the previous one never reported back
+            if now - self.trial_started_at < self.reset_timeout:
+                return False
+            self.trial_started_at = now
+            return True
+
+        return True
+
+    def record_success(self):
+        """
+        Records a successful call, closing the circuit.
+        """
+        self.state = CircuitState.CLOSED
+        self.consecutive_failures = 0
+
+    def record_failure(self):
+        """
+        Records a failed call, opening the circuit if there are too many failures in a row.
+        """
+        self.consecutive_failures += 1
+
+        if self.state == CircuitState.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != CircuitState.OPEN:
+                self.opened += 1
+            self.state = CircuitState.OPEN
+            self.opened_at = time.monotonic()
+
+    def get_retry_after(self):
+        """
+        Returns the number of seconds before the next trial call, 0 if calls go through.
+        """
+        if self.state != CircuitState.OPEN:
+            return 0.0
+        return max(self.reset_timeout - (time.monotonic() - self.opened_at), 0.0)
+
+    def get_stats(self):
+        """
+        Returns a dictionary of circuit breaker statistics.
+        """
+        return {
+            "state": self.state.value,
+            "consecutive_failures": self.consecutive_failures,
+            "retry_after": self.get_retry_after(),
+            "opened": self.opened,
+        }
@@ -0,0 +1,109 @@
+import collections
+
+
+class ContextStore:
+    """
+    A class that holds an independent conversation context per key, e.g. per (guild, channel).
+
+    Contexts are kept in least recently used order. Once the total size of the contexts
+    exceeds the limit, the least recently used ones are evicted.
+    """
+
+    def __init__(self, factory, max_size=16_000_000):
+        """
+        Initializes a new ContextStore instance.
+
+        Args:
+            factory: A function without arguments that creates a new empty context.
+                     The context must provide `get_size()` and `clear()`.
+            max_size (int): The maximum total size of all contexts, in characters.
+
+        Raises:
+            ValueError: If `max_size` is smaller than 1.
+        """
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+
+        self.factory = factory
+        self.max_size = max_size
+        self.contexts = collections.OrderedDict()  # Context per key, least recently used first
+        self.sizes = {}  # Last known size per key
+        self.size = 0  # Total size of all contexts
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Returns the context of the given key, creating it if needed.
+
+        Args:
+            key: The key of the context.
+        """
+        context = self.contexts.get(key)
+        if context is None:
+            context = self.contexts[key] = self.factory()
+            self.sizes[key] = 0
+        else:
+            self.contexts.move_to_end(key)
+        return context
+
+    def peek(self, key):
+        """
+        Returns the context of the given key without creating it or marking it as used, or None if missing.
+
+        Args:
+            key: The key of the context.
+        """
+        return self.contexts.get(key)
+
+    def update(self, key):
+        """
+        Records the new size of the context of the given key, evicting idle contexts if over the limit.
+
+        Args:
+            key: The key of the context that has changed.
+        """
+        context = self.contexts.get(key)
+        if context is None:
+            return
+
+        new_size = context.get_size()
+        self.size += new_size - self.sizes[key]
+        self.sizes[key] = new_size
+        self.contexts.move_to_end(key)
+
+        # Evict the least recently used contexts, keeping the one just updated
+        while self.size > self.max_size and len(self.contexts) > 1:
+            evicted_key = next(iter(self.contexts))
+            self.__remove(evicted_key)
+            self.evictions += 1
+
+    def clear(self, key=None):
+        """
+        Removes the context of the given key, or all contexts if `key` is None.
+
+        Args:
+            key: The key of the context to remove.
+        """
+        if key is None:
+            self.contexts.clear()
+            self.sizes.clear()
+            self.size = 0
+        elif key in self.contexts:
+            self.__remove(key)
+
+    def get_stats(self):
+        """
+        Returns a dictionary of store statistics.
+        """
+        return {
+            "contexts": len(self.contexts),
+            "size": self.size,
+            "evictions": self.evictions,
+        }
+
+    def __remove(self, key):
+        """
+        Removes the context of the given key and its size from the total.
+        """
+        self.contexts.pop(key).clear()
+        self.size -= self.sizes.pop(key)
@@ -0,0 +1,114 @@
+import collections
+import re
+
+
+class ConversationWindow:
+    """
+    A class that keeps the most recent turns of a conversation within a character budget.
+
+    Turns are evicted from the oldest one once the budget is exceeded. The total size is
+    tracked as turns come and go, so trimming costs O(1) amortized per turn. Evicted turns
+    can optionally be condensed into a short summary that is kept as the first turn.
+    """
+
+    SUMMARY_PREFIX = "Summary of the earlier conversation: "
+    SUMMARY_REPLY = "OK."
+
+    def __init__(self, max_chars=4000, summarize=False, summary_max_chars=500):
+        """
+        Initializes a new ConversationWindow instance.
+
+        Args:
+            max_chars (int): The maximum number of characters kept across all turns.
+            summarize (bool): Whether to condense evicted turns into a summary.
+            summary_max_chars (int): The maximum number of characters of the summary.
+
+        Raises:
+            ValueError: If `max_chars` is smaller than 1.
+        """
+        if max_chars < 1:
+            raise ValueError("max_chars must be at least 1")
+
+        self.max_chars = max_chars
+        self.summarize = summarize
+        self.summary_max_chars = summary_max_chars
+        self.turns = collections.deque()  # (user_input, generated_response) pairs
+        self.size = 0  # Total characters of the turns
+        self.summary = ""
+
+    def __len__(self):
+        return len(self.turns)
+
+    def append(self, user_input: str, generated_response: str):
+        """
+        Adds a turn to the conversation, evicting the oldest turns if over budget.
+
+        Args:
+            user_input (str): The user's input text.
+            generated_response (str): The generated response text.
+        """
+        self.turns.append((user_input, generated_response))
+        self.size += len(user_input) + len(generated_response)
+
+        while self.size > self.max_chars and self.turns:
+            evicted_input, evicted_response = self.turns.popleft()
+            self.size -= len(evicted_input) + len(evicted_response)
+
+            if self.summarize:
+                self.__add_to_summary(evicted_input, evicted_response)
+
+    def get_past_user_inputs(self):
+        """
+        Returns the user inputs of the kept turns, oldest first.
+        """
+        inputs = [user_input for user_input, _ in self.turns]
+        if self.summary:
+            inputs.insert(0, f"{self.SUMMARY_PREFIX}{self.summary}")
+        return inputs
+
+    def get_generated_responses(self):
+        """
+        Returns the generated responses of the kept turns, oldest first.
+        """
+        responses = [response for _, response in self.turns]
+        if self.summary:
+            responses.insert(0, self.SUMMARY_REPLY)
+        return responses
+
+    def get_size(self):
+        """
+        Returns the number of characters held by the window, including the summary.
+        """
+        return self.size + len(self.summary)
+
+    def get_fingerprint(self):
+        """
+        Returns a hash of the turns and the summary, equal for windows holding the same conversation.
+        """
+        return hash((tuple(self.turns), self.summary))
+
+    def clear(self):
+        """
+        Removes all turns and the summary.
+        """
+        self.turns.clear()
+        self.size = 0
+        self.summary = ""
+
+    def __add_to_summary(self, user_input: str, generated_response: str):
+        """
+        Condenses an evicted turn into the summary, keeping only the first sentence of each side.
+        """
+        line = f"{self.__first_sentence(user_input)} / {self.__first_sentence(generated_response)}"
+        self.summary = f"{self.summary} {line}".strip()
+
+        # Forget the oldest part of the summary once it is over budget
+        if len(self.summary) > self.summary_max_chars:
+            self.summary = self.summary[-self.summary_max_chars:].lstrip()
+
+    @staticmethod
+    def __first_sentence(text: str):
+        """
+        Returns the first sentence of the given text.
+        """
+        return re.split(r"(?<=[.!?])\s", text.strip(), maxsplit=1)[0]
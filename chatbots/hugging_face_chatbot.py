@@ -1,7 +1,25 @@
-from chatbots.chatbot import ChatBot
+from chatbots.chatbot import ChatBot, CircuitOpenError, QueryTimeoutError
+from chatbots.circuit_breaker import CircuitBreaker
+from chatbots.context_store import ContextStore
+from chatbots.conversation_window import ConversationWindow
+from enum import Enum
+import aiohttp
 import asyncio
 import json
-import requests
+import random
+import time
+
+
+class HuggingFaceError(Enum):
+    LOADING = "loading"  # The model is being loaded
+    RATE_LIMITED = "rate-limited"  # Too many requests
+    SERVER = "server"  # The API failed to answer
+    NETWORK = "network"  # The API couldn't be reached
+    REQUEST = "request"  # The request itself is invalid, retrying won't help
+
+
+TRANSIENT_ERRORS = {HuggingFaceError.LOADING, HuggingFaceError.RATE_LIMITED,
+                    HuggingFaceError.SERVER, HuggingFaceError.NETWORK}
 
 
 class HuggingFaceChatBot(ChatBot):
@@ -9,13 +27,26 @@ class HuggingFaceChatBot(ChatBot):
     A class that represents a chatbot that uses a Hugging Face model for generating responses.
     """
 
-    def __init__(self, token, model):
+    def __init__(self, token, model, pool_size=16, timeout=120.0, context_max_chars=4000, context_summarize=False, context_store_max_chars=16_000_000,
+                 max_retries=3, retry_base_delay=1.0, retry_max_delay=30.0, breaker_threshold=5, breaker_reset_timeout=60.0, wait_for_model=False):
         """
         Initializes a new ChatBot instance.
 
         Args:
             model (str): The name of the Hugging Face model to use.
             token (str): The API token to use for accessing the Hugging Face API.
+            pool_size (int): The maximum number of pooled connections to the Hugging Face API.
+            timeout (float): The maximum number of seconds to wait for a request to complete.
+            context_max_chars (int): The maximum number of characters of past conversation sent with each query.
+            context_summarize (bool): Whether to condense the turns evicted from the context into a summary.
+            context_store_max_chars (int): The maximum number of characters held across all conversation contexts.
+            max_retries (int): The maximum number of retries of a query failing with a transient error.
+            retry_base_delay (float): The number of seconds of the first retry delay, doubled on each retry.
+            retry_max_delay (float): The maximum number of seconds between two retries.
+            breaker_threshold (int): The number of queries of a model failing in a row after which its queries fail fast.
+            breaker_reset_timeout (float): The number of seconds queries of a failing model fail fast before a trial query.
+            wait_for_model (bool): Whether the API holds the request until the model is loaded, rather than the chatbot
+                                   polling it until then, within the deadline or the timeout.
 
         Raises:
             ValueError: If `model` or `token` are empty strings.
@@ -29,16 +60,33 @@ class HuggingFaceChatBot(ChatBot):
         self.api_base_url = "https://api-inference.huggingface.co/models"
         self.api_url = f"{self.api_base_url}/{model}"
         self.headers = {"Authorization": f"Bearer {token}"}
-        self.past_user_inputs = []
-        self.generated_responses = []
+        self.contexts = ContextStore(
+            lambda: ConversationWindow(
+                context_max_chars, summarize=context_summarize),
+            context_store_max_chars)
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.session = None  # Created on first use, as it needs a running event loop
+        self.in_flight = 0
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset_timeout = breaker_reset_timeout
+        self.wait_for_model = wait_for_model
+        self.breakers = {}  # Circuit breaker per model
+        self.retries = 0
+        self.last_query_at = 0.0
 
-    async def query(self, input: str, debug=False):
+    async def query(self, input: str, debug=False, context_key=None, deadline=None):
         """
         Queries the Hugging Face model with the given input text and returns the generated response.
 
         Args:
             input (str): The user's input text.
             debug (bool): Whether to include debugging information in the response.
+            context_key: The key of the conversation context to use, e.g. (guild id, channel id).
+            deadline (float): The `time.monotonic()` time after which the query is abandoned, or None for no deadline.
 
         Returns:
             A tuple of two values:
@@ -48,48 +96,90 @@ class HuggingFaceChatBot(ChatBot):
 
         Raises:
             ValueError: If `input` is an empty string.
+            QueryTimeoutError: If the deadline is exceeded.
+            CircuitOpenError: If the model keeps failing and its queries fail fast for now.
         """
         if not input:
             raise ValueError("input cannot be an empty string")
 
+        model = self.model
+        breaker = self.__get_breaker(model)
+        if not breaker.allow():
+            raise CircuitOpenError(
+                f"Model `{model}` keeps failing, retrying in {breaker.get_retry_after():.0f}s")
+
+        self.last_query_at = time.monotonic()
+        context = self.contexts.get(context_key)
+
         data = {
             "inputs": {
-                "past_user_inputs": self.past_user_inputs,
-                "generated_responses": self.generated_responses,
+                "past_user_inputs": context.get_past_user_inputs(),
+                "generated_responses": context.get_generated_responses(),
                 "text": input.strip(),
             },
             "options": {
-                "wait_for_model": True
+                # By default, retry while the model loads instead of holding the connection for the whole load
+                "wait_for_model": self.wait_for_model
             }
         }
 
-        data = json.loads(json.dumps(data))
+        # A loading model is waited for until the deadline, or the timeout without one, however long it
+        # takes to load, while other transient errors are retried a limited number of times
+        load_deadline = deadline if deadline is not None else time.monotonic() + self.timeout.total
+        attempt = 0
+        retries = 0
+        while True:
+            try:
+                response_json, error = await self.__post(data, deadline)
+            except QueryTimeoutError:
+                breaker.record_failure()
+                raise
+
+            if error not in TRANSIENT_ERRORS:
+                break
+
+            loading = error == HuggingFaceError.LOADING and 'estimated_time' in response_json
+            if not loading and retries >= self.max_retries:
+                break
 
-        loop = asyncio.get_running_loop()
-        response = await loop.run_in_executor(None, lambda: requests.post(self.api_url, headers=self.headers, json=data))
+            delay = self.__get_retry_delay(retries, response_json)
+            limit = load_deadline if loading else deadline
+            if limit is not None and time.monotonic() + delay >= limit:
+                break
 
-        response_json = json.loads(response.text)
+            attempt += 1
+            if not loading:
+                retries += 1
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+        if error is None:
+            breaker.record_success()
+        elif error in TRANSIENT_ERRORS:
+            breaker.record_failure()
 
         success = False
         generated_text = None
-        if 'generated_text' in response_json:
+        if error is None:
             success = True
             generated_text = response_json['generated_text'].strip()
-            self.past_user_inputs.append(input)
-            self.generated_responses.append(generated_text)
+            context.append(input, generated_text)
+            self.contexts.update(context_key)
         else:
-            error = response_json.get('error')
-            if error:
-                generated_text = error
+            message = response_json.get('error')
+            if message:
+                generated_text = f"{message}"
             else:
                 generated_text = f"No generated text found in response\n`{response_json}`"
 
         if debug:
             generated_text += f"\n```json\n{json.dumps(response_json, indent=2)}\n```"
+            if error is not None:
+                generated_text += f"\nError: `{error.value}`, attempts: `{attempt + 1}`"
 
         return success, generated_text
 
-    def change_model(self, new_model):
+    async def change_model(self, new_model):
         """
         Changes the Hugging Face model used by the chatbot.
 
@@ -99,15 +189,17 @@ class HuggingFaceChatBot(ChatBot):
         Returns:
             True if the model was changed successfully, False if not.
         """
-        response = requests.get(f"{self.api_base_url}/{new_model}")
-        if response.status_code == 200:
+        async with self.__get_session().get(f"{self.api_base_url}/{new_model}", headers=self.headers) as response:
+            status = response.status
+
+        if status == 200:
             self.model = new_model
             self.api_url = f"{self.api_base_url}/{new_model}"
             return True
         else:
             return False
 
-    def change_token(self, new_token):
+    async def change_token(self, new_token):
         """
         Changes the API token used by the chatbot.
 
@@ -120,12 +212,53 @@ class HuggingFaceChatBot(ChatBot):
         self.headers = {"Authorization": f"Bearer {new_token}"}
         return True
 
-    def clear_context(self):
+    def clear_context(self, context_key=None):
         """
         Clears the chatbot's context (i.e. past user inputs and generated responses).
+
+        Args:
+            context_key: The key of the conversation context to clear, or None to clear all contexts.
+        """
+        self.contexts.clear(context_key)
+
+    def keeps_context_locally(self):
+        """
+        Returns True, as the conversation contexts are sent with each query.
         """
-        self.past_user_inputs = []
-        self.generated_responses = []
+        return True
+
+    def add_to_context(self, input: str, response: str, context_key=None):
+        """
+        Adds a response obtained without a query, e.g. from the response cache, to the given conversation context.
+
+        Args:
+            input (str): The user's input text.
+            response (str): The response to the input.
+            context_key: The key of the conversation context.
+        """
+        self.contexts.get(context_key).append(input, response)
+        self.contexts.update(context_key)
+
+    def get_context_fingerprint(self, context_key=None):
+        """
+        Returns a hashable fingerprint of the given conversation context.
+
+        Args:
+            context_key: The key of the conversation context.
+        """
+        context = self.contexts.peek(context_key)
+
+        # An empty context has the same fingerprint as a missing one
+        if context is None or context.get_size() == 0:
+            return None
+
+        return context.get_fingerprint()
+
+    def get_context_stats(self):
+        """
+        Returns a dictionary of conversation context statistics.
+        """
+        return self.contexts.get_stats()
 
     def get_model(self):
         """
@@ -138,3 +271,137 @@ class HuggingFaceChatBot(ChatBot):
         Returns the name of the models available by the chatbot.
         """
         return "please visit https://huggingface.co/models?pipeline_tag=conversational to get a list of available models."
+
+    async def close(self):
+        """
+        Closes the HTTP connection pool once the queries in flight have finished.
+        """
+        while self.in_flight > 0:
+            await asyncio.sleep(1)
+
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def keep_warm(self):
+        """
+        Sends a minimal query to the model so it stays loaded, without touching any conversation context.
+
+        Returns:
+            True if the model answered, False if it is loading, failing or its circuit is open.
+        """
+        if self.__get_breaker(self.model).get_retry_after() > 0:
+            return False
+
+        data = {
+            "inputs": {"text": "Hi"},
+            "options": {"wait_for_model": False, "use_cache": False}
+        }
+        _, error = await self.__post(data)
+        return error is None
+
+    def get_breaker_stats(self):
+        """
+        Returns a dictionary of circuit breaker statistics per model, with the number of retries made.
+        """
+        return {
+            "retries": self.retries,
+            "models": {model: breaker.get_stats() for model, breaker in self.breakers.items()},
+        }
+
+    async def __post(self, data, deadline=None):
+        """
+        Sends the query data to the model once.
+
+        Returns:
+            A tuple of two values:
+            - response_json (dict): The JSON response, or a dictionary with the error if there isn't any.
+            - error (HuggingFaceError): The kind of error, or None if the query was successful.
+
+        Raises:
+            QueryTimeoutError: If the deadline is exceeded.
+        """
+        # Shorten the request timeout to the deadline, which aborts the request when reached
+        timeout = self.timeout
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise QueryTimeoutError()
+            timeout = aiohttp.ClientTimeout(
+                total=min(self.timeout.total, remaining))
+
+        self.in_flight += 1
+        try:
+            async with self.__get_session().post(self.api_url, headers=self.headers, json=data, timeout=timeout) as response:
+                status = response.status
+                text = await response.text()
+        except asyncio.TimeoutError:
+            raise QueryTimeoutError("Hugging Face request timed out")
+        except aiohttp.ClientError as e:
+            return {"error": f"{type(e).__name__} - {e}"}, HuggingFaceError.NETWORK
+        finally:
+            self.in_flight -= 1
+
+        try:
+            response_json = json.loads(text)
+        except ValueError:
+            response_json = {"error": f"HTTP {status}: {text[:200]}"}
+
+        if not isinstance(response_json, dict):
+            response_json = {"error": f"Unexpected response\n`{response_json}`"}
+
+        return response_json, self.__classify(status, response_json)
+
+    @staticmethod
+    def __classify(status, response_json):
+        """
+        Returns the kind of error of the given response, or None if it is successful.
+        """
+        if status == 200 and 'generated_text' in response_json:
+            return None
+
+        message = str(response_json.get('error', '')).lower()
+
+        if status == 503 and ('estimated_time' in response_json or 'loading' in message):
+            return HuggingFaceError.LOADING
+        if status == 429 or 'rate limit' in message:
+            return HuggingFaceError.RATE_LIMITED
+        if status >= 500:
+            return HuggingFaceError.SERVER
+        return HuggingFaceError.REQUEST
+
+    def __get_retry_delay(self, attempt, response_json):
+        """
+        Returns the number of seconds to wait before the given retry, with exponential backoff and full jitter.
+
+        A model being loaded is waited for at least the estimated loading time, within the maximum delay.
+        """
+        delay = random.uniform(
+            0, min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt))
+
+        estimated_time = response_json.get('estimated_time')
+        if isinstance(estimated_time, (int, float)):
+            delay = max(delay, min(float(estimated_time), self.retry_max_delay))
+
+        return delay
+
+    def __get_breaker(self, model):
+        """
+        Returns the circuit breaker of the given model, creating it if needed.
+        """
+        breaker = self.breakers.get(model)
+        if breaker is None:
+            breaker = self.breakers[model] = CircuitBreaker(
+                self.breaker_threshold, self.breaker_reset_timeout)
+        return breaker
+
+    def __get_session(self):
+        """
+        Returns the pooled keep-alive HTTP session, creating it if needed.
+        """
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size, keepalive_timeout=60)
+            self.session = aiohttp.ClientSession(
+                connector=connector, timeout=self.timeout)
+        return self.session
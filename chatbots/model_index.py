@@ -0,0 +1,142 @@
+import asyncio
+import bisect
+import difflib
+import logging
+import time
+import utils
+
+logger = logging.getLogger('discord')
+
+
+class ModelIndex:
+    """
+    A class that indexes model names by their normalized form for exact, prefix and fuzzy lookups.
+
+    The index is rebuilt from its loader once its time to live has passed. When the event loop
+    is running, the rebuild happens in a thread and the previous index is served meanwhile.
+    """
+
+    def __init__(self, loader, ttl=300.0):
+        """
+        Initializes a new ModelIndex instance, building the index right away.
+
+        Args:
+            loader: A function without arguments returning the (key, name) pairs of the available models.
+                    It may block, as it is called in a thread once the event loop is running.
+            ttl (float): The number of seconds after which the index is rebuilt.
+        """
+        self.loader = loader
+        self.ttl = ttl
+        self.items = []  # The (key, name) pairs, in the loader's order
+        self.keys_by_name = {}  # Normalized name to key
+        self.names_by_key = {}  # Normalized key to name
+        self.sorted_names = []  # Sorted (normalized name, name) pairs for prefix lookups
+        self.refreshed_at = None
+        self.refresh_future = None
+        self.refresh()
+
+    def refresh(self):
+        """
+        Rebuilds the index from the loader, keeping the previous one if the loader fails.
+        """
+        try:
+            items = list(self.loader())
+        except Exception as e:
+            logger.warning(f"Fail to load models:  {type(e).__name__} - {e}")
+            self.refreshed_at = time.monotonic()
+            return
+
+        keys_by_name = {utils.normalize_text(name): key for key, name in items}
+        names_by_key = {utils.normalize_text(key): name for key, name in items}
+        sorted_names = sorted((utils.normalize_text(name), name)
+                              for key, name in items)
+
+        # Swap the whole index at once, as lookups may run while a thread rebuilds it
+        self.items, self.keys_by_name, self.names_by_key, self.sorted_names = \
+            items, keys_by_name, names_by_key, sorted_names
+        self.refreshed_at = time.monotonic()
+
+    def invalidate(self):
+        """
+        Marks the index as stale, so it is rebuilt on its next use.
+        """
+        self.refreshed_at = None
+
+    def get_key(self, name):
+        """
+        Returns the key of the model with the given name, or None if there isn't any.
+        """
+        self.__refresh_if_stale()
+        return self.keys_by_name.get(utils.normalize_text(name))
+
+    def get_name(self, key):
+        """
+        Returns the name of the model with the given key, or None if there isn't any.
+        """
+        self.__refresh_if_stale()
+        return self.names_by_key.get(utils.normalize_text(key))
+
+    def get_items(self):
+        """
+        Returns the (key, name) pairs of the available models.
+        """
+        self.__refresh_if_stale()
+        return self.items
+
+    def search(self, text, limit=25):
+        """
+        Returns the names of the models best matching the given text.
+
+        Exact matches come first, then names starting with the text, names containing it,
+        and finally names close to it.
+
+        Args:
+            text (str): The text typed so far.
+            limit (int): The maximum number of names to return.
+        """
+        self.__refresh_if_stale()
+        sorted_names = self.sorted_names
+        query = utils.normalize_text(text)
+
+        if not query:
+            return [name for _, name in sorted_names[:limit]]
+
+        matches = []
+
+        # Names starting with the query are adjacent in the sorted names, the exact match first
+        index = bisect.bisect_left(sorted_names, (query,))
+        while index < len(sorted_names) and sorted_names[index][0].startswith(query) and len(matches) < limit:
+            matches.append(sorted_names[index][1])
+            index += 1
+
+        if len(matches) < limit:
+            matches += [name for normalized, name in sorted_names
+                        if query in normalized and not normalized.startswith(query)][:limit - len(matches)]
+
+        if len(matches) < limit:
+            close = difflib.get_close_matches(
+                query, [normalized for normalized, _ in sorted_names], n=limit, cutoff=0.6)
+            found = set(matches)
+            for normalized in close:
+                name = sorted_names[bisect.bisect_left(sorted_names, (normalized,))][1]
+                if name not in found and len(matches) < limit:
+                    matches.append(name)
+                    found.add(name)
+
+        return matches
+
+    def __refresh_if_stale(self):
+        """
+        Rebuilds the index if its time to live has passed, in a thread if the event loop is running.
+        """
+        if self.refreshed_at is not None and time.monotonic() - self.refreshed_at < self.ttl:
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.refresh()
+            return
+
+        if self.refresh_future is None or self.refresh_future.done():
+            self.refresh_future = loop.run_in_executor(None, self.refresh)
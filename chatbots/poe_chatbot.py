@@ -1,21 +1,38 @@
-from chatbots.chatbot import ChatBot
-import poe
+from chatbots.chatbot import ChatBot, QueryTimeoutError
+from chatbots.model_index import ModelIndex
+from chatbots.poe_client_pool import PoeClientPool
+from chatbots.proxy_pool import ProxyPool
+import asyncio
+import logging
+import math
+import time
 import utils
 
+logger = logging.getLogger('discord')
+
 
 class PoeChatBot(ChatBot):
     """
     A class that represents a chatbot that uses poe.com for generating responses.
     """
 
-    def __init__(self, token, model, proxy=None):
+    def __init__(self, token, model, proxy=None, context_per_channel=False, max_concurrency=2, cooldown=60.0, quota_cooldown=3600.0, proxy_probe_interval=60.0, model_index_ttl=300.0):
         """
         Initializes a new ChatBot instance.
 
         Args:
             model (str): The name of the poe model to use.
-            token (str): The token (cookie) to use for accessing poe.com.
-            proxy (str): The proxy to use for connecting to poe.com.
+            token (str or list): The token (cookie) to use for accessing poe.com, or a list or
+                                 comma-separated string of tokens to balance queries across accounts.
+            proxy (str or list): The proxy to use for connecting to poe.com, or a list or comma-separated
+                                 string of proxies to pick the healthiest one from.
+            context_per_channel (bool): Whether to start a new chat whenever the context key changes,
+                                        as poe.com keeps a single chat per bot.
+            max_concurrency (int): The maximum number of queries sent through each account at the same time.
+            cooldown (float): The number of seconds a failing account is taken out of the pool.
+            quota_cooldown (float): The number of seconds an account over its quota is taken out of the pool.
+            proxy_probe_interval (float): The number of seconds between two probes of the proxies.
+            model_index_ttl (float): The number of seconds after which the list of available models is reloaded.
 
         Raises:
             ValueError: If `model` or `token` are empty strings.
@@ -25,18 +42,29 @@ class PoeChatBot(ChatBot):
         if not model:
             raise ValueError("model cannot be an empty string")
 
-        self.token = token
-        self.proxy = proxy if proxy and len(proxy.strip()) > 0 else None
-        self.client = poe.Client(token=self.token, proxy=self.proxy)
+        self.tokens = self.__parse_list(token)
+        self.proxies = self.__parse_list(proxy) if proxy else []
+        self.max_concurrency = max_concurrency
+        self.cooldown = cooldown
+        self.quota_cooldown = quota_cooldown
+        self.proxy_probe_interval = proxy_probe_interval
+        self.proxy_monitor = None  # Background task probing the proxies, started on first query
+        self.closing_pools = set()  # Background tasks closing the pools replaced by a new one
+        self.pool = self.__create_pool()
+        self.models = None
+        self.models = ModelIndex(self.__load_models, model_index_ttl)
         self.model = self.__get_model_key(model)
+        self.context_per_channel = context_per_channel
 
-    async def query(self, input: str, debug=False):
+    async def query(self, input: str, debug=False, context_key=None, deadline=None):
         """
         Queries the Poe with the given input text and returns the generated response.
 
         Args:
             input (str): The user's input text.
             debug (bool): Whether to include debugging information in the response.
+            context_key: The key of the conversation context to use, e.g. (guild id, channel id).
+            deadline (float): The `time.monotonic()` time after which the query is abandoned, or None for no deadline.
 
         Returns:
             A tuple of two values:
@@ -46,6 +74,7 @@ class PoeChatBot(ChatBot):
 
         Raises:
             ValueError: If `input` is an empty string.
+            QueryTimeoutError: If the deadline is exceeded, with the response generated so far.
         """
         if not input:
             raise ValueError("input cannot be an empty string")
@@ -54,15 +83,13 @@ class PoeChatBot(ChatBot):
         generated_text = ""
 
         try:
-            # As client.send_message is a synconous iterator, we need to wrap it in async
-            # iterator to prevent errors like discord.gateway: shard id none heartbeat blocked for more than x seconds
-            ait = utils.async_wrap_iter(
-                self.client.send_message(self.model, input, False))
-            
             # Combine the response chunks into a single string
-            async for chunk in ait:
-                generated_text += chunk["text_new"]
-                
+            async for chunk in self.query_stream(input, debug=debug, context_key=context_key, deadline=deadline):
+                generated_text += chunk
+
+        except QueryTimeoutError as e:
+            raise QueryTimeoutError(str(e), generated_text)
+
         except Exception as e:
             success = False
             error_message = str(e)
@@ -77,7 +104,71 @@ class PoeChatBot(ChatBot):
 
         return success, generated_text
 
-    def change_model(self, new_model):
+    async def query_stream(self, input: str, debug=False, context_key=None, deadline=None):
+        """
+        Queries the Poe with the given input text and yields the generated response in chunks.
+
+        Args:
+            input (str): The user's input text.
+            debug (bool): Whether to include debugging information in the response.
+            context_key: The key of the conversation context to use, e.g. (guild id, channel id).
+            deadline (float): The `time.monotonic()` time after which the query is abandoned, or None for no deadline.
+
+        Yields:
+            str: The next chunk of the generated response text.
+
+        Raises:
+            ValueError: If `input` is an empty string.
+            QueryTimeoutError: If the deadline is exceeded.
+        """
+        if not input:
+            raise ValueError("input cannot be an empty string")
+
+        self.__start_proxy_monitor()
+
+        # The deadline covers the wait for a free client too
+        async with self.pool.acquire(context_key, deadline) as slot:
+            # Don't start reading a response there is no time left for
+            if deadline is not None and deadline - time.monotonic() <= 0:
+                raise QueryTimeoutError("Poe response timed out")
+
+            # Start a new chat if the message comes from another context than the last one
+            with_chat_break = self.context_per_channel and context_key != slot.context_key
+            slot.context_key = context_key
+
+            # As client.send_message is a synconous iterator, we need to wrap it in async
+            # iterator to prevent errors like discord.gateway: shard id none heartbeat blocked for more than x seconds
+            if deadline is None:
+                it = slot.client.send_message(
+                    self.model, input, with_chat_break)
+            else:
+                # Let the client give up on its own too, so the thread reading the response is released
+                timeout = math.ceil(max(deadline - time.monotonic(), 1))
+                it = slot.client.send_message(
+                    self.model, input, with_chat_break, timeout=timeout)
+
+            ait = utils.async_wrap_iter(it)
+
+            try:
+                while True:
+                    if deadline is None:
+                        chunk = await ait.__anext__()
+                    else:
+                        # Cancelling the pending read closes the iterator and stops its thread
+                        chunk = await asyncio.wait_for(ait.__anext__(), deadline - time.monotonic())
+                    yield chunk["text_new"]
+            except StopAsyncIteration:
+                self.pool.report_success(slot)
+                return
+            except asyncio.TimeoutError:
+                raise QueryTimeoutError("Poe response timed out")
+            except Exception as e:
+                self.pool.report_error(slot, e)
+                raise
+            finally:
+                await ait.aclose()
+
+    async def change_model(self, new_model):
         """
         Changes the Hugging Face model used by the chatbot.
 
@@ -94,39 +185,50 @@ class PoeChatBot(ChatBot):
         else:
             return False
 
-    def change_token(self, new_token):
+    async def change_token(self, new_token):
         """
         Changes the API token used by the chatbot.
 
+        The new clients are connected in a thread, then swapped in once ready. Queries in flight
+        finish on the old clients.
+
         Args:
-            new_token (str): The new API token to use.
+            new_token (str or list): The new API token to use, or a list or comma-separated string of tokens.
 
         Returns:
             True if the API was changed successfully.
         """
-        self.token = new_token
-        self.__update_client()
+        await self.__update_client(token=new_token)
         return True
 
-    def change_proxy(self, new_proxy):
+    async def change_proxy(self, new_proxy):
         """
         Changes the proxy used by the chatbot.
 
+        The new clients are connected in a thread, then swapped in once ready. Queries in flight
+        finish on the old clients.
+
         Args:
-            proxy (str): The new proxy to use.
+            proxy (str or list): The new proxy to use, or a list or comma-separated string of proxies.
 
         Returns:
             True if the proxy was changed successfully.
         """
-        self.proxy = new_proxy
-        self.__update_client()
+        await self.__update_client(proxy=new_proxy)
         return True
 
-    def clear_context(self):
+    def clear_context(self, context_key=None):
         """
         Clears the chatbot's context
+
+        As poe.com keeps a single chat per bot, the chat of every account is cleared whatever
+        the context key is.
+
+        Args:
+            context_key: The key of the conversation context to clear, or None to clear all contexts.
         """
-        self.client.send_chat_break(self.model)
+        for slot in self.pool.slots:
+            slot.client.send_chat_break(self.model)
 
     def get_model(self):
         """
@@ -135,36 +237,140 @@ class PoeChatBot(ChatBot):
         return self.__get_model_value(self.model)
 
     def get_available_models(self):
-        return self.client.bot_names.items()
+        return self.models.get_items()
+
+    def search_models(self, text, limit=25):
+        """
+        Returns the names of the available models best matching the given text, for suggestions.
+
+        Args:
+            text (str): The text typed so far.
+            limit (int): The maximum number of names to return.
+        """
+        return self.models.search(text, limit)
 
-    def __update_client(self, token=None, proxy=None):
+    def get_client_stats(self):
         """
-        Updates the Poe client with the provided token and proxy, or the default ones if None.
+        Returns a list of usage statistics, one dictionary per Poe account.
+        """
+        return self.pool.get_stats()
+
+    def get_proxy_stats(self):
+        """
+        Returns a list of health statistics, one dictionary per proxy, or None if no proxy is used.
+        """
+        return self.pool.proxies.get_stats() if self.pool.proxies is not None else None
+
+    async def close(self):
+        """
+        Stops probing the proxies and disconnects the clients once their queries in flight are done.
+        """
+        if self.proxy_monitor is not None:
+            self.proxy_monitor.cancel()
+            self.proxy_monitor = None
+
+        await asyncio.gather(self.pool.close(), *self.closing_pools)
+
+    def __create_pool(self):
+        """
+        Creates a pool of Poe clients from the current tokens and proxies.
+        """
+        return self.__build_pool(self.tokens, self.proxies)
+
+    def __build_pool(self, tokens, proxies):
+        """
+        Creates a pool of Poe clients from the given tokens and proxies, connecting them to poe.com.
+
+        This blocks while the clients connect, so it should run in a thread once the event loop is running.
+        """
+        proxy_pool = ProxyPool(proxies) if proxies else None
+        pool = PoeClientPool(tokens, proxy_pool, self.max_concurrency,
+                             self.cooldown, self.quota_cooldown)
+
+        # Warm up the client used for model lookups, so the swapped pool serves queries right away
+        pool.get_client().bot_names
+        return pool
+
+    def __start_proxy_monitor(self):
+        """
+        Starts probing the proxies in the background if there are several to choose from.
+        """
+        if len(self.proxies) > 1 and (self.proxy_monitor is None or self.proxy_monitor.done()):
+            self.proxy_monitor = asyncio.get_running_loop().create_task(
+                self.__monitor_proxies())
+
+    async def __monitor_proxies(self):
+        """
+        Probes the proxies periodically, moving clients off the degraded ones.
+        """
+        while True:
+            try:
+                if self.pool.proxies is not None:
+                    await self.pool.proxies.probe_all()
+                    await self.pool.fail_over()
+            except Exception as e:
+                logger.warning(
+                    f"Proxy monitor error:  {type(e).__name__} - {e}")
+
+            await asyncio.sleep(self.proxy_probe_interval)
+
+    @staticmethod
+    def __parse_list(value):
+        """
+        Returns the list of values from a value, a list of values or a comma-separated string of values.
+        """
+        if isinstance(value, str):
+            value = value.split(",")
+        return [v.strip() for v in value if v and v.strip()]
+
+    async def __update_client(self, token=None, proxy=None):
+        """
+        Updates the Poe clients with the provided token and proxy, or the current ones if None.
+
+        The new pool is built in a thread and replaces the current one only once all its clients
+        are connected. Queries in flight hold a slot of the old pool and finish on its clients.
 
         Args:
-            token (str): The new token to use for the client. Defaults to None.
-            proxy (str): The new proxy to use for the client. Defaults to None.
+            token (str or list): The new token or tokens to use for the clients. Defaults to None.
+            proxy (str or list): The new proxy or proxies to use for the clients. Defaults to None.
 
         Returns:
             None
 
         """
-        # Set token to default if None
-        if token is None:
-            token = self.token
-        # Otherwise, update the token attribute
-        else:
-            self.token = token
+        tokens = self.__parse_list(token) if token is not None else self.tokens
+        proxies = self.__parse_list(proxy) if proxy is not None else self.proxies
 
-        # Set proxy to default if None
-        if proxy is None:
-            proxy = self.proxy
-        # Otherwise, update the proxy attribute
-        else:
-            self.proxy = proxy
+        # Create new Poe clients off the event loop, as connecting blocks
+        loop = asyncio.get_running_loop()
+        pool = await loop.run_in_executor(None, self.__build_pool, tokens, proxies)
+
+        # Swap the settings and the pool together
+        old_pool = self.pool
+        self.tokens = tokens
+        self.proxies = proxies
+        self.pool = pool
+
+        # Disconnect the old clients in the background, once their queries in flight are done
+        task = loop.create_task(old_pool.close())
+        self.closing_pools.add(task)
+        task.add_done_callback(self.closing_pools.discard)
 
-        # Create a new Poe client with the updated token and proxy
-        self.client = poe.Client(token=token, proxy=proxy)
+        # The new accounts may have other bots available
+        self.models.invalidate()
+
+    def __load_models(self):
+        """
+        Returns the (key, name) pairs of the bots available to the accounts.
+
+        The client only fetches its bots when connecting, so they are fetched again on every later
+        load to find the bots added since. This blocks while fetching, see `ModelIndex`.
+        """
+        client = self.pool.get_client()
+        if self.models is not None:
+            client.bots = client.get_bots()
+            client.bot_names = client.get_bot_names()
+        return client.bot_names.items()
 
     def __get_model_key(self, model_name):
         """
@@ -177,13 +383,7 @@ class PoeChatBot(ChatBot):
             str or None: The key of the model if it exists, or None if it doesn't.
 
         """
-        # Loop through the items in bot_names
-        for key, value in self.get_available_models():
-            # If the value matches the given model_name, return the corresponding key
-            if utils.normalize_text(value) == utils.normalize_text(model_name):
-                return key
-        # If no key matches the given model_name, return None
-        return None
+        return self.models.get_key(model_name)
 
     def __get_model_value(self, model_name):
         """
@@ -196,10 +396,4 @@ class PoeChatBot(ChatBot):
             str or None: The key of the model if it exists, or None if it doesn't.
 
         """
-        # Loop through the items in bot_names
-        for key, value in self.get_available_models():
-            # If the value matches the given model_name, return the corresponding key
-            if utils.normalize_text(key) == utils.normalize_text(model_name):
-                return value
-        # If no key matches the given model_name, return None
-        return None
+        return self.models.get_name(model_name)
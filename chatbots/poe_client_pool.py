@@ -0,0 +1,283 @@
+import asyncio
+import collections
+import contextlib
+import logging
+import poe
+import time
+
+from .chatbot import QueryTimeoutError
+
+logger = logging.getLogger('discord')
+
+# The pools of every chatbot, e.g. of the models bound to guilds, share the limit of each account
+account_loads = collections.Counter()  # Token to the number of queries in flight through the account
+account_released = asyncio.Condition()  # Notified when a query releases its account
+
+
+class PoeClientSlot:
+    """
+    A class that holds a Poe client of the pool with its load and usage counters.
+    """
+
+    def __init__(self, token, proxy=None, max_concurrency=2):
+        """
+        Initializes a new PoeClientSlot instance, connecting its client to poe.com.
+
+        Args:
+            token (str): The token (cookie) to use for accessing poe.com.
+            proxy (str): The proxy to use for connecting to poe.com.
+            max_concurrency (int): The maximum number of queries sent through the client at the same time.
+        """
+        self.token = token
+        self.proxy = proxy
+        self.client = poe.Client(token=token, proxy=proxy)
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.disabled_until = 0.0
+        self.last_error = None
+        self.context_key = None  # The context key of the last query
+
+    def is_healthy(self):
+        """
+        Returns whether the client is not taken out of the pool.
+        """
+        return time.monotonic() >= self.disabled_until
+
+    def get_load(self):
+        """
+        Returns the share of the account's capacity in use, by the queries of every pool.
+        """
+        return account_loads[self.token] / self.max_concurrency
+
+    def has_capacity(self):
+        """
+        Returns whether the account of the client can take another query.
+        """
+        return account_loads[self.token] < self.max_concurrency
+
+
+class PoeClientPool:
+    """
+    A class that balances queries across Poe clients of several accounts.
+
+    Each query goes to the least loaded healthy client. A client is taken out of the pool for
+    a while when it hits its quota or keeps failing.
+    """
+
+    def __init__(self, tokens, proxies=None, max_concurrency=2, cooldown=60.0, quota_cooldown=3600.0, max_consecutive_errors=3):
+        """
+        Initializes a new PoeClientPool instance.
+
+        Args:
+            tokens (list): The tokens (cookies) of the accounts to use.
+            proxies (ProxyPool): The proxies to connect to poe.com through, or None to connect directly.
+            max_concurrency (int): The maximum number of queries sent through each client at the same time.
+            cooldown (float): The number of seconds a failing client is taken out of the pool.
+            quota_cooldown (float): The number of seconds a client over its quota is taken out of the pool.
+            max_consecutive_errors (int): The number of consecutive errors after which a client is taken out.
+
+        Raises:
+            ValueError: If `tokens` is empty or `max_concurrency` is smaller than 1.
+        """
+        if not tokens:
+            raise ValueError("tokens cannot be empty")
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+
+        self.proxies = proxies
+        self.cooldown = cooldown
+        self.quota_cooldown = quota_cooldown
+        self.max_consecutive_errors = max_consecutive_errors
+
+        proxy = proxies.get_best() if proxies is not None else None
+        self.slots = [PoeClientSlot(token, proxy, max_concurrency)
+                      for token in tokens]
+        self.retired = []  # Clients replaced by a fail over, disconnected on close
+        self.condition = account_released
+
+    @contextlib.asynccontextmanager
+    async def acquire(self, affinity=None, deadline=None):
+        """
+        Waits for a healthy client with free capacity and holds it for the duration of the block.
+
+        Args:
+            affinity: A hashable key, e.g. the context key, whose queries preferably go to the same client.
+            deadline (float): The `time.monotonic()` time after which waiting is abandoned, or None for no deadline.
+
+        Yields:
+            PoeClientSlot: The slot of the acquired client.
+
+        Raises:
+            RuntimeError: If every client is taken out of the pool.
+            QueryTimeoutError: If no client is free before the deadline.
+        """
+        async with self.condition:
+            while True:
+                slot = self.__pick(affinity)
+                if slot is not None:
+                    break
+                if not any(slot.is_healthy() for slot in self.slots):
+                    raise RuntimeError("No healthy Poe client available")
+
+                timeout = self.__get_wait_timeout(deadline)
+                if timeout is not None and timeout <= 0:
+                    raise QueryTimeoutError("Timed out waiting for a Poe client")
+                try:
+                    await asyncio.wait_for(self.condition.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass  # Check again, a client may be back from its cooldown
+
+            slot.in_flight += 1
+            account_loads[slot.token] += 1
+            slot.requests += 1
+
+        try:
+            yield slot
+        finally:
+            async with self.condition:
+                slot.in_flight -= 1
+                account_loads[slot.token] -= 1
+                # Wake every waiter, as the query may have taken the client out of the pool,
+                # in which case they all have to find out rather than wait forever
+                self.condition.notify_all()
+
+    def report_success(self, slot):
+        """
+        Records a successful query of the given client.
+        """
+        slot.consecutive_errors = 0
+
+        if self.proxies is not None:
+            self.proxies.record(slot.proxy)
+
+    def report_error(self, slot, error):
+        """
+        Records a failed query of the given client, taking it out of the pool if needed.
+
+        Args:
+            slot (PoeClientSlot): The slot of the failed client.
+            error (Exception): The error raised by the client.
+        """
+        slot.errors += 1
+        slot.consecutive_errors += 1
+        slot.last_error = f"{type(error).__name__} - {error}"
+
+        if self.proxies is not None:
+            self.proxies.record(slot.proxy, error=True)
+
+        # Poe reports exhausted message quotas as errors mentioning the limit
+        if "limit" in str(error).lower():
+            slot.disabled_until = time.monotonic() + self.quota_cooldown
+        elif slot.consecutive_errors >= self.max_consecutive_errors:
+            slot.disabled_until = time.monotonic() + self.cooldown
+            slot.consecutive_errors = 0
+
+    async def fail_over(self):
+        """
+        Moves the clients connected through a degraded proxy to the best one.
+
+        The new client is connected in a thread, then replaces the old one. Queries in flight
+        keep reading their response from the old client.
+        """
+        if self.proxies is None:
+            return
+
+        best = self.proxies.get_best()
+        loop = asyncio.get_running_loop()
+
+        for slot in self.slots:
+            if slot.proxy == best or not self.proxies.is_degraded(slot.proxy):
+                continue
+
+            try:
+                client = await loop.run_in_executor(None, lambda: poe.Client(token=slot.token, proxy=best))
+            except Exception:
+                self.proxies.record(best, error=True)
+                continue
+
+            self.retired.append(slot.client)
+            slot.client = client
+            slot.proxy = best
+
+    async def close(self):
+        """
+        Disconnects the clients from poe.com once the queries in flight are done.
+        """
+        async with self.condition:
+            await self.condition.wait_for(lambda: all(slot.in_flight == 0 for slot in self.slots))
+
+        clients = [slot.client for slot in self.slots] + self.retired
+        self.retired = []
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.__disconnect, clients)
+
+    def get_client(self):
+        """
+        Returns the client of the first healthy slot, or of the first slot if none is healthy.
+        """
+        for slot in self.slots:
+            if slot.is_healthy():
+                return slot.client
+        return self.slots[0].client
+
+    def get_stats(self):
+        """
+        Returns a list of usage statistics, one dictionary per client.
+        """
+        now = time.monotonic()
+        return [
+            {
+                "account": f"...{slot.token[-4:]}",
+                "proxy": slot.proxy,
+                "healthy": slot.is_healthy(),
+                "disabled_for": max(slot.disabled_until - now, 0.0),
+                "in_flight": slot.in_flight,
+                "requests": slot.requests,
+                "errors": slot.errors,
+                "last_error": slot.last_error,
+            }
+            for slot in self.slots
+        ]
+
+    @staticmethod
+    def __disconnect(clients):
+        """
+        Closes the websocket of the given clients, logging the errors so every client is closed.
+        """
+        for client in clients:
+            try:
+                client.disconnect_ws()
+            except Exception as e:
+                logger.warning(
+                    f"Poe client disconnect error:  {type(e).__name__} - {e}")
+
+    def __get_wait_timeout(self, deadline=None):
+        """
+        Returns the number of seconds to wait for a client, until the deadline or until the next client
+        is back from its cooldown, whichever comes first, or None to wait for a released client only.
+        """
+        now = time.monotonic()
+        timeouts = [slot.disabled_until - now for slot in self.slots if not slot.is_healthy()]
+        if deadline is not None:
+            timeouts.append(deadline - now)
+        return min(timeouts) if timeouts else None
+
+    def __pick(self, affinity=None):
+        """
+        Returns the healthy slot with free capacity to use, or None if there isn't any.
+        """
+        candidates = [slot for slot in self.slots
+                      if slot.is_healthy() and slot.has_capacity()]
+        if not candidates:
+            return None
+
+        # Keep a conversation on the same account when possible, as the chat lives there
+        if affinity is not None:
+            preferred = self.slots[hash(affinity) % len(self.slots)]
+            if preferred in candidates:
+                return preferred
+
+        return min(candidates, key=lambda slot: slot.get_load())
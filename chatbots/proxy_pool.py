@@ -0,0 +1,147 @@
+import asyncio
+import time
+import urllib.parse
+
+
+class ProxyStats:
+    """
+    A class that holds the health of a proxy as exponentially weighted moving averages.
+    """
+
+    def __init__(self, url):
+        """
+        Initializes a new ProxyStats instance.
+
+        Args:
+            url (str): The URL of the proxy.
+        """
+        self.url = url
+        self.latency = None  # EWMA of the latency in seconds, None until measured
+        self.error_rate = 0.0  # EWMA of the error rate, from 0 to 1
+        self.samples = 0
+
+
+class ProxyPool:
+    """
+    A class that scores proxies by latency and error rate to pick the best one for new connections.
+
+    Proxies are scored from the connection latency measured by probes, inflated by the error
+    rate observed by both probes and real queries.
+    """
+
+    DEFAULT_PORTS = {"http": 80, "https": 443, "socks4": 1080,
+                     "socks5": 1080, "socks5h": 1080}
+
+    def __init__(self, proxies, alpha=0.3, probe_timeout=5.0, error_penalty=10.0, degraded_error_rate=0.5, degraded_latency_factor=3.0):
+        """
+        Initializes a new ProxyPool instance.
+
+        Args:
+            proxies (list): The URLs of the proxies.
+            alpha (float): The weight of the newest sample in the moving averages.
+            probe_timeout (float): The number of seconds after which a probe counts as failed.
+            error_penalty (float): How much the error rate inflates the latency in the score.
+            degraded_error_rate (float): The error rate above which a proxy is degraded.
+            degraded_latency_factor (float): How many times slower than the best proxy a proxy is degraded.
+
+        Raises:
+            ValueError: If `proxies` is empty.
+        """
+        if not proxies:
+            raise ValueError("proxies cannot be empty")
+
+        self.alpha = alpha
+        self.probe_timeout = probe_timeout
+        self.error_penalty = error_penalty
+        self.degraded_error_rate = degraded_error_rate
+        self.degraded_latency_factor = degraded_latency_factor
+        self.stats = {url: ProxyStats(url) for url in proxies}
+
+    def record(self, url, latency=None, error=False):
+        """
+        Records the outcome of a probe or a query sent through the given proxy.
+
+        Args:
+            url (str): The URL of the proxy.
+            latency (float): The connection latency measured by a probe in seconds, None for queries.
+            error (bool): Whether the probe or query failed.
+        """
+        stats = self.stats.get(url)
+        if stats is None:
+            return
+
+        stats.samples += 1
+        stats.error_rate += self.alpha * \
+            ((1.0 if error else 0.0) - stats.error_rate)
+
+        if latency is not None:
+            if stats.latency is None:
+                stats.latency = latency
+            else:
+                stats.latency += self.alpha * (latency - stats.latency)
+
+    def get_score(self, url):
+        """
+        Returns the score of the given proxy, lower is better.
+        """
+        stats = self.stats[url]
+        latency = stats.latency if stats.latency is not None else self.probe_timeout
+        return latency * (1 + self.error_penalty * stats.error_rate)
+
+    def get_best(self):
+        """
+        Returns the URL of the proxy with the best score.
+        """
+        return min(self.stats, key=self.get_score)
+
+    def is_degraded(self, url):
+        """
+        Returns whether the given proxy fails too often or is much slower than the best one.
+        """
+        stats = self.stats.get(url)
+        if stats is None:
+            return False
+        if stats.error_rate > self.degraded_error_rate:
+            return True
+
+        best_score = self.get_score(self.get_best())
+        return self.get_score(url) > best_score * self.degraded_latency_factor
+
+    async def probe_all(self):
+        """
+        Measures the connection latency of every proxy at the same time.
+        """
+        await asyncio.gather(*(self.__probe(url) for url in self.stats))
+
+    def get_stats(self):
+        """
+        Returns a list of health statistics, one dictionary per proxy.
+        """
+        return [
+            {
+                "proxy": url,
+                "latency": stats.latency,
+                "error_rate": stats.error_rate,
+                "score": self.get_score(url),
+                "samples": stats.samples,
+            }
+            for url, stats in self.stats.items()
+        ]
+
+    async def __probe(self, url):
+        """
+        Measures how long it takes to open a connection to the given proxy.
+        """
+        parts = urllib.parse.urlsplit(url if "://" in url else f"http://{url}")
+        port = parts.port or self.DEFAULT_PORTS.get(parts.scheme, 80)
+
+        start = time.monotonic()
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(parts.hostname, port), self.probe_timeout)
+            writer.close()
+            await writer.wait_closed()
+        except (OSError, asyncio.TimeoutError):
+            self.record(url, error=True)
+            return
+
+        self.record(url, latency=time.monotonic() - start)
@@ -1,18 +1,42 @@
+import copy
 import json
 import logging
 import os
 from dotenv import load_dotenv
+from config_store import SqliteConfigStore, apply_config_changes, diff_config
+from write_behind import WriteBehind, write_file_atomically
 
 # Constants
 CONFIG_FILE = "config.json"
 DEFAULT_CONFIG = {
     "nicknames": {},
     "channel_whitelist": [],
-    "channel_blacklist": []
+    "channel_blacklist": [],
+    "response_cache_blacklist": [],
+    "bot_bindings": {
+        "guilds": {},  # Guild id to the bot and model its channels use
+        "channels": {}  # Channel id to the bot and model it uses, overriding its guild
+    },
+    "rate_limits": {
+        "user_rate": 0,  # Tokens per second, 0 to disable
+        "user_burst": 5,
+        "channel_rate": 0,
+        "channel_burst": 10,
+        "guild_rate": 0,
+        "guild_burst": 30,
+        "shed_threshold": 0,  # Pending queries above which new ones are shed, 0 to disable
+        "shed_mode": "reply",  # drop, defer or reply
+        "shed_max_defer": 10.0
+    }
 }
 
+# Keys applied when config.json is edited while running
+RELOADABLE_KEYS = ("nicknames", "channel_whitelist", "channel_blacklist",
+                   "response_cache_blacklist", "bot_bindings")
+
 # Initialize variables
 data = {}
+file_content = None  # config.json as last read or written, to tell external edits from ours
 
 # Load environment variables from .env file
 load_dotenv()
@@ -20,14 +44,33 @@ load_dotenv()
 
 def load_config():
     """
-    Load configuration from JSON file
+    Load configuration from JSON file, or from SQLite database if CONFIG_BACKEND is sqlite
     """
-    global data
-    # Check if the config file exists
-    if os.path.exists(CONFIG_FILE):
-        with open(CONFIG_FILE, "r") as f:
-            data = json.load(f)
-            return True
+    global data, file_content
+    if store is not None:
+        # Copy the existing JSON file into the database the first time it is used
+        store.migrate_json(CONFIG_FILE)
+        exists = not store.is_empty()
+        if exists:
+            data = store.load()
+    else:
+        exists = os.path.exists(CONFIG_FILE)
+        if exists:
+            with open(CONFIG_FILE, "r") as f:
+                file_content = f.read()
+            data = json.loads(file_content)
+
+    # Check if the config exists
+    if exists:
+        # Fill in keys added after the config file was created
+        for key, value in DEFAULT_CONFIG.items():
+            if key not in data:
+                data[key] = copy.deepcopy(value)
+            elif isinstance(value, dict) and key != "nicknames":
+                for sub_key, sub_value in value.items():
+                    data[key].setdefault(sub_key, copy.deepcopy(sub_value))
+
+        return True
     else:
         # If the config file doesn't exist, create a new one with default values
         reset_config()
@@ -36,10 +79,118 @@ def load_config():
 
 def save_config():
     """
-    Save configuration to JSON file
+    Save configuration, after CONFIG_SAVE_DELAY seconds so consecutive changes are written once
+    """
+    writer.schedule(serialize_config)
+
+
+def flush_config():
+    """
+    Write the pending configuration changes right away, e.g. on shutdown
+    """
+    writer.flush()
+
+
+def serialize_config():
+    """
+    Return what the writer saves: the JSON text, or a copy of the configuration for SQLite database
     """
-    with open(CONFIG_FILE, "w") as f:
-        json.dump(data, f)
+    if store is not None:
+        return copy.deepcopy(data)
+    return json.dumps(data)
+
+
+def write_config_file(content):
+    """
+    Replace JSON file with the given content atomically
+    """
+    global file_content
+    write_file_atomically(CONFIG_FILE, content)
+    file_content = content
+
+
+def reload_config():
+    """
+    Reload nicknames, channel lists and bot bindings after an external edit of JSON file, or after another process
+    changed SQLite database, applying only what the edit changed
+
+    The edit is compared with the config as last read or written, so changes made by commands in the
+    meantime are kept, and the bot's own writes change nothing.
+
+    Returns:
+        dict: The changes by key, each with the "added" and "removed" entries, empty if nothing changed
+
+    Raises:
+        ValueError: If the file is not a valid configuration, nothing is applied then
+    """
+    global file_content
+    if store is not None:
+        # Wait for the pending changes to be saved, as saving a copy taken before the reload would undo it.
+        # The changes of other processes still show once saved, as saving doesn't catch up with them
+        if writer.is_dirty():
+            return {}
+        with writer.lock:
+            if not store.has_external_changes():
+                return {}
+            old, new = store.reload(RELOADABLE_KEYS)
+        content = None
+    else:
+        with open(CONFIG_FILE, "r") as f:
+            content = f.read()
+        if content == file_content:
+            return {}
+
+        try:
+            new = json.loads(content)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"invalid JSON: {e}")
+        old = json.loads(file_content) if file_content else {}
+    validate_config(new)
+
+    changes = diff_config(old, new, RELOADABLE_KEYS)
+
+    # Apply all the changes at once, nothing else runs on the event loop meanwhile
+    apply_config_changes(data, changes)
+
+    if content is not None:
+        file_content = content
+    return changes
+
+
+def validate_config(new):
+    """
+    Raise ValueError if the reloadable keys of the given configuration have the wrong shape
+    """
+    if not isinstance(new, dict):
+        raise ValueError("the configuration is not an object")
+
+    nicknames = new.get("nicknames", {})
+    if not isinstance(nicknames, dict) or not all(
+            isinstance(user_id, str) and user_id.isdigit() and isinstance(nickname, str)
+            for user_id, nickname in nicknames.items()):
+        raise ValueError("nicknames must map user ids to names")
+
+    for key in ("channel_whitelist", "channel_blacklist", "response_cache_blacklist"):
+        channels = new.get(key, [])
+        if not isinstance(channels, list) or not all(
+                isinstance(channel_id, str) and channel_id.isdigit() for channel_id in channels):
+            raise ValueError(f"{key} must be a list of channel ids")
+
+    bot_bindings = new.get("bot_bindings", {})
+    if not isinstance(bot_bindings, dict) or not all(
+            isinstance(bindings, dict) and all(
+                isinstance(target_id, str) and target_id.isdigit()
+                and isinstance(binding, dict) and isinstance(binding.get("bot"), str)
+                for target_id, binding in bindings.items())
+            for bindings in bot_bindings.values()):
+        raise ValueError("bot_bindings must map server and channel ids to a bot and model")
+
+
+def get_config_location():
+    """
+    Return the file the configuration is saved to
+    """
+    return store.path if store is not None else CONFIG_FILE
 
 
 def reset_config():
@@ -47,7 +198,7 @@ def reset_config():
     Reset configuration to default
     """
     global data
-    data = DEFAULT_CONFIG
+    data = copy.deepcopy(DEFAULT_CONFIG)
     save_config()
 
 
@@ -58,10 +209,102 @@ DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
 POE_TOKEN = os.getenv("POE_TOKEN")
 POE_MODEL = os.getenv("POE_MODEL")
 POE_PROXY = os.getenv("POE_PROXY")
+POE_TIMEOUT = float(os.getenv("POE_TIMEOUT", 120))
+POE_MAX_CONCURRENCY = int(os.getenv("POE_MAX_CONCURRENCY", 2))
+POE_COOLDOWN = float(os.getenv("POE_COOLDOWN", 60))
+POE_QUOTA_COOLDOWN = float(os.getenv("POE_QUOTA_COOLDOWN", 3600))
+POE_PROXY_PROBE_INTERVAL = float(os.getenv("POE_PROXY_PROBE_INTERVAL", 60))
+POE_MODEL_INDEX_TTL = float(os.getenv("POE_MODEL_INDEX_TTL", 300))
+POE_CONTEXT_PER_CHANNEL = os.getenv(
+    "POE_CONTEXT_PER_CHANNEL", "false").lower() in ("true", "1", "t")
 
 # Load Hugging Face settings from environment variables
 HUGGING_FACE_TOKEN = os.getenv("HUGGING_FACE_TOKEN")
 HUGGING_FACE_MODEL = os.getenv("HUGGING_FACE_MODEL")
+HUGGING_FACE_POOL_SIZE = int(os.getenv("HUGGING_FACE_POOL_SIZE", 16))
+HUGGING_FACE_TIMEOUT = float(os.getenv("HUGGING_FACE_TIMEOUT", 120))
+HUGGING_FACE_CONTEXT_MAX_CHARS = int(
+    os.getenv("HUGGING_FACE_CONTEXT_MAX_CHARS", 4000))
+HUGGING_FACE_CONTEXT_SUMMARIZE = os.getenv(
+    "HUGGING_FACE_CONTEXT_SUMMARIZE", "false").lower() in ("true", "1", "t")
+HUGGING_FACE_MAX_RETRIES = int(os.getenv("HUGGING_FACE_MAX_RETRIES", 3))
+HUGGING_FACE_RETRY_MAX_DELAY = float(
+    os.getenv("HUGGING_FACE_RETRY_MAX_DELAY", 30))
+HUGGING_FACE_BREAKER_THRESHOLD = int(
+    os.getenv("HUGGING_FACE_BREAKER_THRESHOLD", 5))
+HUGGING_FACE_BREAKER_RESET_TIMEOUT = float(
+    os.getenv("HUGGING_FACE_BREAKER_RESET_TIMEOUT", 60))
+HUGGING_FACE_WAIT_FOR_MODEL = os.getenv(
+    "HUGGING_FACE_WAIT_FOR_MODEL", "false").lower() in ("true", "1", "t")
+
+# Load keep warm settings from environment variables
+KEEP_WARM_ENABLED = os.getenv(
+    "KEEP_WARM_ENABLED", "false").lower() in ("true", "1", "t")
+KEEP_WARM_MIN_INTERVAL = float(os.getenv("KEEP_WARM_MIN_INTERVAL", 60))
+KEEP_WARM_MAX_INTERVAL = float(os.getenv("KEEP_WARM_MAX_INTERVAL", 600))
+KEEP_WARM_IDLE_TIMEOUT = float(os.getenv("KEEP_WARM_IDLE_TIMEOUT", 1800))
+
+# Load context settings from environment variables
+CONTEXT_STORE_MAX_CHARS = int(os.getenv("CONTEXT_STORE_MAX_CHARS", 16_000_000))
+
+# Load response cache settings from environment variables
+RESPONSE_CACHE_ENABLED = os.getenv(
+    "RESPONSE_CACHE_ENABLED", "false").lower() in ("true", "1", "t")
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 1000))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 300))
+
+# Load single flight settings from environment variables
+SINGLE_FLIGHT_ENABLED = os.getenv(
+    "SINGLE_FLIGHT_ENABLED", "true").lower() in ("true", "1", "t")
+
+# Load dispatcher settings from environment variables
+DISPATCHER_MAX_WORKERS = int(os.getenv("DISPATCHER_MAX_WORKERS", 8))
+DISPATCHER_MAX_IN_FLIGHT_PER_BACKEND = int(
+    os.getenv("DISPATCHER_MAX_IN_FLIGHT_PER_BACKEND", 4))
+DISPATCHER_PRIORITY_AGING = float(os.getenv("DISPATCHER_PRIORITY_AGING", 10))
+
+# Load async iterator bridge settings from environment variables
+ASYNC_ITER_MAX_WORKERS = int(os.getenv("ASYNC_ITER_MAX_WORKERS", 16))
+ASYNC_ITER_BUFFER_SIZE = int(os.getenv("ASYNC_ITER_BUFFER_SIZE", 64))
+
+# Load streaming settings from environment variables
+STREAMING_ENABLED = os.getenv(
+    "STREAMING_ENABLED", "false").lower() in ("true", "1", "t")
+STREAMING_EDIT_INTERVAL_MS = int(os.getenv("STREAMING_EDIT_INTERVAL_MS", 1000))
+STREAMING_EDIT_CHARS = int(os.getenv("STREAMING_EDIT_CHARS", 500))
+
+# Load router settings from environment variables
+ROUTER_ENABLED = os.getenv(
+    "ROUTER_ENABLED", "false").lower() in ("true", "1", "t")
+ROUTER_POLICY = os.getenv("ROUTER_POLICY", "primary").lower()
+ROUTER_WEIGHTS = {
+    name.strip(): float(weight)
+    for name, weight in (item.split(":") for item in os.getenv("ROUTER_WEIGHTS", "").split(",") if ":" in item)
+}
+ROUTER_FAILOVER_TIMEOUT = float(os.getenv("ROUTER_FAILOVER_TIMEOUT", 30))
+ROUTER_MAX_ERROR_RATE = float(os.getenv("ROUTER_MAX_ERROR_RATE", 0.5))
+
+# Load hedging settings from environment variables
+HEDGING_ENABLED = os.getenv(
+    "HEDGING_ENABLED", "false").lower() in ("true", "1", "t")
+HEDGING_PERCENTILE = float(os.getenv("HEDGING_PERCENTILE", 95))
+HEDGING_MAX_RATIO = float(os.getenv("HEDGING_MAX_RATIO", 0.1))
+
+# Load config persistence settings from environment variables
+CONFIG_SAVE_DELAY = float(os.getenv("CONFIG_SAVE_DELAY", 1))
+CONFIG_BACKEND = os.getenv("CONFIG_BACKEND", "json").lower()
+CONFIG_DB_FILE = os.getenv("CONFIG_DB_FILE", "config.db")
+CONFIG_RELOAD_ENABLED = os.getenv(
+    "CONFIG_RELOAD_ENABLED", "false").lower() in ("true", "1", "t")
+CONFIG_RELOAD_POLL_INTERVAL = float(
+    os.getenv("CONFIG_RELOAD_POLL_INTERVAL", 5))
+
+# Load sharding settings from environment variables
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", 0))
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", 1))
+SHARD_RESTART_DELAY = float(os.getenv("SHARD_RESTART_DELAY", 5))
+SHARD_IDS = [int(shard_id) for shard_id in os.getenv(
+    "SHARD_IDS", "").split(",") if shard_id.strip()]  # Set by the supervisor for each worker
 
 # Load development setting from environment variables
 DEBUG = os.getenv("DEBUG", "false").lower() in ("true", "1", "t")
@@ -76,3 +319,11 @@ if POE_TOKEN == "[TOKEN HERE]":
 
 if HUGGING_FACE_TOKEN == "[TOKEN HERE]":
     HUGGING_FACE_TOKEN = ""
+
+# Writes the config in the background, replacing config.json atomically or updating the changed rows of the database
+if CONFIG_BACKEND == "sqlite":
+    store = SqliteConfigStore(CONFIG_DB_FILE)
+    writer = WriteBehind(store.save, CONFIG_SAVE_DELAY)
+else:
+    store = None
+    writer = WriteBehind(write_config_file, CONFIG_SAVE_DELAY)
@@ -0,0 +1,284 @@
+import copy
+import json
+import logging
+import os
+import sqlite3
+
+logger = logging.getLogger('discord')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nicknames (
+    user_id TEXT PRIMARY KEY,
+    nickname TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS channel_lists (
+    list TEXT NOT NULL,
+    channel_id TEXT NOT NULL,
+    PRIMARY KEY (list, channel_id)
+);
+CREATE INDEX IF NOT EXISTS channel_lists_channel_id ON channel_lists (channel_id);
+CREATE TABLE IF NOT EXISTS bot_bindings (
+    scope TEXT NOT NULL,
+    target_id TEXT NOT NULL,
+    bot TEXT NOT NULL,
+    model TEXT,
+    PRIMARY KEY (scope, target_id)
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+CHANNEL_LISTS = ("channel_whitelist", "channel_blacklist",
+                 "response_cache_blacklist")
+TABLE_KEYS = {"nicknames", "bot_bindings", *CHANNEL_LISTS}  # Keys stored in their own table
+SCHEMA_VERSION_KEY = "schema_version"
+
+
+def diff_config(old, new, keys):
+    """
+    Returns the changes of the given keys between two configurations.
+
+    Nicknames and bot bindings are compared by user id and by scope and target id, the channel lists
+    by channel id.
+
+    Args:
+        old (dict): The configuration as last loaded or saved.
+        new (dict): The configuration to compare it with.
+        keys (tuple): The keys to compare, the ones missing from the new configuration are skipped.
+
+    Returns:
+        dict: The changes by key, each with the "added" and "removed" entries, empty if nothing changed.
+        The bot bindings are keyed by `(scope, target id)` tuples.
+    """
+    changes = {}
+    for key in keys:
+        if key not in new:
+            continue
+        if key in ("nicknames", "bot_bindings"):
+            old_items = old.get(key, {})
+            new_items = new[key]
+            if key == "bot_bindings":
+                old_items = flatten_bindings(old_items)
+                new_items = flatten_bindings(new_items)
+            added = {item_id: value for item_id, value in new_items.items()
+                     if old_items.get(item_id) != value}
+            removed = [item_id for item_id in old_items if item_id not in new_items]
+        else:
+            added = [item for item in new[key] if item not in old.get(key, [])]
+            removed = [item for item in old.get(key, []) if item not in new[key]]
+        if added or removed:
+            changes[key] = {"added": added, "removed": removed}
+    return changes
+
+
+def apply_config_changes(data, changes):
+    """
+    Applies the changes returned by `diff_config` to the given configuration.
+    """
+    for key, change in changes.items():
+        if key == "nicknames":
+            data[key].update(change["added"])
+            for user_id in change["removed"]:
+                data[key].pop(user_id, None)
+        elif key == "bot_bindings":
+            for (scope, target_id), binding in change["added"].items():
+                data[key].setdefault(scope, {})[target_id] = binding.copy()
+            for scope, target_id in change["removed"]:
+                data[key].get(scope, {}).pop(target_id, None)
+        else:
+            data[key] += [item for item in change["added"] if item not in data[key]]
+            data[key][:] = [item for item in data[key] if item not in change["removed"]]
+
+
+def flatten_bindings(bot_bindings):
+    """
+    Returns the bot bindings keyed by `(scope, target id)` tuples.
+    """
+    return {(scope, target_id): binding
+            for scope, bindings in bot_bindings.items() for target_id, binding in bindings.items()}
+
+
+class SqliteConfigStore:
+    """
+    A class that keeps the configuration in a SQLite database instead of a JSON file.
+
+    The configuration is read and written in the same shape as the JSON file. Saving compares it
+    with the last saved one and only upserts or deletes the rows that changed, so a change costs
+    the same however many guilds, channels and users are configured.
+    """
+
+    def __init__(self, path):
+        """
+        Initializes a new SqliteConfigStore instance, creating the database if needed.
+
+        Args:
+            path (str): The path of the database file.
+        """
+        self.path = path
+        # Saves run in a thread, never two at once
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+        self.saved = {}  # The configuration as last loaded or saved
+        self.data_version = None  # Changes when another connection commits
+
+    def is_empty(self):
+        """
+        Returns whether nothing has been saved to the database yet.
+        """
+        return self.connection.execute("SELECT 1 FROM settings LIMIT 1").fetchone() is None
+
+    def load(self):
+        """
+        Returns the configuration stored in the database.
+        """
+        data = {
+            "nicknames": dict(self.connection.execute("SELECT user_id, nickname FROM nicknames")),
+            "bot_bindings": {"guilds": {}, "channels": {}},
+        }
+
+        for name in CHANNEL_LISTS:
+            data[name] = []
+        for name, channel_id in self.connection.execute("SELECT list, channel_id FROM channel_lists ORDER BY rowid"):
+            data.setdefault(name, []).append(channel_id)
+
+        for scope, target_id, bot, model in self.connection.execute("SELECT scope, target_id, bot, model FROM bot_bindings"):
+            data["bot_bindings"].setdefault(scope, {})[target_id] = {
+                "bot": bot, "model": model}
+
+        for key, value in self.connection.execute("SELECT key, value FROM settings WHERE key != ?", (SCHEMA_VERSION_KEY,)):
+            data[key] = json.loads(value)
+
+        self.saved = copy.deepcopy(data)
+        self.data_version = self.__get_data_version()
+        return data
+
+    def reload(self, keys):
+        """
+        Loads the configuration changed by another connection, e.g. another process, for the given keys.
+
+        Only the given keys are taken as saved from the database, the others keep their last loaded or
+        saved value. The caller merges the given keys into its configuration, so a later save never
+        deletes the rows of the other keys it doesn't know about.
+
+        Args:
+            keys (tuple): The keys the caller merges into its configuration.
+
+        Returns:
+            A tuple of two values:
+            - old (dict): The configuration as last loaded or saved.
+            - new (dict): The configuration stored in the database.
+        """
+        old = self.saved
+        new = self.load()
+        merged = copy.deepcopy(old)
+        for key in keys:
+            if key in new:
+                merged[key] = copy.deepcopy(new[key])
+        self.saved = merged
+        return old, new
+
+    def has_external_changes(self):
+        """
+        Returns whether another connection, e.g. another process, changed the database since it was last loaded.
+        """
+        return self.data_version is not None and self.__get_data_version() != self.data_version
+
+    def save(self, data):
+        """
+        Writes the changes of the configuration since it was last loaded or saved, in one transaction.
+
+        Args:
+            data (dict): A copy of the configuration, not modified while it is saved.
+        """
+        saved = self.saved
+
+        with self.connection:
+            old_nicknames = saved.get("nicknames", {})
+            new_nicknames = data.get("nicknames", {})
+            self.connection.executemany(
+                "DELETE FROM nicknames WHERE user_id = ?",
+                [(user_id,) for user_id in old_nicknames if user_id not in new_nicknames])
+            self.connection.executemany(
+                "INSERT INTO nicknames (user_id, nickname) VALUES (?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET nickname = excluded.nickname",
+                [(user_id, nickname) for user_id, nickname in new_nicknames.items()
+                 if old_nicknames.get(user_id) != nickname])
+
+            for name in CHANNEL_LISTS:
+                old_channels = set(saved.get(name, []))
+                new_channels = data.get(name, [])
+                self.connection.executemany(
+                    "DELETE FROM channel_lists WHERE list = ? AND channel_id = ?",
+                    [(name, channel_id) for channel_id in old_channels - set(new_channels)])
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO channel_lists (list, channel_id) VALUES (?, ?)",
+                    [(name, channel_id) for channel_id in new_channels if channel_id not in old_channels])
+
+            old_bindings = saved.get("bot_bindings", {})
+            for scope, bindings in data.get("bot_bindings", {}).items():
+                old_scope = old_bindings.get(scope, {})
+                self.connection.executemany(
+                    "DELETE FROM bot_bindings WHERE scope = ? AND target_id = ?",
+                    [(scope, target_id) for target_id in old_scope if target_id not in bindings])
+                self.connection.executemany(
+                    "INSERT INTO bot_bindings (scope, target_id, bot, model) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (scope, target_id) DO UPDATE SET bot = excluded.bot, model = excluded.model",
+                    [(scope, target_id, binding["bot"], binding.get("model")) for target_id, binding in bindings.items()
+                     if old_scope.get(target_id) != binding])
+
+            # Anything else, e.g. the rate limits, is a small JSON value per key
+            self.connection.executemany(
+                "DELETE FROM settings WHERE key = ?",
+                [(key,) for key in set(saved) - set(data) - TABLE_KEYS])
+            self.connection.executemany(
+                "INSERT INTO settings (key, value) VALUES (?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                [(key, json.dumps(value)) for key, value in data.items()
+                 if key not in TABLE_KEYS and saved.get(key) != value])
+
+            # Marks the database as initialized, even without any other setting
+            self.connection.execute(
+                "INSERT OR IGNORE INTO settings (key, value) VALUES (?, '1')", (SCHEMA_VERSION_KEY,))
+
+        self.saved = data
+        # Own commits don't change the version, so the changes other connections made before still show
+        if self.data_version is None:
+            self.data_version = self.__get_data_version()
+
+    def migrate_json(self, json_path):
+        """
+        Copies the configuration of a JSON file into the database, if the database is still empty.
+
+        The JSON file is kept as is, so going back to it only loses the changes made since.
+
+        Args:
+            json_path (str): The path of the JSON file.
+
+        Returns:
+            bool: Whether the configuration has been migrated.
+        """
+        if not self.is_empty() or not os.path.exists(json_path):
+            return False
+
+        with open(json_path, "r") as f:
+            data = json.load(f)
+
+        self.save(data)
+        logger.info(f"Migrated config file {json_path} to {self.path}")
+        return True
+
+    def close(self):
+        """
+        Closes the database.
+        """
+        self.connection.close()
+
+    def __get_data_version(self):
+        """
+        Returns the version of the database, which only changes on commits of other connections.
+        """
+        return self.connection.execute("PRAGMA data_version").fetchone()[0]
@@ -0,0 +1,221 @@
+import asyncio
+import collections
+import heapq
+import itertools
+import logging
+import time
+
+from enum import Enum
+
+logger = logging.getLogger('discord')
+
+
+class Priority(Enum):
+    INTERACTION = 0  # Slash commands with a user waiting for the followup
+    MONITORED = 1  # Messages in monitored channels
+
+
+class PrioritySemaphore:
+    """
+    A class that implements a semaphore whose waiters are woken up in order of score, lowest first.
+    """
+
+    def __init__(self, value: int):
+        """
+        Initializes a new PrioritySemaphore instance.
+
+        Args:
+            value (int): The number of slots.
+        """
+        self.value = value
+        self.waiters = []  # Heap of (score, sequence, future)
+        self.sequence = itertools.count()
+
+    async def acquire(self, score: float):
+        """
+        Waits for a free slot and takes it.
+
+        Args:
+            score (float): The score of the waiter, waiters with a lower score are served first.
+        """
+        if self.value > 0 and not self.waiters:
+            self.value -= 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (score, next(self.sequence), future))
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Hand the slot over if it was given right before the cancellation
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        """
+        Gives the slot to the waiter with the lowest score, or frees it if nobody is waiting.
+        """
+        while self.waiters:
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+
+        self.value += 1
+
+
+class QueryDispatcher:
+    """
+    A class that dispatches queries through one FIFO queue per channel.
+
+    Queries sent to the same channel are processed strictly in order, while different
+    channels are processed concurrently by a bounded pool of workers. The number of
+    queries in flight against each backend is bounded as well.
+
+    When slots are contended, interactions are served before monitored messages. A query
+    waiting for `aging` seconds longer than another one outranks it whatever its priority,
+    so monitored messages are not starved.
+    """
+
+    def __init__(self, max_workers=8, max_in_flight_per_backend=4, aging=10.0):
+        """
+        Initializes a new QueryDispatcher instance.
+
+        Args:
+            max_workers (int): The maximum number of channels processed at the same time.
+            max_in_flight_per_backend (int): The maximum number of queries in flight per backend.
+            aging (float): The number of seconds of waiting that make up for one priority level.
+
+        Raises:
+            ValueError: If `max_workers` or `max_in_flight_per_backend` is smaller than 1.
+        """
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+        if max_in_flight_per_backend < 1:
+            raise ValueError("max_in_flight_per_backend must be at least 1")
+
+        self.max_workers = max_workers
+        self.max_in_flight_per_backend = max_in_flight_per_backend
+        self.aging = aging
+        self.queues = {}  # Pending jobs per channel
+        self.workers = {}  # Running worker task per channel
+        self.worker_slots = PrioritySemaphore(max_workers)
+        self.backend_slots = {}  # Semaphore per backend
+        self.dispatched = {priority: 0 for priority in Priority}
+        self.total_wait = {priority: 0.0 for priority in Priority}
+
+    async def submit(self, channel_id, backend, func, priority=Priority.MONITORED):
+        """
+        Queues a query for the given channel and waits for its result.
+
+        Args:
+            channel_id: The key of the channel queue, usually the Discord channel id.
+            backend (str): The backend the query is sent to.
+            func: A coroutine function without arguments that performs the query.
+            priority (Priority): The priority class of the query.
+
+        Returns:
+            The value returned by `func`.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        queue = self.queues.get(channel_id)
+        if queue is None:
+            queue = self.queues[channel_id] = collections.deque()
+        queue.append((backend, func, future, priority, time.monotonic()))
+
+        # Start a worker for the channel if there isn't one draining its queue
+        if channel_id not in self.workers:
+            self.workers[channel_id] = asyncio.create_task(
+                self.__run_channel(channel_id))
+
+        return await future
+
+    def get_pending_count(self):
+        """
+        Returns the number of queries waiting in all channel queues.
+        """
+        return sum(len(queue) for queue in self.queues.values())
+
+    def get_stats(self):
+        """
+        Returns a dictionary of dispatcher statistics.
+        """
+        return {
+            "active_channels": len(self.workers),
+            "pending": self.get_pending_count(),
+            "priorities": {
+                priority.name.lower(): {
+                    "dispatched": self.dispatched[priority],
+                    "average_wait": self.total_wait[priority] / self.dispatched[priority] if self.dispatched[priority] else 0.0,
+                }
+                for priority in Priority
+            },
+        }
+
+    def __get_backend_slots(self, backend):
+        """
+        Returns the semaphore limiting the in-flight queries of the given backend.
+        """
+        slots = self.backend_slots.get(backend)
+        if slots is None:
+            slots = self.backend_slots[backend] = PrioritySemaphore(
+                self.max_in_flight_per_backend)
+        return slots
+
+    async def __run_channel(self, channel_id):
+        """
+        Drains the queue of the given channel one job at a time, then exits.
+        """
+        queue = self.queues[channel_id]
+
+        try:
+            while queue:
+                backend, func, future, priority, submitted_at = queue.popleft()
+
+                # Skip jobs whose caller has already gone away
+                if future.done():
+                    continue
+
+                # Older jobs gain on newer ones of a higher priority as they wait
+                score = submitted_at + self.aging * priority.value
+                backend_slots = self.__get_backend_slots(backend)
+
+                # Take the backend slot first, so channels waiting on a saturated backend
+                # don't hold worker slots that channels of idle backends could use
+                await backend_slots.acquire(score)
+                try:
+                    await self.worker_slots.acquire(score)
+                    try:
+                        wait = time.monotonic() - submitted_at
+                        self.dispatched[priority] += 1
+                        self.total_wait[priority] += wait
+                        logger.debug(
+                            f"Dispatching {priority.name.lower()} query in channel {channel_id} after waiting {wait:.2f}s")
+
+                        try:
+                            result = await func()
+                        except Exception as e:
+                            if not future.done():
+                                future.set_exception(e)
+                            continue
+                    finally:
+                        self.worker_slots.release()
+                finally:
+                    backend_slots.release()
+
+                if not future.done():
+                    future.set_result(result)
+
+        finally:
+            # Cancel any job left behind if the worker is stopped early
+            while queue:
+                _, _, future, _, _ = queue.popleft()
+                if not future.done():
+                    future.cancel()
+
+            del self.workers[channel_id]
+            del self.queues[channel_id]
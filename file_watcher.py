@@ -0,0 +1,160 @@
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+import os
+import struct
+
+logger = logging.getLogger('discord')
+
+# inotify event masks, from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+
+class FileWatcher:
+    """
+    A class that calls back when a file changes, e.g. after an external edit.
+
+    On Linux the directory of the file is watched with inotify, so files replaced by a rename
+    are noticed too. Elsewhere, or if inotify is unavailable, the file is polled. Bursts of
+    events, as editors save in several steps, result in a single callback.
+    """
+
+    def __init__(self, path, on_change, poll_interval=5.0, debounce=0.2):
+        """
+        Initializes a new FileWatcher instance.
+
+        Args:
+            path (str): The path of the file to watch.
+            on_change: A function without arguments, called on the event loop when the file changed.
+            poll_interval (float): The number of seconds between two checks of the file when polling.
+            debounce (float): The number of seconds to wait for more events before calling back.
+        """
+        self.path = os.path.abspath(path)
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.fd = None  # The inotify file descriptor
+        self.task = None  # The polling task
+        self.handle = None  # The pending callback
+        self.mode = None
+
+    def start(self):
+        """
+        Starts watching the file, with inotify if available, by polling otherwise.
+        """
+        loop = asyncio.get_running_loop()
+
+        try:
+            self.fd = self.__init_inotify()
+            loop.add_reader(self.fd, self.__read_events, loop)
+            self.mode = "inotify"
+        except (OSError, AttributeError, NotImplementedError) as e:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+            logger.info(
+                f"inotify unavailable ({type(e).__name__} - {e}), polling {self.path} every {self.poll_interval}s")
+            self.task = loop.create_task(self.__poll(loop))
+            self.mode = "polling"
+
+        logger.info(f"Watching {self.path} with {self.mode}")
+
+    async def stop(self):
+        """
+        Stops watching the file.
+        """
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+
+        if self.fd is not None:
+            asyncio.get_running_loop().remove_reader(self.fd)
+            os.close(self.fd)
+            self.fd = None
+
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    def __init_inotify(self):
+        """
+        Returns an inotify file descriptor watching the directory of the file.
+        """
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+        # Watch the directory, as an atomic replace gives the file a new inode
+        directory = os.path.dirname(self.path).encode()
+        if libc.inotify_add_watch(fd, directory, IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            errno = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(errno, os.strerror(errno))
+
+        return fd
+
+    def __read_events(self, loop):
+        """
+        Reads the pending inotify events, scheduling a callback if one of them is about the file.
+        """
+        try:
+            buffer = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+
+        name = os.path.basename(self.path).encode()
+        offset = 0
+        while offset + IN_EVENT_HEADER.size <= len(buffer):
+            _, _, _, length = IN_EVENT_HEADER.unpack_from(buffer, offset)
+            offset += IN_EVENT_HEADER.size
+            event_name = buffer[offset:offset + length].rstrip(b"\0")
+            offset += length
+
+            if event_name == name:
+                self.__schedule(loop)
+
+    async def __poll(self, loop):
+        """
+        Checks the file for changes at the polling interval.
+        """
+        last = self.__get_signature()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            signature = self.__get_signature()
+            if signature != last:
+                last = signature
+                self.__schedule(loop)
+
+    def __get_signature(self):
+        """
+        Returns what changes when the file is written or replaced, None if it doesn't exist.
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def __schedule(self, loop):
+        """
+        Calls back after the debounce window, unless a callback is already pending.
+        """
+        if self.handle is None:
+            self.handle = loop.call_later(self.debounce, self.__notify)
+
+    def __notify(self):
+        """
+        Calls back, logging its errors so watching goes on.
+        """
+        self.handle = None
+        try:
+            self.on_change()
+        except Exception as e:
+            logger.exception(
+                f"File watcher callback error:  {type(e).__name__} - {e}")
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger('discord')
+
+
+class KeepWarmScheduler:
+    """
+    A class that periodically pings models so they stay loaded while people are talking to the bot.
+
+    The interval between pings shrinks as traffic grows, and pings stop once no message has
+    been received for a while. A model that served a query during the last interval is not
+    pinged, as the query already kept it warm.
+    """
+
+    def __init__(self, get_targets, min_interval=60.0, max_interval=600.0, idle_timeout=1800.0, alpha=0.3):
+        """
+        Initializes a new KeepWarmScheduler instance.
+
+        Args:
+            get_targets: A function without arguments returning the chatbots to keep warm. Each of them
+                         has an async `keep_warm` method and a `last_query_at` attribute.
+            min_interval (float): The minimum number of seconds between two pings, under heavy traffic.
+            max_interval (float): The maximum number of seconds between two pings, under light traffic.
+            idle_timeout (float): The number of seconds without messages after which pings stop.
+            alpha (float): The weight of the newest interval in the moving average of the traffic.
+        """
+        self.get_targets = get_targets
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.idle_timeout = idle_timeout
+        self.alpha = alpha
+        self.rate = 0.0  # EWMA of the messages per minute
+        self.messages = 0  # Messages since the last ping
+        self.last_activity = None
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.pings = 0
+
+    def start(self):
+        """
+        Starts the scheduler in the background, unless it is already running.
+        """
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.__run())
+
+    async def stop(self):
+        """
+        Stops the scheduler.
+        """
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    def record_activity(self):
+        """
+        Records a message sent to the bot, waking the scheduler up if it was idle.
+        """
+        self.messages += 1
+        self.last_activity = time.monotonic()
+        self.wakeup.set()
+
+    def get_interval(self):
+        """
+        Returns the number of seconds until the next ping given the recent traffic.
+        """
+        interval = self.max_interval / (1 + self.rate)
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def is_idle(self):
+        """
+        Returns whether no message has been received for the idle timeout.
+        """
+        return self.last_activity is None or time.monotonic() - self.last_activity >= self.idle_timeout
+
+    def get_stats(self):
+        """
+        Returns a dictionary of scheduler statistics.
+        """
+        return {
+            "idle": self.is_idle(),
+            "rate": self.rate,
+            "interval": self.get_interval(),
+            "pings": self.pings,
+        }
+
+    async def __run(self):
+        """
+        Pings the models at the adaptive interval while there is traffic.
+        """
+        while True:
+            if self.is_idle():
+                logger.debug("Keep warm idle, waiting for messages")
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            interval = self.get_interval()
+            started_at = time.monotonic()
+            await asyncio.sleep(interval)
+
+            # Update the traffic from the messages received during the interval
+            elapsed_minutes = (time.monotonic() - started_at) / 60
+            self.rate += self.alpha * \
+                (self.messages / elapsed_minutes - self.rate)
+            self.messages = 0
+
+            if self.is_idle():
+                continue
+
+            for target in self.get_targets():
+                # Queries served during the interval already kept the model warm
+                if time.monotonic() - target.last_query_at < interval:
+                    continue
+
+                try:
+                    await target.keep_warm()
+                    self.pings += 1
+                except Exception as e:
+                    logger.warning(
+                        f"Keep warm error:  {type(e).__name__} - {e}")
@@ -2,14 +2,32 @@ import asyncio
 import logging
 import logging.handlers
 import sys
+import time
 import argparse
+import atexit
+import os
+import signal
 import discord
 from discord import app_commands
 import config
 import utils
+from channel_rules import ChannelRules
+from chatbot_registry import ChatBotRegistry
+
+from dispatcher import Priority, QueryDispatcher
+from file_watcher import FileWatcher
+from keep_warm import KeepWarmScheduler
+from rate_limiter import LoadShedder, RateLimiter, ShedMode
+from response_cache import ResponseCache
+from router import BackendRouter, HedgedStream
+from single_flight import SingleFlight
+from supervisor import ShardSupervisor
+from streamer import ResponseStreamer
 
 from enum import Enum
 
+from chatbots.chatbot import QueryTimeoutError
+from chatbots.model_index import ModelIndex
 from chatbots.hugging_face_chatbot import HuggingFaceChatBot
 from chatbots.poe_chatbot import PoeChatBot
 
@@ -18,7 +36,8 @@ logging.getLogger().handlers.clear()  # Remove root logger stream output
 discord.utils.setup_logging(level=config.LOGGING_LEVEL)
 logger = logging.getLogger('discord')
 handler = logging.handlers.RotatingFileHandler(
-    filename='discord.log',
+    # Workers of a sharded deployment each log to their own file, as they can't rotate a shared one
+    filename=f'discord-shard-{config.SHARD_IDS[0]}.log' if config.SHARD_IDS else 'discord.log',
     encoding='utf-8',
     maxBytes=32 * 1024 * 1024,  # 32 MiB
     backupCount=5,  # Rotate through 5 files
@@ -32,7 +51,12 @@ logger.addHandler(handler)
 # Create Discord client with appropriate intents
 intents = discord.Intents.default()
 intents.message_content = True
-client = discord.Client(intents=intents)
+if config.SHARD_COUNT > 0:
+    # Run the given shards, or all of them if not started by the supervisor
+    client = discord.AutoShardedClient(
+        intents=intents, shard_count=config.SHARD_COUNT, shard_ids=config.SHARD_IDS or None)
+else:
+    client = discord.Client(intents=intents)
 
 # Create command tree for Discord slash commands
 tree = app_commands.CommandTree(client)
@@ -40,6 +64,47 @@ tree = app_commands.CommandTree(client)
 # Initialize chatbot object
 chatbot = None
 
+# Serialize bot changes, so chatbots built in the background are swapped in order
+bot_change_lock = asyncio.Lock()
+bot_reset_task = None  # Background re-initialization of the chatbot after a failure
+bot_prune_tasks = set()  # Background closing of the chatbots no longer bound anywhere
+
+# Create response cache if enabled
+response_cache = ResponseCache(
+    config.RESPONSE_CACHE_MAX_ENTRIES, config.RESPONSE_CACHE_TTL) if config.RESPONSE_CACHE_ENABLED else None
+
+# Create single flight to collapse identical queries in flight if enabled
+single_flight = SingleFlight() if config.SINGLE_FLIGHT_ENABLED else None
+
+# Initialize rate limiter and load shedder, created from config
+rate_limiter = None
+load_shedder = None
+
+# Create dispatcher to queue queries per channel
+dispatcher = QueryDispatcher(
+    config.DISPATCHER_MAX_WORKERS, config.DISPATCHER_MAX_IN_FLIGHT_PER_BACKEND, config.DISPATCHER_PRIORITY_AGING)
+
+# Create scheduler keeping the Hugging Face models warm if enabled
+keep_warm = KeepWarmScheduler(
+    lambda: get_keep_warm_targets(), config.KEEP_WARM_MIN_INTERVAL, config.KEEP_WARM_MAX_INTERVAL,
+    config.KEEP_WARM_IDLE_TIMEOUT) if config.KEEP_WARM_ENABLED else None
+
+# Create registry of the chatbots bound to guilds and channels, one per bot and model
+chatbot_registry = ChatBotRegistry(lambda bot, model: create_bound_chatbot(bot, model))
+
+# Create watcher applying external edits of the config file if enabled, the SQLite database is polled instead
+config_watcher = FileWatcher(
+    config.CONFIG_FILE, lambda: reload_from_config(), config.CONFIG_RELOAD_POLL_INTERVAL) \
+    if config.CONFIG_RELOAD_ENABLED and config.store is None else None
+
+# Reload the changes other workers made to the shared SQLite database, or if enabled
+config_store_task = None
+
+# Create router to keep every bot live and fail over between them if enabled
+router = BackendRouter(
+    config.ROUTER_POLICY, config.ROUTER_WEIGHTS, max_error_rate=config.ROUTER_MAX_ERROR_RATE,
+    hedge_percentile=config.HEDGING_PERCENTILE, max_hedge_ratio=config.HEDGING_MAX_RATIO if config.HEDGING_ENABLED else 0) if config.ROUTER_ENABLED else None
+
 
 # Define enums
 class BotType(Enum):
@@ -58,15 +123,21 @@ class QueryStatus(Enum):
     UNKNOWN_QUERY_ERROR = 1
     EMPTY_RESPONSE_ERROR = 3
     UNKNOWN_RESPONSE_ERROR = 4
+    TIMEOUT_ERROR = 5
 
 
 # Initialize variables
 nicknames = {}  # Nickname list
 channel_whitelist = []  # Initialize channel whitelist
 channel_blacklist = []  # Initialize channel blacklist
+channel_rules = ChannelRules()  # Whitelist and blacklist compiled for lookups by id
+response_cache_blacklist = []  # Channels bypassing the response cache
+bot_bindings = {"guilds": {}, "channels": {}}  # Bot and model bound to guilds and channels
+bot_index = ModelIndex(lambda: [(bot.value, bot.value) for bot in BotType], float("inf"))  # Bot names for suggestions
 current_bot = BotType.POE  # Current bot
 current_channel_monitor_mode = ChannelMonitorMode.ALL  # Current monitor mode
 current_name_prefix_mode = True  # Current name prefix mode
+startup_model = None  # Model set from the command arguments
 
 
 @tree.command(name="send-to-channel", description="Send a message to the bot in a channel without showing your message")
@@ -99,11 +170,7 @@ async def handle_send_to_channel_command(interaction, user_input: str, channel:
             logger.info(
                 f"Input from {interaction.user.name} to channel {channel.name} ({channel.id}) (via /send-to-channel): {user_input}")
 
-            status, response = await query(user_input)
-
-            response = format_response_based_on_status(response, status)
-
-            await channel.send(content=response)
+            await reply(channel, user_input, channel.send, interaction.user, interactive=True)
     except Exception as e:
         logger.exception(f"send_to_channel error:  {type(e).__name__} - {e}")
         await interaction.followup.send(f"> Sorry, an error occured while trying to send the message to channel.\n\n`{type(e).__name__} - {e}`")
@@ -139,11 +206,10 @@ async def handle_send_command(interaction, user_input: str, delay: float = 0.0,
             logger.info(
                 f"Input from {interaction.user.name} (via /send): {user_input}")
 
-            status, response = await query(user_input)
-
-            response = format_response_based_on_status(response, status)
+            async def send(content):
+                return await interaction.followup.send(content=content, wait=True)
 
-            await interaction.followup.send(content=response)
+            await reply(interaction.channel, user_input, send, interaction.user, interactive=True)
     except Exception as e:
         logger.exception(f"send error:  {type(e).__name__} - {e}")
         await interaction.followup.send(f"> Sorry, an error occured while trying to send the message.\n\n`{type(e).__name__} - {e}`")
@@ -157,6 +223,11 @@ async def handle_get_bot_command(interaction):
     try:
         bot_name = get_bot()
         message = f"> The current chatbot is: `{bot_name}`."
+
+        binding = get_binding(interaction.channel)
+        if binding is not None:
+            message += f"\n> This {binding['scope']} is bound to: `{binding['bot']}` with model `{binding['model']}`."
+
         logger.info(message)
         await interaction.response.send_message(message)
     except Exception as e:
@@ -164,6 +235,41 @@ async def handle_get_bot_command(interaction):
         await interaction.response.send_message(f"> Sorry, an error occured while trying to get bot.\n\n`{type(e).__name__} - {e}`")
 
 
+@tree.command(name="get-bot-usage", description="Get the usage of each account and proxy of the current bot")
+async def handle_get_bot_usage_command(interaction):
+    """
+    Command to get the usage of each account and the health of each proxy of the current chatbot.
+    """
+    try:
+        if isinstance(chatbot, HuggingFaceChatBot):
+            stats = chatbot.get_breaker_stats()
+            lines = [f"> The current chatbot `{get_bot()}` uses a single account, retries: `{stats['retries']}`."]
+            for model, breaker in stats["models"].items():
+                state = breaker["state"] if breaker["retry_after"] <= 0 else f"{breaker['state']} for {breaker['retry_after']:.0f}s"
+                lines.append(
+                    f"> Model `{model}`: circuit {state}, failures in a row: `{breaker['consecutive_failures']}`, opened: `{breaker['opened']}` times.")
+            message = "\n".join(lines)
+        elif not isinstance(chatbot, PoeChatBot):
+            message = f"> The current chatbot `{get_bot()}` uses a single account."
+        else:
+            lines = []
+            for index, stats in enumerate(chatbot.get_client_stats()):
+                state = "healthy" if stats["healthy"] else f"out for {stats['disabled_for']:.0f}s (`{stats['last_error']}`)"
+                lines.append(
+                    f"> Account {index} `{stats['account']}`: {state}, in flight: `{stats['in_flight']}`, requests: `{stats['requests']}`, errors: `{stats['errors']}`.")
+            # Proxy URLs may hold credentials, so they are only shown by index
+            for index, stats in enumerate(chatbot.get_proxy_stats() or []):
+                latency = f"{stats['latency'] * 1000:.0f}ms" if stats["latency"] is not None else "unknown"
+                lines.append(
+                    f"> Proxy {index}: latency: `{latency}`, error rate: `{stats['error_rate']:.0%}`, score: `{stats['score']:.3f}`.")
+            message = "\n".join(lines)
+        logger.info(message)
+        await interaction.response.send_message(message)
+    except Exception as e:
+        logger.exception(f"get_bot_usage error:  {type(e).__name__} - {e}")
+        await interaction.response.send_message(f"> Sorry, an error occured while trying to get bot usage.\n\n`{type(e).__name__} - {e}`")
+
+
 @tree.command(name="get-available-bot", description="Get available chatbot")
 async def handle_get_available_bot_command(interaction):
     """
@@ -189,7 +295,7 @@ async def handle_change_bot_command(interaction, bot_name: str = None):
         # Defer sending message as changing bot takes time
         await interaction.response.defer()
 
-        success = change_bot(bot_name)
+        success = await change_bot_async(bot_name)
 
         if success:
             message = f"> Bot has been changed to: `{bot_name}`."
@@ -214,7 +320,7 @@ async def handle_reset_bot_command(interaction):
         # Defer sending message as changing bot takes time
         await interaction.response.defer()
 
-        success = change_bot(current_bot)
+        success = await change_bot_async(current_bot)
 
         if success:
             message = "> Bot has been reset."
@@ -228,6 +334,81 @@ async def handle_reset_bot_command(interaction):
         await interaction.followup.send(f"> Sorry, an error occured while trying to reset bot.\n\n`{type(e).__name__} - {e}`")
 
 
+@handle_change_bot_command.autocomplete("bot_name")
+async def autocomplete_change_bot_name(interaction, current: str):
+    """
+    Suggests the bot names matching what has been typed so far.
+    """
+    return [app_commands.Choice(name=name, value=name) for name in bot_index.search(current)]
+
+
+@tree.command(name="bind-bot", description="Use a bot and model in this server or channel only")
+async def handle_bind_bot_command(interaction, bot_name: str, model_name: str = None, channel_only: bool = False):
+    """
+    Command to bind the current server, or only the current channel, to a bot and model.
+    """
+    try:
+        # Defer sending message as creating the bot takes time
+        await interaction.response.defer()
+
+        bot_type = parse_bot_type(bot_name)
+        if bot_type is None:
+            bots = ", ".join([bot.value for bot in BotType])
+            message = f"> Bot `{bot_name}` is invalid, available bot: {bots}."
+        else:
+            if not model_name:
+                model_name = config.POE_MODEL if bot_type == BotType.POE else config.HUGGING_FACE_MODEL
+
+            if await chatbot_registry.get(bot_type.value, model_name) is None:
+                message = f"> Failed to create bot `{bot_type.value}` with model `{model_name}`."
+            else:
+                scope, key = get_binding_target(interaction.channel, channel_only)
+                binding = {"bot": bot_type.value, "model": model_name}
+                bot_bindings[scope][key] = binding
+
+                # Save to JSON
+                config.data["bot_bindings"][scope][key] = binding.copy()
+                config.save_config()
+
+                message = f"> This {get_binding_scope_name(scope)} now uses bot `{bot_type.value}` with model `{model_name}`."
+
+        logger.info(message)
+        await interaction.followup.send(message)
+    except Exception as e:
+        logger.exception(f"bind_bot error:  {type(e).__name__} - {e}")
+        await interaction.followup.send(f"> Sorry, an error occured while trying to bind bot.\n\n`{type(e).__name__} - {e}`")
+
+
+@tree.command(name="unbind-bot", description="Use the current bot again in this server or channel")
+async def handle_unbind_bot_command(interaction, channel_only: bool = False):
+    """
+    Command to remove the bot binding of the current server, or only of the current channel.
+    """
+    try:
+        scope, key = get_binding_target(interaction.channel, channel_only)
+
+        if key in bot_bindings[scope]:
+            del bot_bindings[scope][key]
+
+            # Save to JSON
+            if key in config.data["bot_bindings"][scope]:
+                del config.data["bot_bindings"][scope][key]
+                config.save_config()
+
+            # Release the chatbot if nothing is bound to it anymore, without holding up the response
+            prune_chatbots_in_background()
+
+            message = f"> This {get_binding_scope_name(scope)} now uses the current bot `{get_bot()}`."
+        else:
+            message = f"> This {get_binding_scope_name(scope)} isn't bound to a bot."
+
+        logger.info(message)
+        await interaction.response.send_message(message)
+    except Exception as e:
+        logger.exception(f"unbind_bot error:  {type(e).__name__} - {e}")
+        await interaction.response.send_message(f"> Sorry, an error occured while trying to unbind bot.\n\n`{type(e).__name__} - {e}`")
+
+
 @tree.command(name="get-available-model", description="Get the current chatbot available model")
 async def handle_get_availble_model_command(interaction):
     """
@@ -264,7 +445,7 @@ async def handle_change_model_command(interaction, model_name: str = None):
     Command to change the chatbot model.
     """
     try:
-        success = chatbot.change_model(model_name)
+        success = await chatbot.change_model(model_name)
         if success:
             message = f"> Model has been changed to: `{model_name}`."
         else:
@@ -284,6 +465,14 @@ async def handle_change_model_command(interaction, model_name: str = None):
         await interaction.response.send_message(f"> Sorry, an error occured while trying to change model.\n\n`{type(e).__name__} - {e}`")
 
 
+@handle_change_model_command.autocomplete("model_name")
+async def autocomplete_change_model_name(interaction, current: str):
+    """
+    Suggests the models of the current chatbot matching what has been typed so far.
+    """
+    return [app_commands.Choice(name=name, value=name) for name in chatbot.search_models(current)]
+
+
 @tree.command(name="reset-model", description="Reset the current model to the default one")
 async def handle_reset_model_command(interaction):
     """
@@ -298,7 +487,7 @@ async def handle_reset_model_command(interaction):
         elif current_bot == BotType.HUGGING_FACE:
             default_model = config.HUGGING_FACE_MODEL
 
-        success = chatbot.change_model(default_model)
+        success = await chatbot.change_model(default_model)
         if success:
             message = f"> Model has been reset to the default one: `{default_model}`."
             logger.info(message)
@@ -318,7 +507,10 @@ async def handle_change_token_command(interaction, token: str):
     Command to change the API token.
     """
     try:
-        success = chatbot.change_token(token)
+        # Defer sending message as connecting with the new token takes time
+        await interaction.response.defer()
+
+        success = await chatbot.change_token(token)
         if success:
             message = "> API token has been changed."
             logger.info(message)
@@ -326,10 +518,10 @@ async def handle_change_token_command(interaction, token: str):
             message = "> Failed to change API token."
             logger.warning(message)
 
-        await interaction.response.send_message(message)
+        await interaction.followup.send(message)
     except Exception as e:
         logger.exception(f"change_token error:  {type(e).__name__} - {e}")
-        await interaction.response.send_message(f"> Sorry, an error occured while trying to change token.\n\n`{type(e).__name__} - {e}`")
+        await interaction.followup.send(f"> Sorry, an error occured while trying to change token.\n\n`{type(e).__name__} - {e}`")
 
 
 @tree.command(name="reset-token", description="Reset the API token to the default one")
@@ -338,7 +530,15 @@ async def handle_reset_token_command(interaction):
     Command to reset the API token to the default one.
     """
     try:
-        success = chatbot.change_token(config.HUGGING_FACE_TOKEN)
+        # Defer sending message as connecting with the default token takes time
+        await interaction.response.defer()
+
+        if current_bot == BotType.POE:
+            default_token = config.POE_TOKEN
+        else:
+            default_token = config.HUGGING_FACE_TOKEN
+
+        success = await chatbot.change_token(default_token)
         if success:
             message = "> API token has been reset to the default one."
             logger.info(message)
@@ -346,20 +546,32 @@ async def handle_reset_token_command(interaction):
             message = "> Failed to reset API token to the default one."
             logger.warning(message)
 
-        await interaction.response.send_message(message)
+        await interaction.followup.send(message)
     except Exception as e:
         logger.exception(f"reset_token error:  {type(e).__name__} - {e}")
-        await interaction.response.send_message(f"> Sorry, an error occured while trying to reset token.\n\n`{type(e).__name__} - {e}`")
+        await interaction.followup.send(f"> Sorry, an error occured while trying to reset token.\n\n`{type(e).__name__} - {e}`")
 
 
 @tree.command(name="clear-context", description="Clear context")
-async def handle_clear_context_command(interaction):
+async def handle_clear_context_command(interaction, all_channels: bool = False):
     """
-    Command to clear the context of the chatbot.
+    Command to clear the context of the chatbot in the current channel, or in all channels.
     """
     try:
-        chatbot.clear_context()
-        message = "> Context has been cleared."
+        if all_channels:
+            for target in [chatbot] + chatbot_registry.get_all():
+                target.clear_context()
+            message = "> Context has been cleared in all channels."
+        else:
+            # Only clear the bound chatbot if it exists, creating it takes longer than a response may
+            binding = get_binding(interaction.channel)
+            if binding is None:
+                target = chatbot
+            else:
+                target = chatbot_registry.peek(binding["bot"], binding["model"])
+            if target is not None:
+                target.clear_context(get_context_key(interaction.channel))
+            message = "> Context has been cleared."
         logger.info(message)
         await interaction.response.send_message(message)
     except Exception as e:
@@ -367,42 +579,70 @@ async def handle_clear_context_command(interaction):
         await interaction.response.send_message(f"> Sorry, an error occured while trying to clear context.\n\n`{type(e).__name__} - {e}`")
 
 
+@tree.command(name="get-context-stats", description="Get the conversation context statistics")
+async def handle_get_context_stats_command(interaction):
+    """
+    Command to get the conversation context statistics of the chatbot.
+    """
+    try:
+        stats = chatbot.get_context_stats()
+        if stats is None:
+            message = f"> The current chatbot `{get_bot()}` doesn't keep conversation contexts locally."
+        else:
+            message = f"> Live contexts: `{stats['contexts']}`, characters held: `{stats['size']}`, evictions: `{stats['evictions']}`."
+        logger.info(message)
+        await interaction.response.send_message(message)
+    except Exception as e:
+        logger.exception(f"get_context_stats error:  {type(e).__name__} - {e}")
+        await interaction.response.send_message(f"> Sorry, an error occured while trying to get context stats.\n\n`{type(e).__name__} - {e}`")
+
+
 @tree.command(name="enable-channel-monitoring", description="Enable monitoring of the current channel")
-async def handle_enable_channel_monitoring_command(interaction, channel: discord.TextChannel = None):
+async def handle_enable_channel_monitoring_command(interaction, channel: discord.TextChannel = None, category: discord.CategoryChannel = None, whole_server: bool = False):
     """
     Command to enable the current channel monitoring.
+
+    A category or the whole server can be given instead, covering all of its channels.
     """
     global current_channel_monitor_mode
 
     try:
-        target_channel_id = str(
-            interaction.channel_id) if channel is None else str(channel.id)
+        target_channel_id = get_rule_target(
+            interaction, channel, category, whole_server)
 
         if current_channel_monitor_mode == ChannelMonitorMode.NONE:
-            if target_channel_id in channel_whitelist:
-                message = f"> Channel `{client.get_channel(int(target_channel_id))} ({target_channel_id})` is already being monitored."
+            if int(target_channel_id) in channel_rules.whitelist:
+                message = f"> {describe_rule_target(target_channel_id)} is already being monitored."
             else:
                 channel_whitelist.append(target_channel_id)
+                channel_rules.whitelist.add(int(target_channel_id))
 
                 # Save to JSON
                 if target_channel_id not in config.data["channel_whitelist"]:
                     config.data["channel_whitelist"].append(target_channel_id)
                     config.save_config()
 
-                message = f"> Channel `{client.get_channel(int(target_channel_id))} ({target_channel_id})` has been added to the monitoring whitelist."
+                message = f"> {describe_rule_target(target_channel_id)} has been added to the monitoring whitelist."
 
         elif current_channel_monitor_mode == ChannelMonitorMode.ALL:
-            if target_channel_id in channel_blacklist:
+            if int(target_channel_id) in channel_rules.blacklist:
                 channel_blacklist.remove(target_channel_id)
+                channel_rules.blacklist.discard(int(target_channel_id))
 
                 # Save to JSON
                 if target_channel_id in config.data["channel_blacklist"]:
                     config.data["channel_blacklist"].remove(target_channel_id)
                     config.save_config()
 
-                message = f"> Channel `{client.get_channel(int(target_channel_id))} ({target_channel_id})` has been removed from the monitoring blacklist."
+                message = f"> {describe_rule_target(target_channel_id)} has been removed from the monitoring blacklist."
             else:
-                message = f"> Channel `{client.get_channel(int(target_channel_id))} ({target_channel_id})` is already being monitored."
+                # The channel may still be blacklisted through its category or server
+                parent_id = get_parent_rule(
+                    target_channel_id, channel_rules.blacklist)
+                if parent_id is not None:
+                    message = f"> {describe_rule_target(target_channel_id)} is not being monitored, as {describe_rule_target(parent_id)} is in the monitoring blacklist."
+                else:
+                    message = f"> {describe_rule_target(target_channel_id)} is already being monitored."
 
         logger.info(message)
         await interaction.response.send_message(content=message)
@@ -413,41 +653,51 @@ async def handle_enable_channel_monitoring_command(interaction, channel: discord
 
 
 @tree.command(name="disable-channel-monitoring", description="Disable monitoring of the current channel")
-async def handle_disable_channel_monitoring_command(interaction, channel: discord.TextChannel = None):
+async def handle_disable_channel_monitoring_command(interaction, channel: discord.TextChannel = None, category: discord.CategoryChannel = None, whole_server: bool = False):
     """
     Command to disable the current channel monitoring.
+
+    A category or the whole server can be given instead, covering all of its channels.
     """
     global current_channel_monitor_mode
 
     try:
-        target_channel_id = str(
-            interaction.channel_id) if channel is None else str(channel.id)
+        target_channel_id = get_rule_target(
+            interaction, channel, category, whole_server)
 
         if current_channel_monitor_mode == ChannelMonitorMode.NONE:
-            if target_channel_id in channel_whitelist:
+            if int(target_channel_id) in channel_rules.whitelist:
                 channel_whitelist.remove(target_channel_id)
+                channel_rules.whitelist.discard(int(target_channel_id))
 
                 # Save to JSON
                 if target_channel_id in config.data["channel_whitelist"]:
                     config.data["channel_whitelist"].remove(target_channel_id)
                     config.save_config()
 
-                message = f"> Channel `{client.get_channel(int(target_channel_id))} ({target_channel_id})` has been removed from the monitoring whitelist."
+                message = f"> {describe_rule_target(target_channel_id)} has been removed from the monitoring whitelist."
             else:
-                message = f"> Channel `{client.get_channel(int(target_channel_id))} ({target_channel_id})` is already not being monitored."
+                # The channel may still be whitelisted through its category or server
+                parent_id = get_parent_rule(
+                    target_channel_id, channel_rules.whitelist)
+                if parent_id is not None:
+                    message = f"> {describe_rule_target(target_channel_id)} is still being monitored, as {describe_rule_target(parent_id)} is in the monitoring whitelist."
+                else:
+                    message = f"> {describe_rule_target(target_channel_id)} is already not being monitored."
 
         elif current_channel_monitor_mode == ChannelMonitorMode.ALL:
-            if target_channel_id in channel_blacklist:
-                message = f"> Channel `{client.get_channel(int(target_channel_id))} ({target_channel_id})` is already not being monitored."
+            if int(target_channel_id) in channel_rules.blacklist:
+                message = f"> {describe_rule_target(target_channel_id)} is already not being monitored."
             else:
                 channel_blacklist.append(target_channel_id)
+                channel_rules.blacklist.add(int(target_channel_id))
 
                 # Save to JSON
                 if target_channel_id not in config.data["channel_blacklist"]:
                     config.data["channel_blacklist"].append(target_channel_id)
                     config.save_config()
 
-                message = f"> Channel `{client.get_channel(int(target_channel_id))} ({target_channel_id})` has been added to the monitoring blacklist."
+                message = f"> {describe_rule_target(target_channel_id)} has been added to the monitoring blacklist."
 
         logger.info(message)
         await interaction.response.send_message(content=message)
@@ -468,7 +718,7 @@ async def handle_get_channel_whitelist_command(interaction):
         message = "There are no whitelisted channels."
     else:
         channel_list = ", ".join(
-            [f"`{client.get_channel(int(channel))} ({channel})`" for channel in channel_whitelist])
+            [f"`{get_rule_target_name(channel)}`" for channel in channel_whitelist])
         message = f"> The whitelisted channels are: {channel_list}."
 
     logger.info(message)
@@ -486,7 +736,7 @@ async def handle_get_channel_blacklist_command(interaction):
         message = "There are no blacklisted channels"
     else:
         channel_list = ", ".join(
-            [f"`{client.get_channel(int(channel))} ({channel})`" for channel in channel_blacklist])
+            [f"`{get_rule_target_name(channel)}`" for channel in channel_blacklist])
         message = f"> The blacklisted channels are: {channel_list}."
 
     logger.info(message)
@@ -522,6 +772,123 @@ async def handle_change_channel_monitor_mode_command(interaction, new_mode: str
     await interaction.response.send_message(content=message)
 
 
+@tree.command(name="enable-response-cache", description="Allow cached responses in the current channel")
+async def handle_enable_response_cache_command(interaction, channel: discord.TextChannel = None):
+    """
+    Command to allow cached responses in the current channel.
+    """
+    try:
+        target_channel_id = str(
+            interaction.channel_id) if channel is None else str(channel.id)
+
+        if target_channel_id in response_cache_blacklist:
+            response_cache_blacklist.remove(target_channel_id)
+
+            # Save to JSON
+            if target_channel_id in config.data["response_cache_blacklist"]:
+                config.data["response_cache_blacklist"].remove(
+                    target_channel_id)
+                config.save_config()
+
+            message = f"> Channel `{client.get_channel(int(target_channel_id))} ({target_channel_id})` will use cached responses."
+        else:
+            message = f"> Channel `{client.get_channel(int(target_channel_id))} ({target_channel_id})` is already using cached responses."
+
+        if response_cache is None:
+            message += " (The response cache is disabled by `RESPONSE_CACHE_ENABLED`.)"
+
+        logger.info(message)
+        await interaction.response.send_message(content=message)
+    except Exception as e:
+        logger.exception(
+            f"enable_response_cache error:  {type(e).__name__} - {e}")
+        await interaction.response.send_message(f"> Sorry, an error occured while trying to enable response cache.\n\n`{type(e).__name__} - {e}`")
+
+
+@tree.command(name="disable-response-cache", description="Bypass cached responses in the current channel")
+async def handle_disable_response_cache_command(interaction, channel: discord.TextChannel = None):
+    """
+    Command to bypass cached responses in the current channel.
+    """
+    try:
+        target_channel_id = str(
+            interaction.channel_id) if channel is None else str(channel.id)
+
+        if target_channel_id in response_cache_blacklist:
+            message = f"> Channel `{client.get_channel(int(target_channel_id))} ({target_channel_id})` is already bypassing cached responses."
+        else:
+            response_cache_blacklist.append(target_channel_id)
+
+            # Save to JSON
+            if target_channel_id not in config.data["response_cache_blacklist"]:
+                config.data["response_cache_blacklist"].append(
+                    target_channel_id)
+                config.save_config()
+
+            message = f"> Channel `{client.get_channel(int(target_channel_id))} ({target_channel_id})` will bypass cached responses."
+
+        logger.info(message)
+        await interaction.response.send_message(content=message)
+    except Exception as e:
+        logger.exception(
+            f"disable_response_cache error:  {type(e).__name__} - {e}")
+        await interaction.response.send_message(f"> Sorry, an error occured while trying to disable response cache.\n\n`{type(e).__name__} - {e}`")
+
+
+@tree.command(name="get-response-cache-stats", description="Get the response cache statistics")
+async def handle_get_response_cache_stats_command(interaction):
+    """
+    Command to get the response cache statistics.
+    """
+    if response_cache is None:
+        message = "> The response cache is disabled."
+    else:
+        stats = response_cache.get_stats()
+        message = f"> Cached responses: `{stats['entries']}`, hits: `{stats['hits']}`, misses: `{stats['misses']}`, evictions: `{stats['evictions']}`."
+
+    logger.info(message)
+    await interaction.response.send_message(content=message)
+
+
+@tree.command(name="get-query-stats", description="Get the query pipeline statistics")
+async def handle_get_query_stats_command(interaction):
+    """
+    Command to get the query pipeline statistics.
+    """
+    stats = dispatcher.get_stats()
+    message = f"> Active channels: `{stats['active_channels']}`, pending queries: `{stats['pending']}`."
+    for priority, priority_stats in stats["priorities"].items():
+        message += f"\n> `{priority}` queries dispatched: `{priority_stats['dispatched']}`, average wait: `{priority_stats['average_wait']:.2f}s`."
+
+    if single_flight is not None:
+        stats = single_flight.get_stats()
+        message += f"\n> Identical queries collapsed: `{stats['collapsed']}` of `{stats['total']}`, in flight: `{stats['in_flight']}`."
+
+    if rate_limiter is not None:
+        stats = rate_limiter.get_stats()
+        message += f"\n> Queries allowed: `{stats['allowed']}`, rate limited per user: `{stats['limited_user']}`, per channel: `{stats['limited_channel']}`, per guild: `{stats['limited_guild']}`."
+
+    if load_shedder is not None:
+        stats = load_shedder.get_stats()
+        message += f"\n> Queries shed: `{stats['shed']}`, deferred: `{stats['deferred']}`."
+
+    if router is not None:
+        for stats in router.get_stats():
+            latency = f"{stats['latency']:.2f}s" if stats["latency"] is not None else "unknown"
+            role = "primary" if stats["primary"] else "fallback"
+            state = "healthy" if stats["healthy"] else "degraded"
+            message += f"\n> Bot `{stats['backend']}` ({role}, {state}): first chunk latency: `{latency}`, error rate: `{stats['error_rate']:.0%}`, requests: `{stats['requests']}`, errors: `{stats['errors']}`."
+            if stats["hedge_delay"] is not None:
+                message += f" Hedged after: `{stats['hedge_delay']:.2f}s`."
+
+        if config.HEDGING_ENABLED:
+            stats = router.get_hedge_stats()
+            message += f"\n> Queries hedged: `{stats['hedged']}` of `{stats['routed']}`, won by the hedge: `{stats['won']}`."
+
+    logger.info(message)
+    await interaction.response.send_message(content=message)
+
+
 @tree.command(name="enable-name-prefix", description="Enable prefixing username / nickname to chat messages")
 async def handle_enable_name_prefix_command(interaction):
     """
@@ -620,15 +987,56 @@ async def handle_get_nickname_command(interaction):
     await interaction.response.send_message(content=message)
 
 
+@client.event
+async def setup_hook():
+    """
+    Event that runs once after the Discord client has logged in, before connecting to the gateway.
+    """
+    global config_store_task
+
+    # Close the client on SIGTERM (e.g. docker stop) like on Ctrl+C, so pending config changes are written
+    try:
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGTERM, lambda: asyncio.get_running_loop().create_task(client.close()))
+    except NotImplementedError:
+        pass  # Signal handlers aren't supported by the event loop on Windows
+
+    # Set default model
+    if startup_model:
+        success = await chatbot.change_model(startup_model)
+        if not success:
+            logger.warning(f"Invalid model '{startup_model}' on start, using the default one")
+
+    # Bring up the other bots as fallbacks
+    if router is not None:
+        asyncio.get_running_loop().create_task(start_fallback_bots())
+
+    # Watch the config file for external edits
+    if config_watcher is not None:
+        config_watcher.start()
+
+    # Poll the config database for changes of the other workers
+    if config.store is not None and (config.CONFIG_RELOAD_ENABLED or config.SHARD_IDS):
+        config_store_task = asyncio.get_running_loop().create_task(watch_config_store())
+
+
 @client.event
 async def on_ready():
     """
     Event that runs when the Discord client is ready.
     """
-    logger.info(f'Logged in as {client.user}')
+    if config.SHARD_COUNT > 0:
+        logger.info(f'Logged in as {client.user} with shards {list(client.shards)} of {config.SHARD_COUNT}')
+    else:
+        logger.info(f'Logged in as {client.user}')
+
+    # Start keeping the models warm, on_ready runs again after reconnections
+    if keep_warm is not None:
+        keep_warm.start()
 
-    # Register the command tree for Discord slash commands
-    await tree.sync()
+    # Register the command tree for Discord slash commands, commands are global so a single worker does it
+    if not config.SHARD_IDS or 0 in config.SHARD_IDS:
+        await tree.sync()
 
 
 @client.event
@@ -643,15 +1051,9 @@ async def on_message(message):
         if message.author == client.user:
             return
 
-        # Check if current mode is NONE, and only query messages in the whitelist
-        if current_channel_monitor_mode == ChannelMonitorMode.NONE:
-            if str(message.channel.id) not in channel_whitelist:
-                return
-
-        # Check if current mode is ALL, and ignore messages in the blacklist
-        elif current_channel_monitor_mode == ChannelMonitorMode.ALL:
-            if str(message.channel.id) in channel_blacklist:
-                return
+        # Only query messages in the whitelist if current mode is NONE, ignore messages in the blacklist if ALL
+        if not channel_rules.is_monitored(message.channel):
+            return
 
         user_input = message.content
 
@@ -669,75 +1071,348 @@ async def on_message(message):
         logger.info(f"Input from {message.author}: {user_input}")
 
         async with message.channel.typing():
-            status, response = await query(user_input)
-
-            response = format_response_based_on_status(response, status)
-
-            await message.channel.send(content=response)
+            await reply(message.channel, user_input, message.channel.send, message.author)
 
     except Exception as e:
         logger.exception(f"on_message error:  {type(e).__name__} - {e}")
         await message.channel.send(content=f"> Sorry, fail to process your request.\n\n`{type(e).__name__} - {e}`")
 
 
-def get_bot():
-    if isinstance(chatbot, PoeChatBot):
+def get_bot(target=None):
+    """
+    Returns the name of the bot type of the given chatbot, or of the current one
+    """
+    if target is None:
+        target = chatbot
+
+    if isinstance(target, PoeChatBot):
         return BotType.POE.value.lower()
 
-    elif isinstance(chatbot, HuggingFaceChatBot):
+    elif isinstance(target, HuggingFaceChatBot):
         return BotType.HUGGING_FACE.value.lower()
     else:
         return None
 
 
+def get_binding(channel):
+    """
+    Returns the bot binding of the channel, or of its guild, with its scope name, or None if unbound
+    """
+    binding = bot_bindings["channels"].get(str(channel.id))
+    if binding is not None:
+        return {**binding, "scope": get_binding_scope_name("channels")}
+
+    guild = getattr(channel, "guild", None)
+    if guild is not None:
+        binding = bot_bindings["guilds"].get(str(guild.id))
+        if binding is not None:
+            return {**binding, "scope": get_binding_scope_name("guilds")}
+
+    return None
+
+
+def get_binding_target(channel, channel_only=False):
+    """
+    Returns the binding scope and key of the channel's guild, or of the channel itself if asked or outside a guild
+    """
+    guild = getattr(channel, "guild", None)
+    if channel_only or guild is None:
+        return "channels", str(channel.id)
+    return "guilds", str(guild.id)
+
+
+def get_rule_target(interaction, channel=None, category=None, whole_server=False):
+    """
+    Returns the id of the server, category or channel a monitoring command applies to, the current channel by default
+    """
+    if whole_server and interaction.guild_id is not None:
+        return str(interaction.guild_id)
+    if category is not None:
+        return str(category.id)
+    return str(interaction.channel_id) if channel is None else str(channel.id)
+
+
+def get_rule_target_name(target_id):
+    """
+    Returns the name and id of the server, category or channel with the given id
+    """
+    target = client.get_channel(int(target_id)) or client.get_guild(int(target_id))
+    return f"{target} ({target_id})"
+
+
+def describe_rule_target(target_id):
+    """
+    Returns the kind, name and id of the server, category or channel with the given id, as shown to users
+    """
+    if client.get_guild(int(target_id)) is not None:
+        kind = "Server"
+    elif isinstance(client.get_channel(int(target_id)), discord.CategoryChannel):
+        kind = "Category"
+    else:
+        kind = "Channel"
+    return f"{kind} `{get_rule_target_name(target_id)}`"
+
+
+def get_parent_rule(target_id, rules):
+    """
+    Returns the id of the category or server of the given channel or category found in the given rules, or None
+    """
+    target = client.get_channel(int(target_id))
+    if target is None:
+        return None
+    return channel_rules.find_rule(target, rules)
+
+
+def get_binding_scope_name(scope):
+    """
+    Returns the name shown to users of the given binding scope
+    """
+    return "channel" if scope == "channels" else "server"
+
+
+def get_bound_keys():
+    """
+    Returns the registry keys of every bot and model bound to a guild or channel
+    """
+    return {ChatBotRegistry.make_key(binding["bot"], binding["model"])
+            for bindings in bot_bindings.values() for binding in bindings.values()}
+
+
+async def resolve_chatbot(channel):
+    """
+    Returns the chatbot bound to the channel or its guild, or None if it uses the current chatbot
+    """
+    binding = get_binding(channel)
+    if binding is None:
+        return None
+
+    target = await chatbot_registry.get(binding["bot"], binding["model"])
+    if target is None:
+        logger.warning(
+            f"Bot '{binding['bot']}' with model '{binding['model']}' bound to channel {channel.id} is unavailable, using the current bot")
+    return target
+
+
+def get_keep_warm_targets():
+    """
+    Returns the Hugging Face chatbots in use, the current one, the fallbacks and the ones bound to guilds or channels
+    """
+    targets = [chatbot] + chatbot_registry.get_all()
+    if router is not None:
+        targets += [router.get_backend(stats["backend"])
+                    for stats in router.get_stats()]
+
+    unique = {id(target): target for target in targets
+              if isinstance(target, HuggingFaceChatBot)}
+    return list(unique.values())
+
+
+async def create_bound_chatbot(bot_name: str, model: str):
+    """
+    Creates a chatbot of the given bot and model for the registry, or returns None if it fails
+    """
+    bot_type = parse_bot_type(bot_name)
+    if bot_type is None:
+        return None
+
+    loop = asyncio.get_running_loop()
+    new_chatbot = await loop.run_in_executor(None, create_chatbot, bot_type)
+    if new_chatbot is None:
+        return None
+
+    if model and not await new_chatbot.change_model(model):
+        logger.warning(f"Invalid model '{model}' for bot '{bot_name}'")
+        close_chatbot(new_chatbot)
+        return None
+
+    return new_chatbot
+
+
 def change_bot(new_bot):
     """
     Set the chatbot to the given bot_type if the bot_type is valid
+
+    This blocks while the chatbot connects, so it is only meant for start up. Use
+    `change_bot_async` once the event loop is running.
     """
-    global chatbot, current_bot
+    new_bot = parse_bot_type(new_bot)
+    if new_bot is None:
+        return False
+
+    new_chatbot = create_chatbot(new_bot)
+    if new_chatbot is None:
+        return False
+
+    swap_chatbot(new_bot, new_chatbot)
+    return True
+
 
+async def change_bot_async(new_bot):
+    """
+    Set the chatbot to the given bot_type if the bot_type is valid, without blocking the event loop
+
+    The new chatbot is created and connected in a thread, then swapped in once ready. Queries in
+    flight finish on the old chatbot.
+    """
+    new_bot = parse_bot_type(new_bot)
+    if new_bot is None:
+        return False
+
+    async with bot_change_lock:
+        loop = asyncio.get_running_loop()
+        new_chatbot = await loop.run_in_executor(None, create_chatbot, new_bot)
+        if new_chatbot is None:
+            return False
+
+        swap_chatbot(new_bot, new_chatbot)
+        return True
+
+
+def reset_bot_in_background():
+    """
+    Re-initializes the current chatbot in the background, unless it is already being re-initialized
+    """
+    global bot_reset_task
+
+    if bot_reset_task is None or bot_reset_task.done():
+        bot_reset_task = asyncio.get_running_loop().create_task(
+            change_bot_async(current_bot))
+
+
+def prune_chatbots_in_background():
+    """
+    Closes the chatbots no longer bound anywhere in the background, as closing waits for their queries in flight
+    """
+    task = asyncio.get_running_loop().create_task(prune_chatbots())
+    bot_prune_tasks.add(task)
+    task.add_done_callback(bot_prune_tasks.discard)
+
+
+async def prune_chatbots():
+    """
+    Closes the chatbots no longer bound anywhere
+    """
+    try:
+        await chatbot_registry.prune(get_bound_keys())
+    except Exception as e:
+        logger.exception(f"prune_chatbots error:  {type(e).__name__} - {e}")
+
+
+def parse_bot_type(new_bot):
+    """
+    Returns the BotType of the given bot name or type, or None if it is invalid
+    """
     if isinstance(new_bot, str):
         try:
             new_bot = BotType(utils.normalize_text(new_bot))
         except ValueError:
             logger.warning(f"Invalid bot type: {new_bot}")
-            return False
+            return None
 
     if not isinstance(new_bot, BotType):
         logger.warning(f"Invalid bot type: {type(new_bot)}")
-        return False
+        return None
+
+    return new_bot
 
+
+def create_chatbot(new_bot: BotType):
+    """
+    Creates and connects a chatbot of the given bot_type, or returns None if it fails
+
+    This blocks while the chatbot connects.
+    """
     try:
         if new_bot == BotType.POE:            
             if config.POE_TOKEN == "":
                 logger.warning("POE_TOKEN is not set.")
-                return False
+                return None
 
             if config.POE_MODEL == "":
                 logger.warning("POE_MODEL is not set.")
-                return False
+                return None
 
-            chatbot = PoeChatBot(
-                config.POE_TOKEN, config.POE_MODEL, config.POE_PROXY)
+            return PoeChatBot(
+                config.POE_TOKEN, config.POE_MODEL, config.POE_PROXY, config.POE_CONTEXT_PER_CHANNEL,
+                config.POE_MAX_CONCURRENCY, config.POE_COOLDOWN, config.POE_QUOTA_COOLDOWN,
+                config.POE_PROXY_PROBE_INTERVAL, config.POE_MODEL_INDEX_TTL)
 
         elif new_bot == BotType.HUGGING_FACE:
             if config.HUGGING_FACE_TOKEN == "":
                 logger.warning("HUGGING_FACE_TOKEN is not set.")
-                return False
+                return None
 
             if config.HUGGING_FACE_MODEL == "":
                 logger.warning("HUGGING_FACE_MODEL is not set.")
-                return False
-
-            chatbot = HuggingFaceChatBot(
-                config.HUGGING_FACE_TOKEN, config.HUGGING_FACE_MODEL)
+                return None
 
-        current_bot = new_bot
-        return True
+            return HuggingFaceChatBot(
+                config.HUGGING_FACE_TOKEN, config.HUGGING_FACE_MODEL, config.HUGGING_FACE_POOL_SIZE, config.HUGGING_FACE_TIMEOUT,
+                config.HUGGING_FACE_CONTEXT_MAX_CHARS, config.HUGGING_FACE_CONTEXT_SUMMARIZE, config.CONTEXT_STORE_MAX_CHARS,
+                config.HUGGING_FACE_MAX_RETRIES, retry_max_delay=config.HUGGING_FACE_RETRY_MAX_DELAY,
+                breaker_threshold=config.HUGGING_FACE_BREAKER_THRESHOLD, breaker_reset_timeout=config.HUGGING_FACE_BREAKER_RESET_TIMEOUT,
+                wait_for_model=config.HUGGING_FACE_WAIT_FOR_MODEL)
 
     except Exception as e:
         logger.exception(f"change_bot error:  {type(e).__name__} - {e}")
-        return False
+
+    return None
+
+
+def swap_chatbot(new_bot: BotType, new_chatbot):
+    """
+    Replaces the current chatbot with the given one, closing the old one in the background
+    """
+    global chatbot, current_bot
+
+    old_chatbot = chatbot
+    chatbot = new_chatbot
+    current_bot = new_bot
+
+    # The previous primary bot stays live in the router as a fallback, only a bot of the same type is replaced
+    if router is not None:
+        old_chatbot = router.set_backend(
+            new_bot.value, new_chatbot, primary=True)
+
+    # Release the replaced chatbot once its queries in flight have finished
+    if old_chatbot is not None and old_chatbot is not chatbot:
+        close_chatbot(old_chatbot)
+
+
+async def start_fallback_bots():
+    """
+    Creates the bots other than the current one in the background and adds them to the router
+    """
+    loop = asyncio.get_running_loop()
+
+    for bot_type in BotType:
+        if router.get_backend(bot_type.value) is not None:
+            continue
+
+        new_chatbot = await loop.run_in_executor(None, create_chatbot, bot_type)
+        if new_chatbot is None:
+            logger.info(f"Bot '{bot_type.value}' is not available as a fallback")
+            continue
+
+        # Keep the bot if it hasn't been brought up by a bot change in the meantime
+        async with bot_change_lock:
+            if router.get_backend(bot_type.value) is None:
+                router.set_backend(bot_type.value, new_chatbot)
+                logger.info(f"Bot '{bot_type.value}' added as a fallback")
+            else:
+                close_chatbot(new_chatbot)
+
+
+def close_chatbot(old_chatbot):
+    """
+    Closes the given chatbot in the background if the event loop is running
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+
+    loop.create_task(old_chatbot.close())
 
 
 def change_channel_monitor_mode(new_mode):
@@ -755,6 +1430,7 @@ def change_channel_monitor_mode(new_mode):
         return False
 
     current_channel_monitor_mode = new_mode
+    channel_rules.monitor_all = new_mode == ChannelMonitorMode.ALL
     return True
 
 
@@ -763,16 +1439,165 @@ def change_name_prefix_mode(new_mode):
     current_name_prefix_mode = new_mode
 
 
-async def query(message: str):
+async def reply(channel, message: str, send, user, interactive=False):
+    """
+    Queries the chatbot with the message and sends the response using the given send function.
+
+    If streaming is enabled, the response is shown progressively while it is being generated.
+    """
+    if not await admit_query(channel, user, send, interactive):
+        return
+
+    if keep_warm is not None:
+        keep_warm.record_activity()
+
+    # Interactions have a user waiting for the followup, so they go first
+    priority = Priority.INTERACTION if interactive else Priority.MONITORED
+
+    # The deadline covers the time spent waiting in the queue as well
+    deadline = time.monotonic() + get_query_timeout(channel)
+
+    if config.STREAMING_ENABLED:
+        streamer = ResponseStreamer(
+            send, config.STREAMING_EDIT_INTERVAL_MS / 1000, config.STREAMING_EDIT_CHARS)
+        status, response = await dispatch_query(channel, message, priority, deadline, streamer)
+
+        # The response has already been shown while streaming
+        if status == QueryStatus.SUCCESS:
+            return
+        if status == QueryStatus.TIMEOUT_ERROR:
+            response = ""
+    else:
+        status, response = await dispatch_query(channel, message, priority, deadline)
+
+    response = format_response_based_on_status(response, status)
+
+    await send(content=response)
+
+
+async def admit_query(channel, user, send, interactive=False):
+    """
+    Applies the rate limits and load shedding to a query, notifying the user if it is rejected.
+
+    Rejected monitored messages are dropped silently unless the load shedding mode is `reply`,
+    while rejected interactions are always answered.
+
+    Returns:
+        True if the query is admitted, False if not.
+    """
+    if rate_limiter is not None:
+        guild = getattr(channel, "guild", None)
+        scope = rate_limiter.acquire(
+            user.id, channel.id, guild.id if guild else None)
+
+        if scope is not None:
+            logger.info(f"Query from {user} rejected by the {scope} rate limit")
+            if interactive:
+                await send(content=f"> Sorry, too many messages are being sent (`{scope}` limit), please retry later.")
+            return False
+
+    if load_shedder is not None:
+        mode = await load_shedder.admit(dispatcher.get_pending_count)
+
+        if mode is not None:
+            logger.warning(
+                f"Query from {user} shed ({mode.value}) with {dispatcher.get_pending_count()} queries pending")
+            if interactive or mode == ShedMode.REPLY:
+                await send(content="> Sorry, the bot is busy right now, please retry later.")
+            return False
+
+    return True
+
+
+def get_query_timeout(channel=None):
+    """
+    Returns the number of seconds a query to the bot of the channel, or to the current bot, may take
+    """
+    binding = get_binding(channel) if channel is not None else None
+    bot_type = parse_bot_type(binding["bot"]) if binding is not None else current_bot
+
+    if bot_type == BotType.HUGGING_FACE:
+        return config.HUGGING_FACE_TIMEOUT
+    return config.POE_TIMEOUT
+
+
+async def dispatch_query(channel, message: str, priority=Priority.MONITORED, deadline=None, streamer: ResponseStreamer = None):
+    """
+    Queues the message in the channel's queue and waits for the query result.
+    """
+    context_key = get_context_key(channel)
+    use_cache = str(channel.id) not in response_cache_blacklist
+    target = await resolve_chatbot(channel)
+    logger.info(
+        f"Queueing {priority.name.lower()} query in channel {channel.id}, {dispatcher.get_pending_count()} queries pending")
+    return await dispatcher.submit(channel.id, get_bot(target), lambda: query(message, context_key, streamer, use_cache, deadline, target), priority)
+
+
+def get_context_key(channel):
+    """
+    Returns the key of the conversation context of the given channel.
+    """
+    guild = getattr(channel, "guild", None)
+    return (guild.id if guild else None, channel.id)
+
+
+async def query(message: str, context_key=None, streamer: ResponseStreamer = None, use_cache=True, deadline=None, target=None):
     status = None
+    query_key = None
+    cache_key = None
+
+    # Don't start a query whose deadline passed while waiting in the queue
+    if deadline is not None and deadline <= time.monotonic():
+        status = QueryStatus.TIMEOUT_ERROR
+        logger.error("Query deadline exceeded before sending")
+        return status, ""
+
+    # Identify the query to reuse the response of identical ones with the same conversation context in any
+    # channel, except in debug mode. Only for chatbots keeping their contexts locally, as the reused
+    # response is added to the context of the channel, which can't be done when it is held by the service
+    keyed = target if target is not None else chatbot
+    if (response_cache is not None or single_flight is not None) and not config.DEBUG and keyed.keeps_context_locally():
+        query_key = ResponseCache.make_key(
+            get_bot(keyed), keyed.get_model(), message, keyed.get_context_fingerprint(context_key))
+
+    # Reply from the cache if the same query has been answered recently
+    if response_cache is not None and use_cache and query_key is not None:
+        cache_key = query_key
+        response = response_cache.get(cache_key)
+
+        if response is not None:
+            logger.info(f"Response (cached): {response}")
+            keyed.add_to_context(message, response, context_key)
+            if streamer is not None:
+                await streamer.write(response)
+                await streamer.finish()
+            return QueryStatus.SUCCESS, response
 
     try:
-        success, response = await chatbot.query(message, debug=config.DEBUG)
+        # Share the result of an identical query already in flight
+        if single_flight is not None and query_key is not None:
+            (success, response), shared = await single_flight.do(
+                query_key, lambda: query_chatbot(message, context_key, streamer, deadline, target))
+
+            if shared:
+                logger.info("Query collapsed into an identical one in flight")
+                if success:
+                    keyed.add_to_context(message, response, context_key)
+                if streamer is not None and success:
+                    await streamer.write(response)
+                    await streamer.finish()
+        else:
+            success, response = await query_chatbot(message, context_key, streamer, deadline, target)
+    except QueryTimeoutError as e:
+        status = QueryStatus.TIMEOUT_ERROR
+        logger.error(
+            f"Query timeout:  {e}, {len(e.partial_text)} characters received")
+        return status, e.partial_text
     except AttributeError as e:
         status = QueryStatus.QUERY_ATTRIBUTE_ERROR
         logger.exception(
             f"Query AttributeError:  {type(e).__name__} - {e}, trying to re-initialize the chatbot")
-        change_bot(current_bot)
+        reset_bot_in_background()
         return status, e
     except Exception as e:
         status = QueryStatus.UNKNOWN_QUERY_ERROR
@@ -789,6 +1614,10 @@ async def query(message: str):
     if success:
         status = QueryStatus.SUCCESS
         logger.info(f"Response: {response}")
+
+        if cache_key is not None:
+            response_cache.put(cache_key, response)
+
         return status, response
     else:
         status = QueryStatus.UNKNOWN_RESPONSE_ERROR
@@ -798,6 +1627,109 @@ async def query(message: str):
         return status, error_message
 
 
+async def query_chatbot(message: str, context_key=None, streamer: ResponseStreamer = None, deadline=None, target=None):
+    """
+    Queries the given chatbot, or the current one, streaming the response if a streamer is given.
+
+    Chatbots bound to a guild or channel are queried directly, the router only serves the current one.
+    """
+    if target is None:
+        if router is not None:
+            return await query_router(message, context_key, streamer, deadline)
+        target = chatbot
+
+    if streamer is None:
+        return await target.query(message, debug=config.DEBUG, context_key=context_key, deadline=deadline)
+    else:
+        return await streamer.stream(target.query_stream(message, debug=config.DEBUG, context_key=context_key, deadline=deadline))
+
+
+async def query_router(message: str, context_key=None, streamer: ResponseStreamer = None, deadline=None):
+    """
+    Queries the bots in the order decided by the router, failing over to the next one on errors or timeouts.
+
+    A bot is only failed over while nothing of its response has been received. If hedging is
+    enabled, a bot late to respond is raced against the next one.
+    """
+    routes, reason = router.route()
+    logger.info(f"Routing query, {reason}")
+
+    success, response = False, "No bot available"
+    index = 0
+
+    def open_stream(name, backend, is_last):
+        first_chunk_timeout = None if is_last else config.ROUTER_FAILOVER_TIMEOUT
+        return router.track(name, backend.query_stream(
+            message, debug=config.DEBUG, context_key=context_key, deadline=deadline), first_chunk_timeout)
+
+    def has_tried_all(chunks):
+        # The next bot of a hedged stream has only been tried if the race started it
+        tried = index + 1 if isinstance(chunks, HedgedStream) and chunks.hedged else index
+        return tried >= len(routes)
+
+    while index < len(routes):
+        name, backend = routes[index]
+        chunks = None
+
+        # Race the bot against the next one if it doesn't respond as fast as usual
+        if config.HEDGING_ENABLED and index + 1 < len(routes):
+            next_name, next_backend = routes[index + 1]
+            chunks = router.hedge((name, open_stream(name, backend, False)),
+                                  (next_name, open_stream(next_name, next_backend, index + 2 == len(routes))))
+
+        if chunks is None:
+            chunks = open_stream(name, backend, index + 1 == len(routes))
+        index += 1
+
+        response = ""
+
+        try:
+            if streamer is None:
+                try:
+                    async for chunk in chunks:
+                        response += chunk
+                except QueryTimeoutError as e:
+                    raise QueryTimeoutError(str(e), response)
+                success = True
+            else:
+                success, response = await streamer.stream(chunks)
+
+        except QueryTimeoutError as e:
+            if has_tried_all(chunks) or e.partial_text or (deadline is not None and deadline <= time.monotonic()):
+                raise
+            success, response = False, str(e)
+
+        except AttributeError:
+            raise
+
+        except Exception as e:
+            # Keep the part of the response received before the error
+            if has_tried_all(chunks) or response:
+                return False, f"{response}... (`{e}`)" if response else f"{e}"
+            success, response = False, str(e)
+
+        if isinstance(chunks, HedgedStream):
+            name = chunks.name
+            if chunks.hedged:
+                reason += f", hedged after {chunks.delay:.1f}s"
+                index += 1  # The next bot has been tried too
+
+        if success or index >= len(routes) or (streamer is not None and streamer.text):
+            break
+
+        logger.warning(
+            f"Bot '{name}' failed ({response}), failing over to '{routes[index][0]}'")
+
+    if config.DEBUG:
+        note = f"\n\n> Routed to `{name}`, {reason}" if routes else f"\n\n> {reason}"
+        if streamer is not None and success:
+            await streamer.write(note)
+            await streamer.finish()
+        response += note
+
+    return success, response
+
+
 def add_prefix_to_message(prefix: str, message: str):
     return f"{prefix}{message}"
 
@@ -818,6 +1750,11 @@ def format_response_based_on_status(response: str, status: QueryStatus):
     elif status == QueryStatus.UNKNOWN_RESPONSE_ERROR:
         return f"> Sorry, your request couldn't be processed, below are the response received:\n\n{response}"
 
+    elif status == QueryStatus.TIMEOUT_ERROR:
+        if response:
+            return f"{response}...\n\n> Sorry, the response took too long and was cut off."
+        return "> Sorry, the chatbot took too long to respond, please retry later."
+
 
 def create_embeds(text: str):
     MAX_CHARS_PER_EMBED = 4096
@@ -838,7 +1775,7 @@ def create_embeds(text: str):
 
 
 def restore_from_config():
-    global nicknames, channel_whitelist, channel_blacklist
+    global nicknames, channel_whitelist, channel_blacklist, response_cache_blacklist, bot_bindings
 
     try:
         success = config.load_config()
@@ -847,20 +1784,101 @@ def restore_from_config():
             nicknames = config.data["nicknames"].copy()
             channel_whitelist = config.data["channel_whitelist"].copy()
             channel_blacklist = config.data["channel_blacklist"].copy()
+            channel_rules.load(channel_whitelist, channel_blacklist)
+            response_cache_blacklist = config.data["response_cache_blacklist"].copy()
+            bot_bindings = {scope: bindings.copy()
+                            for scope, bindings in config.data["bot_bindings"].items()}
 
             logger.info(
-                f"Restored config from config file {config.CONFIG_FILE}")
+                f"Restored config from config file {config.get_config_location()}")
 
         else:
-            logger.info(f"Created config file {config.CONFIG_FILE}")
+            logger.info(f"Created config file {config.get_config_location()}")
+
+        configure_admission_control(config.data["rate_limits"])
 
     except AttributeError as e:
         logger.exception(
             f"restore_from_config error:  {type(e).__name__} - {e}")
 
 
+def reload_from_config():
+    """
+    Applies the external edits of the config file to the nicknames, channel lists and bot bindings, without restarting
+    """
+    try:
+        changes = config.reload_config()
+    except (OSError, ValueError) as e:
+        logger.warning(
+            f"Config file {config.get_config_location()} not reloaded:  {type(e).__name__} - {e}")
+        return
+
+    # Apply every change before anything else runs on the event loop
+    for key, change in changes.items():
+        if key == "nicknames":
+            nicknames.update(change["added"])
+            for user_id in change["removed"]:
+                nicknames.pop(user_id, None)
+        elif key == "bot_bindings":
+            for (scope, target_id), binding in change["added"].items():
+                bot_bindings.setdefault(scope, {})[target_id] = binding.copy()
+            for scope, target_id in change["removed"]:
+                bot_bindings.get(scope, {}).pop(target_id, None)
+        elif key == "response_cache_blacklist":
+            response_cache_blacklist.extend(channel_id for channel_id in change["added"]
+                                            if channel_id not in response_cache_blacklist)
+            response_cache_blacklist[:] = [channel_id for channel_id in response_cache_blacklist
+                                           if channel_id not in change["removed"]]
+        else:
+            channels = channel_whitelist if key == "channel_whitelist" else channel_blacklist
+            rules = channel_rules.whitelist if key == "channel_whitelist" else channel_rules.blacklist
+            channels += [channel_id for channel_id in change["added"]
+                         if channel_id not in channels]
+            channels[:] = [channel_id for channel_id in channels
+                           if channel_id not in change["removed"]]
+            rules.update(int(channel_id) for channel_id in change["added"])
+            rules.difference_update(int(channel_id)
+                                    for channel_id in change["removed"])
+
+    # Release the chatbots no longer bound anywhere, the newly bound ones are created on their first query
+    if "bot_bindings" in changes:
+        prune_chatbots_in_background()
+
+    for key, change in changes.items():
+        logger.info(
+            f"Reloaded {key} from config file {config.get_config_location()}: added {change['added']}, removed {change['removed']}")
+
+
+async def watch_config_store():
+    """
+    Reloads the config from the SQLite database whenever another process changed it
+    """
+    while True:
+        await asyncio.sleep(config.CONFIG_RELOAD_POLL_INTERVAL)
+        reload_from_config()
+
+
+def configure_admission_control(limits: dict):
+    """
+    Creates the rate limiter and load shedder from the given rate limit settings
+    """
+    global rate_limiter, load_shedder
+
+    rate_limiter = RateLimiter(limits)
+
+    try:
+        shed_mode = ShedMode(utils.normalize_text(limits["shed_mode"]))
+    except ValueError:
+        logger.warning(
+            f"Invalid shed mode: {limits['shed_mode']}, using {ShedMode.REPLY.value}")
+        shed_mode = ShedMode.REPLY
+
+    load_shedder = LoadShedder(
+        int(limits["shed_threshold"]), shed_mode, float(limits["shed_max_defer"]))
+
+
 def main():
-    global chatbot, current_monitor_mode, current_name_prefix_mode
+    global chatbot, current_monitor_mode, current_name_prefix_mode, startup_model
 
     parser = argparse.ArgumentParser()
     parser.add_argument('--bot', type=str, choices=[bot.value for bot in BotType],
@@ -874,6 +1892,22 @@ def main():
 
     args = parser.parse_args()
 
+    # Run the shards in worker processes, each running this script with the same arguments
+    if config.SHARD_COUNT > 0 and config.SHARD_WORKERS > 1 and not config.SHARD_IDS:
+        if config.store is None:
+            logger.error("Sharded workers need a shared config, set CONFIG_BACKEND to sqlite, exiting...")
+            return
+
+        supervisor = ShardSupervisor(
+            [sys.executable, os.path.abspath(__file__)] + sys.argv[1:], config.SHARD_COUNT, config.SHARD_WORKERS,
+            config.SHARD_RESTART_DELAY)
+        supervisor.run()
+        return
+
+    # Set the size of the thread pool consuming blocking response streams
+    utils.configure_async_wrap_iter(
+        config.ASYNC_ITER_MAX_WORKERS, config.ASYNC_ITER_BUFFER_SIZE)
+
     # Set default bot
     success = change_bot(args.bot)
 
@@ -882,9 +1916,8 @@ def main():
         logger.error(f"Fail to create bot '{args.bot}' on start, exiting...")
         return
 
-    # Set default model
-    if args.model:
-        chatbot.change_model(args.model)
+    # Set default model once the event loop is running
+    startup_model = args.model
 
     # Set default channel monitor mode
     change_channel_monitor_mode(args.channel_monitor_mode)
@@ -895,12 +1928,18 @@ def main():
     # Restore variables from config
     restore_from_config()
 
+    # Write the config changes still waiting for their debounce window on any exit
+    atexit.register(config.flush_config)
+
     # Start dicord client
     try:
         client.run(config.DISCORD_TOKEN, log_handler=None)
     except Exception as e:
         logger.exception(f"Fail to run discord client:  {type(e).__name__} - {e}")
         return
+    finally:
+        # Write the config changes still waiting for their debounce window
+        config.flush_config()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,200 @@
+import asyncio
+import collections
+import time
+
+from enum import Enum
+
+
+class ShedMode(Enum):
+    DROP = "drop"
+    DEFER = "defer"
+    REPLY = "reply"
+
+
+class TokenBucket:
+    """
+    A class that implements a token bucket, refilled at a constant rate up to its burst size.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        """
+        Initializes a new TokenBucket instance, starting full.
+
+        Args:
+            rate (float): The number of tokens added per second.
+            burst (int): The maximum number of tokens held.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+
+    def refill(self):
+        """
+        Adds the tokens earned since the last refill.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens +
+                          (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def has_token(self):
+        """
+        Returns whether a token is available, after refilling.
+        """
+        self.refill()
+        return self.tokens >= 1
+
+    def take(self):
+        """
+        Consumes a token, assuming one is available.
+        """
+        self.tokens -= 1
+
+
+class RateLimiter:
+    """
+    A class that limits the rate of queries per user, per channel and per guild with token buckets.
+
+    A query is admitted only if every scope has a token left, in which case one token of
+    each scope is consumed.
+    """
+
+    SCOPES = ("user", "channel", "guild")
+
+    def __init__(self, limits: dict, max_buckets=10000):
+        """
+        Initializes a new RateLimiter instance.
+
+        Args:
+            limits (dict): The `<scope>_rate` (tokens per second) and `<scope>_burst` of each scope.
+                           A scope with a rate of 0 or less is not limited.
+            max_buckets (int): The maximum number of buckets kept per scope, the least recently used ones are dropped.
+        """
+        self.limits = {
+            scope: (float(limits.get(f"{scope}_rate", 0)),
+                    int(limits.get(f"{scope}_burst", 1)))
+            for scope in self.SCOPES
+        }
+        self.max_buckets = max_buckets
+        self.buckets = {scope: collections.OrderedDict()
+                        for scope in self.SCOPES}
+        self.allowed = 0
+        self.limited = {scope: 0 for scope in self.SCOPES}
+
+    def acquire(self, user_id, channel_id, guild_id):
+        """
+        Consumes a token of each scope if all of them have one.
+
+        Args:
+            user_id: The id of the user sending the query.
+            channel_id: The id of the channel the query is sent in.
+            guild_id: The id of the guild the query is sent in, or None for direct messages.
+
+        Returns:
+            None if the query is admitted, otherwise the name of the first scope over its limit.
+        """
+        ids = {"user": user_id, "channel": channel_id, "guild": guild_id}
+        buckets = []
+
+        for scope in self.SCOPES:
+            bucket = self.__get_bucket(scope, ids[scope])
+            if bucket is None:
+                continue
+            if not bucket.has_token():
+                self.limited[scope] += 1
+                return scope
+            buckets.append(bucket)
+
+        for bucket in buckets:
+            bucket.take()
+
+        self.allowed += 1
+        return None
+
+    def get_stats(self):
+        """
+        Returns a dictionary of rate limiter statistics.
+        """
+        return {
+            "allowed": self.allowed,
+            **{f"limited_{scope}": count for scope, count in self.limited.items()},
+        }
+
+    def __get_bucket(self, scope, id):
+        """
+        Returns the bucket of the given scope and id, or None if the scope is not limited.
+        """
+        rate, burst = self.limits[scope]
+        if rate <= 0 or id is None:
+            return None
+
+        buckets = self.buckets[scope]
+        bucket = buckets.get(id)
+        if bucket is None:
+            bucket = buckets[id] = TokenBucket(rate, burst)
+            if len(buckets) > self.max_buckets:
+                buckets.popitem(last=False)
+        else:
+            buckets.move_to_end(id)
+        return bucket
+
+
+class LoadShedder:
+    """
+    A class that sheds queries while too many of them are waiting to be processed.
+    """
+
+    def __init__(self, threshold: int, mode=ShedMode.REPLY, max_defer=10.0):
+        """
+        Initializes a new LoadShedder instance.
+
+        Args:
+            threshold (int): The number of pending queries above which new queries are shed.
+                             A threshold of 0 or less disables shedding.
+            mode (ShedMode): What to do with shed queries: drop them, defer them until the load
+                             goes down, or reply with a canned message.
+            max_defer (float): The maximum number of seconds a query is deferred before being dropped.
+        """
+        self.threshold = threshold
+        self.mode = mode
+        self.max_defer = max_defer
+        self.shed = 0
+        self.deferred = 0
+
+    async def admit(self, get_pending_count):
+        """
+        Decides whether a query is admitted given the current load, deferring it if configured.
+
+        Args:
+            get_pending_count: A function without arguments returning the number of pending queries.
+
+        Returns:
+            None if the query is admitted, otherwise the ShedMode applied (DROP or REPLY).
+        """
+        if self.threshold <= 0 or get_pending_count() <= self.threshold:
+            return None
+
+        if self.mode == ShedMode.DEFER:
+            self.deferred += 1
+            deadline = time.monotonic() + self.max_defer
+
+            while time.monotonic() < deadline:
+                await asyncio.sleep(0.5)
+                if get_pending_count() <= self.threshold:
+                    return None
+
+            self.shed += 1
+            return ShedMode.DROP
+
+        self.shed += 1
+        return self.mode
+
+    def get_stats(self):
+        """
+        Returns a dictionary of load shedder statistics.
+        """
+        return {
+            "shed": self.shed,
+            "deferred": self.deferred,
+        }
@@ -0,0 +1,95 @@
+import collections
+import time
+
+import utils
+
+
+class ResponseCache:
+    """
+    A class that caches chatbot responses for exactly matching queries.
+
+    Entries expire after a fixed time to live, and the least recently used entries are
+    evicted once the cache is full.
+    """
+
+    def __init__(self, max_entries=1000, ttl=300.0):
+        """
+        Initializes a new ResponseCache instance.
+
+        Args:
+            max_entries (int): The maximum number of cached responses.
+            ttl (float): The number of seconds a cached response stays valid.
+
+        Raises:
+            ValueError: If `max_entries` is smaller than 1 or `ttl` is not positive.
+        """
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        if ttl <= 0:
+            raise ValueError("ttl must be positive")
+
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()  # (expires_at, response) per key, least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(backend: str, model: str, input: str, context_fingerprint=None):
+        """
+        Returns the cache key of a query.
+
+        Args:
+            backend (str): The backend the query is sent to.
+            model (str): The model the query is sent to.
+            input (str): The user's input text, normalized before use.
+            context_fingerprint: A hashable fingerprint of the conversation context, if any.
+        """
+        return (backend, model, utils.normalize_text(input), context_fingerprint)
+
+    def get(self, key):
+        """
+        Returns the cached response of the given key, or None if missing or expired.
+        """
+        entry = self.entries.get(key)
+
+        if entry is not None and entry[0] <= time.monotonic():
+            del self.entries[key]
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, response: str):
+        """
+        Caches the response of the given key, evicting the least recently used entries if full.
+        """
+        self.entries[key] = (time.monotonic() + self.ttl, response)
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """
+        Removes all cached responses.
+        """
+        self.entries.clear()
+
+    def get_stats(self):
+        """
+        Returns a dictionary of cache statistics.
+        """
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
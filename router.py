@@ -0,0 +1,443 @@
+import asyncio
+import collections
+import random
+import time
+
+from enum import Enum
+
+from chatbots import QueryTimeoutError
+
+
+class RoutingPolicy(Enum):
+    PRIMARY = "primary"  # The primary backend, then the others in order as fallbacks
+    FASTEST = "fastest"  # The backend with the best latency and error rate first
+    WEIGHTED = "weighted"  # A random backend picked by weight, scaled down by its error rate
+
+
+class BackendStats:
+    """
+    A class that holds the health of a backend as exponentially weighted moving averages.
+    """
+
+    def __init__(self, name):
+        """
+        Initializes a new BackendStats instance.
+
+        Args:
+            name (str): The name of the backend.
+        """
+        self.name = name
+        self.latency = None  # EWMA of the first chunk latency in seconds, None until measured
+        self.error_rate = 0.0  # EWMA of the error rate, from 0 to 1
+        self.requests = 0
+        self.errors = 0
+        self.last_error_at = 0.0
+        self.recent_latencies = collections.deque(maxlen=100)
+
+
+class BackendRouter:
+    """
+    A class that routes each query across several live chatbots, falling back to the next one on failure.
+
+    Each backend is tracked with the latency of its first chunk and its error rate. The order in
+    which the backends are tried is decided per query by the routing policy, backends failing
+    too often being tried last.
+    """
+
+    def __init__(self, policy=RoutingPolicy.PRIMARY, weights=None, alpha=0.3, max_error_rate=0.5, error_penalty=10.0, recovery_time=60.0,
+                 hedge_percentile=95.0, max_hedge_ratio=0.1, hedge_min_samples=10):
+        """
+        Initializes a new BackendRouter instance.
+
+        Args:
+            policy (RoutingPolicy or str): The policy deciding the order in which backends are tried.
+            weights (dict): The weight of each backend name for the weighted policy, 1 by default.
+            alpha (float): The weight of the newest sample in the moving averages.
+            max_error_rate (float): The error rate above which a backend is only tried as a last resort.
+            error_penalty (float): How much the error rate inflates the latency in the score.
+            recovery_time (float): The number of seconds without errors after which a degraded backend is tried again.
+            hedge_percentile (float): The percentile of a backend's recent first chunk latencies after which
+                                      the query is hedged to the next backend.
+            max_hedge_ratio (float): The maximum share of queries that may be hedged, 0 to disable hedging.
+            hedge_min_samples (int): The number of latencies a backend needs before its queries are hedged.
+
+        Raises:
+            ValueError: If `policy` is not a valid routing policy.
+        """
+        self.policy = RoutingPolicy(policy)
+        self.weights = weights or {}
+        self.alpha = alpha
+        self.max_error_rate = max_error_rate
+        self.error_penalty = error_penalty
+        self.recovery_time = recovery_time
+        self.hedge_percentile = hedge_percentile
+        self.max_hedge_ratio = max_hedge_ratio
+        self.hedge_min_samples = hedge_min_samples
+        self.backends = {}  # Backend name to chatbot, in the order they were added
+        self.stats = {}
+        self.primary = None
+        self.routed = 0
+        self.hedged = 0
+        self.hedges_won = 0
+
+    def set_backend(self, name, chatbot, primary=False):
+        """
+        Adds or replaces the chatbot of the given backend, keeping its statistics.
+
+        Args:
+            name (str): The name of the backend.
+            chatbot (ChatBot): The chatbot serving the backend.
+            primary (bool): Whether the backend becomes the primary one.
+
+        Returns:
+            The chatbot previously serving the backend, or None.
+        """
+        old_chatbot = self.backends.get(name)
+        self.backends[name] = chatbot
+        self.stats.setdefault(name, BackendStats(name))
+
+        if primary or self.primary is None:
+            self.primary = name
+
+        return old_chatbot
+
+    def get_backend(self, name):
+        """
+        Returns the chatbot of the given backend, or None if there isn't any.
+        """
+        return self.backends.get(name)
+
+    def route(self):
+        """
+        Decides the order in which the backends are tried for a query.
+
+        Returns:
+            A tuple of two values:
+            - routes (list): The (name, chatbot) pairs of the backends, in the order to try them.
+            - reason (str): A short explanation of the decision.
+        """
+        self.routed += 1
+
+        names = list(self.backends)
+        healthy = [name for name in names if self.is_healthy(name)]
+        degraded = [name for name in names if not self.is_healthy(name)]
+
+        if self.policy == RoutingPolicy.FASTEST:
+            healthy.sort(key=self.get_score)
+            reason = "fastest"
+
+        elif self.policy == RoutingPolicy.WEIGHTED:
+            healthy = self.__shuffle_by_weight(healthy)
+            reason = "weighted"
+
+        else:
+            healthy.sort(key=lambda name: name != self.primary)
+            reason = "primary"
+
+        degraded.sort(key=self.get_score)
+        order = healthy + degraded
+
+        if not order:
+            return [], f"{reason}: no backend available"
+
+        reason = f"{reason}: {self.__describe(order[0])}"
+        if self.primary in degraded:
+            reason += f", primary `{self.primary}` degraded ({self.stats[self.primary].error_rate:.0%} errors)"
+
+        return [(name, self.backends[name]) for name in order], reason
+
+    async def track(self, name, chunks, first_chunk_timeout=None):
+        """
+        Yields the chunks of a backend response, recording its latency and outcome.
+
+        Args:
+            name (str): The name of the backend.
+            chunks: An async iterator yielding chunks of the response text.
+            first_chunk_timeout (float): The number of seconds to wait for the first chunk, or None to wait
+                                         for the backend's own deadline.
+
+        Yields:
+            str: The next chunk of the response text.
+
+        Raises:
+            QueryTimeoutError: If the first chunk doesn't arrive in time.
+        """
+        start = time.monotonic()
+        latency = None
+
+        try:
+            try:
+                if first_chunk_timeout is None:
+                    chunk = await chunks.__anext__()
+                else:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), first_chunk_timeout)
+            except asyncio.TimeoutError:
+                raise QueryTimeoutError(
+                    f"No response from `{name}` within {first_chunk_timeout:g}s")
+
+            latency = time.monotonic() - start
+            yield chunk
+
+            async for chunk in chunks:
+                yield chunk
+
+        except StopAsyncIteration:
+            pass
+
+        except Exception:
+            self.record(name, latency, error=True)
+            raise
+
+        finally:
+            await chunks.aclose()
+
+        self.record(name, latency)
+
+    def record(self, name, latency=None, error=False):
+        """
+        Records the outcome of a query sent to the given backend.
+
+        Args:
+            name (str): The name of the backend.
+            latency (float): The number of seconds until the first chunk, or None if none arrived.
+            error (bool): Whether the query failed.
+        """
+        stats = self.stats.get(name)
+        if stats is None:
+            return
+
+        stats.requests += 1
+        if error:
+            stats.errors += 1
+            stats.last_error_at = time.monotonic()
+        stats.error_rate += self.alpha * \
+            ((1.0 if error else 0.0) - stats.error_rate)
+
+        if latency is not None:
+            stats.recent_latencies.append(latency)
+            if stats.latency is None:
+                stats.latency = latency
+            else:
+                stats.latency += self.alpha * (latency - stats.latency)
+
+    def hedge(self, primary, secondary):
+        """
+        Returns a stream racing the given responses, or None if the primary backend cannot be hedged.
+
+        The secondary response is only started if the primary one has no first chunk after the
+        hedge delay of the primary backend, and the hedge budget allows it.
+
+        Args:
+            primary (tuple): The name of the primary backend and its tracked response chunks.
+            secondary (tuple): The name of the secondary backend and its tracked response chunks, not started yet.
+        """
+        delay = self.get_hedge_delay(primary[0])
+        if delay is None:
+            return None
+        return HedgedStream(self, primary, secondary, delay)
+
+    def get_hedge_delay(self, name):
+        """
+        Returns the number of seconds after which a query to the given backend without a first chunk
+        is hedged, or None if hedging is disabled or the backend has too few latency samples.
+        """
+        latencies = sorted(self.stats[name].recent_latencies)
+        if self.max_hedge_ratio <= 0 or len(latencies) < self.hedge_min_samples:
+            return None
+
+        index = min(int(len(latencies) * self.hedge_percentile / 100), len(latencies) - 1)
+        return latencies[index]
+
+    def take_hedge(self):
+        """
+        Counts a hedged query if the hedge budget allows one more.
+
+        Returns:
+            True if the query may be hedged.
+        """
+        if self.hedged + 1 > self.max_hedge_ratio * self.routed:
+            return False
+
+        self.hedged += 1
+        return True
+
+    def is_healthy(self, name):
+        """
+        Returns whether the given backend doesn't fail too often, or hasn't failed for a while.
+        """
+        stats = self.stats[name]
+        return stats.error_rate <= self.max_error_rate or \
+            time.monotonic() - stats.last_error_at >= self.recovery_time
+
+    def get_score(self, name):
+        """
+        Returns the score of the given backend, lower is better.
+
+        Backends without measured latency score 0, so they are tried and measured first.
+        """
+        stats = self.stats[name]
+        latency = stats.latency if stats.latency is not None else 0.0
+        return latency * (1 + self.error_penalty * stats.error_rate)
+
+    def get_stats(self):
+        """
+        Returns a list of health statistics, one dictionary per backend.
+        """
+        return [
+            {
+                "backend": name,
+                "primary": name == self.primary,
+                "healthy": self.is_healthy(name),
+                "latency": stats.latency,
+                "error_rate": stats.error_rate,
+                "requests": stats.requests,
+                "errors": stats.errors,
+                "hedge_delay": self.get_hedge_delay(name),
+            }
+            for name, stats in self.stats.items()
+            if name in self.backends
+        ]
+
+    def get_hedge_stats(self):
+        """
+        Returns a dictionary of hedging statistics.
+        """
+        return {
+            "routed": self.routed,
+            "hedged": self.hedged,
+            "won": self.hedges_won,
+        }
+
+    def __shuffle_by_weight(self, names):
+        """
+        Returns the given backends in a random order, backends of higher weight coming first more often.
+        """
+        names = list(names)
+        order = []
+
+        while names:
+            weights = [max(self.weights.get(name, 1.0) * (1 - self.stats[name].error_rate), 1e-6)
+                       for name in names]
+            name = random.choices(names, weights)[0]
+            names.remove(name)
+            order.append(name)
+
+        return order
+
+    def __describe(self, name):
+        """
+        Returns a short description of the health of the given backend.
+        """
+        stats = self.stats[name]
+        latency = f"{stats.latency:.1f}s" if stats.latency is not None else "unmeasured"
+        return f"`{name}` ({latency}, {stats.error_rate:.0%} errors)"
+
+
+class HedgedStream:
+    """
+    An async iterator racing a primary response against a secondary one, yielding the chunks of
+    whichever produces its first chunk first.
+
+    The secondary response is started only if the primary one is late, and the loser is cancelled.
+    """
+
+    def __init__(self, router, primary, secondary, delay):
+        """
+        Initializes a new HedgedStream instance.
+
+        Args:
+            router (BackendRouter): The router counting the hedged queries against its budget.
+            primary (tuple): The name of the primary backend and its response chunks.
+            secondary (tuple): The name of the secondary backend and its response chunks, not started yet.
+            delay (float): The number of seconds without a first chunk after which the secondary response is started.
+        """
+        self.router = router
+        self.primary = primary
+        self.secondary = secondary
+        self.delay = delay
+        self.name = primary[0]  # The name of the backend whose chunks are yielded
+        self.hedged = False
+        self.chunks = None  # The chunks of the winning response, once decided
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.chunks is None:
+            return await self.__race()
+        return await self.chunks.__anext__()
+
+    async def aclose(self):
+        """
+        Closes the winning response, or both if the race hasn't been decided.
+        """
+        if self.chunks is not None:
+            await self.chunks.aclose()
+        else:
+            await self.primary[1].aclose()
+            await self.secondary[1].aclose()
+
+    async def __race(self):
+        """
+        Waits for the first chunk of the primary response, hedging with the secondary one if it is late.
+
+        Returns:
+            str: The first chunk of the winning response.
+
+        Raises:
+            StopAsyncIteration: If the winning response is empty.
+            Exception: The error of the last response, if both fail.
+        """
+        name, chunks = self.primary
+        tasks = {asyncio.create_task(self.__next_chunk(chunks)): self.primary}
+        error = None
+
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.delay)
+
+            if not done and self.router.take_hedge():
+                self.hedged = True
+                name, chunks = self.secondary
+                tasks[asyncio.create_task(self.__next_chunk(chunks))] = self.secondary
+
+            while tasks:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    name, chunks = tasks.pop(task)
+                    try:
+                        chunk = task.result()
+                    except StopAsyncIteration:
+                        chunk = None
+                    except Exception as e:
+                        error = e
+                        await chunks.aclose()
+                        continue
+
+                    self.name, self.chunks = name, chunks
+                    if self.hedged and name == self.secondary[0]:
+                        self.router.hedges_won += 1
+
+                    if chunk is None:
+                        raise StopAsyncIteration
+                    return chunk
+
+            raise error
+
+        finally:
+            # Cancel the loser, or both responses if the race itself is cancelled
+            for task, (name, chunks) in tasks.items():
+                task.cancel()
+            for task, (name, chunks) in tasks.items():
+                await asyncio.gather(task, return_exceptions=True)
+                await chunks.aclose()
+
+            if not self.hedged:
+                await self.secondary[1].aclose()
+
+    @staticmethod
+    async def __next_chunk(chunks):
+        """
+        Returns the next chunk of the given response.
+        """
+        return await chunks.__anext__()
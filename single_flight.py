@@ -0,0 +1,59 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    A class that collapses concurrent calls with the same key into a single call.
+
+    The first caller of a key starts the call, and callers arriving while it is in flight
+    wait for the same result instead of starting their own.
+    """
+
+    def __init__(self):
+        """
+        Initializes a new SingleFlight instance.
+        """
+        self.calls = {}  # In-flight task per key
+        self.total = 0  # Number of calls made through the single flight
+        self.collapsed = 0  # Number of calls served by another caller's call
+
+    async def do(self, key, func):
+        """
+        Calls `func` unless a call with the same key is already in flight, and returns its result.
+
+        The call keeps running if the caller that started it is cancelled, so the other
+        callers still receive the result.
+
+        Args:
+            key: A hashable key identifying identical calls.
+            func: A coroutine function without arguments that performs the call.
+
+        Returns:
+            A tuple of two values:
+            - result: The value returned by the call.
+            - shared (bool): Whether the result came from a call started by another caller.
+        """
+        self.total += 1
+
+        task = self.calls.get(key)
+        if task is not None:
+            self.collapsed += 1
+            return await asyncio.shield(task), True
+
+        task = asyncio.ensure_future(func())
+        self.calls[key] = task
+        task.add_done_callback(lambda _: self.calls.pop(key, None))
+        # Retrieve the exception even if every caller went away
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+        return await asyncio.shield(task), False
+
+    def get_stats(self):
+        """
+        Returns a dictionary of single flight statistics.
+        """
+        return {
+            "in_flight": len(self.calls),
+            "total": self.total,
+            "collapsed": self.collapsed,
+        }
@@ -0,0 +1,118 @@
+import time
+
+from chatbots import QueryTimeoutError
+
+
+class ResponseStreamer:
+    """
+    A class that progressively shows a streamed response in Discord.
+
+    The first chunk is posted as a new message right away, later chunks are shown by
+    editing that message at a limited cadence. When the message reaches the Discord
+    character limit, the rest of the response continues in a new message.
+    """
+
+    MAX_CHARS_PER_MESSAGE = 2000
+
+    def __init__(self, send, edit_interval=1.0, edit_chars=500):
+        """
+        Initializes a new ResponseStreamer instance.
+
+        Args:
+            send: A coroutine function that posts the given content and returns the sent message.
+            edit_interval (float): The minimum number of seconds between two edits.
+            edit_chars (int): The number of new characters that triggers an edit before `edit_interval` has passed.
+        """
+        self.send = send
+        self.edit_interval = edit_interval
+        self.edit_chars = edit_chars
+        self.text = ""  # The whole response received so far
+        self.message = None  # The message currently being edited
+        self.message_text = ""  # The content of the current message, including unpublished text
+        self.published_length = 0  # The length of the content already shown in the current message
+        self.last_published = 0.0
+
+    async def stream(self, chunks):
+        """
+        Shows the chunks of the given async iterator as they arrive.
+
+        Args:
+            chunks: An async iterator yielding chunks of the response text.
+
+        Returns:
+            A tuple of two values:
+            - success (bool): Whether the whole response was streamed.
+            - generated_text (str): The streamed response text.
+              If `success` is False, this will contain an error message instead, as the
+              partial response has already been shown.
+
+        Raises:
+            QueryTimeoutError: If the deadline is exceeded, with the response streamed so far.
+        """
+        try:
+            async for chunk in chunks:
+                await self.write(chunk)
+        except QueryTimeoutError as e:
+            await self.finish()
+            raise QueryTimeoutError(str(e), self.text)
+        except Exception as e:
+            await self.finish()
+            return False, f"{e}"
+
+        await self.finish()
+        return True, self.text
+
+    async def write(self, chunk: str):
+        """
+        Appends a chunk to the response, publishing it if an update is due.
+        """
+        self.text += chunk
+        self.message_text += chunk
+
+        # Roll over to a new message when the current one is full
+        while len(self.message_text) > self.MAX_CHARS_PER_MESSAGE:
+            content = self.message_text[:self.MAX_CHARS_PER_MESSAGE]
+            self.message_text = self.message_text[self.MAX_CHARS_PER_MESSAGE:]
+            await self.__publish(content)
+            self.message = None
+            self.published_length = 0
+
+        if self.__is_update_due():
+            await self.__publish(self.message_text)
+
+    async def finish(self):
+        """
+        Publishes any text that has not been shown yet.
+        """
+        if self.message_text.strip() and len(self.message_text) > self.published_length:
+            await self.__publish(self.message_text)
+
+    def __is_update_due(self):
+        """
+        Returns whether the unpublished text should be shown now.
+        """
+        if not self.message_text.strip():
+            return False
+
+        # Post the first chunk of a message right away
+        if self.message is None:
+            return True
+
+        pending = len(self.message_text) - self.published_length
+        if pending <= 0:
+            return False
+
+        elapsed = time.monotonic() - self.last_published
+        return elapsed >= self.edit_interval or pending >= self.edit_chars
+
+    async def __publish(self, content: str):
+        """
+        Posts or edits the current message with the given content.
+        """
+        if self.message is None:
+            self.message = await self.send(content)
+        else:
+            await self.message.edit(content=content)
+
+        self.published_length = len(content)
+        self.last_published = time.monotonic()
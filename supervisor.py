@@ -0,0 +1,163 @@
+import logging
+import os
+import signal
+import subprocess
+import time
+
+logger = logging.getLogger('discord')
+
+IDENTIFY_INTERVAL = 5.0  # Seconds Discord requires between two shards connecting
+
+
+class ShardSupervisor:
+    """
+    A class that runs the Discord shards in several worker processes and restarts the workers that exit.
+
+    Each worker runs the given command with the `SHARD_IDS` and `SHARD_COUNT` environment variables
+    set to its own contiguous range of shards. Workers start one after the other, as shards must
+    connect a few seconds apart. A worker that keeps crashing is restarted with an exponential
+    backoff, reset once it has stayed up for a while.
+    """
+
+    def __init__(self, command, shard_count, workers, restart_delay=5.0, max_restart_delay=300.0, stable_time=60.0):
+        """
+        Initializes a new ShardSupervisor instance.
+
+        Args:
+            command (list): The command running a worker, e.g. `[sys.executable, "main.py"]`.
+            shard_count (int): The total number of shards.
+            workers (int): The number of worker processes, at most one per shard.
+            restart_delay (float): The number of seconds before restarting a worker that exited.
+            max_restart_delay (float): The maximum number of seconds before restarting a worker that keeps exiting.
+            stable_time (float): The number of seconds a worker must stay up for its restart delay to be reset.
+        """
+        self.command = command
+        self.shard_ranges = self.get_shard_ranges(shard_count, workers)
+        self.shard_count = shard_count
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.stable_time = stable_time
+        self.processes = [None] * len(self.shard_ranges)
+        self.started_at = [0.0] * len(self.shard_ranges)
+        self.failures = [0] * len(self.shard_ranges)  # Consecutive quick exits per worker
+        self.restart_at = [0.0] * len(self.shard_ranges)
+        self.restarts = 0
+        self.stopping = False
+
+    @staticmethod
+    def get_shard_ranges(shard_count, workers):
+        """
+        Returns the shard ids of each worker, splitting the shards into contiguous ranges of similar sizes.
+        """
+        workers = max(min(workers, shard_count), 1)
+        size, extra = divmod(shard_count, workers)
+        ranges = []
+        start = 0
+        for index in range(workers):
+            end = start + size + (1 if index < extra else 0)
+            ranges.append(list(range(start, end)))
+            start = end
+        return ranges
+
+    def run(self):
+        """
+        Starts the workers and keeps them running until the supervisor is interrupted or terminated.
+        """
+        signal.signal(signal.SIGINT, self.__handle_signal)
+        signal.signal(signal.SIGTERM, self.__handle_signal)
+
+        # Stagger the first starts, as each worker connects its shards one after the other
+        now = time.monotonic()
+        delay = 0.0
+        for index, shard_ids in enumerate(self.shard_ranges):
+            self.restart_at[index] = now + delay
+            delay += IDENTIFY_INTERVAL * len(shard_ids)
+
+        logger.info(
+            f"Supervising {len(self.shard_ranges)} workers for {self.shard_count} shards: {self.shard_ranges}")
+
+        try:
+            while not self.stopping:
+                self.__check_workers()
+                time.sleep(0.5)
+        finally:
+            self.__stop_workers()
+
+    def get_stats(self):
+        """
+        Returns a dictionary of supervisor statistics.
+        """
+        return {
+            "workers": len(self.shard_ranges),
+            "running": sum(1 for process in self.processes if process is not None and process.poll() is None),
+            "restarts": self.restarts,
+        }
+
+    def __check_workers(self):
+        """
+        Starts the workers due to start, and schedules the restart of the workers that exited.
+        """
+        now = time.monotonic()
+        for index, process in enumerate(self.processes):
+            if process is None:
+                if now >= self.restart_at[index]:
+                    self.__start_worker(index)
+                continue
+
+            code = process.poll()
+            if code is None:
+                continue
+
+            if now - self.started_at[index] >= self.stable_time:
+                self.failures[index] = 0
+            delay = min(self.restart_delay * 2 ** self.failures[index], self.max_restart_delay)
+            self.failures[index] += 1
+            self.restart_at[index] = now + delay
+            self.processes[index] = None
+            self.restarts += 1
+            logger.warning(
+                f"Worker of shards {self.shard_ranges[index]} exited with code {code}, restarting in {delay:.0f}s")
+
+    def __start_worker(self, index):
+        """
+        Starts the worker process of the given shard range.
+        """
+        shard_ids = self.shard_ranges[index]
+        env = {
+            **os.environ,
+            "SHARD_IDS": ",".join(str(shard_id) for shard_id in shard_ids),
+            "SHARD_COUNT": str(self.shard_count),
+        }
+        self.processes[index] = subprocess.Popen(self.command, env=env)
+        self.started_at[index] = time.monotonic()
+        logger.info(
+            f"Started worker of shards {shard_ids} (pid {self.processes[index].pid})")
+
+    def __stop_workers(self, timeout=10.0):
+        """
+        Interrupts the workers so they shut down gracefully, killing the ones still running after the timeout.
+        """
+        running = [process for process in self.processes
+                   if process is not None and process.poll() is None]
+        for process in running:
+            # Workers stop on SIGINT like on Ctrl+C, writing their pending config changes
+            if os.name == "posix":
+                process.send_signal(signal.SIGINT)
+            else:
+                process.terminate()
+
+        deadline = time.monotonic() + timeout
+        for process in running:
+            try:
+                process.wait(max(deadline - time.monotonic(), 0))
+            except subprocess.TimeoutExpired:
+                logger.warning(f"Killing worker (pid {process.pid})")
+                process.kill()
+                process.wait()
+
+    def __handle_signal(self, signum, frame):
+        """
+        Stops supervising on SIGINT or SIGTERM.
+        """
+        logger.info(f"Received signal {signum}, stopping the workers")
+        self.stopping = True
@@ -0,0 +1,35 @@
+from types import SimpleNamespace
+
+from channel_rules import ChannelRules
+
+
+def make_channel(channel_id, category_id=None, guild_id=None, parent_id=None):
+    guild = SimpleNamespace(id=guild_id) if guild_id is not None else None
+    return SimpleNamespace(id=channel_id, category_id=category_id, guild=guild, parent_id=parent_id)
+
+
+def test_blacklisted_category_is_not_monitored():
+    rules = ChannelRules(monitor_all=True)
+    rules.load([], ["2"])
+    channel = make_channel(1, category_id=2, guild_id=3)
+
+    assert not rules.is_monitored(channel)
+    assert rules.find_rule(channel, rules.blacklist) == 2
+
+
+def test_whitelisted_server_is_monitored():
+    rules = ChannelRules(monitor_all=False)
+    rules.load(["3"], [])
+    thread = make_channel(4, guild_id=3, parent_id=1)
+
+    assert rules.is_monitored(thread)
+    assert rules.find_rule(thread, rules.whitelist) == 3
+
+
+def test_channel_rule_comes_first():
+    rules = ChannelRules(monitor_all=True)
+    rules.load([], ["1", "2"])
+    channel = make_channel(1, category_id=2)
+
+    assert rules.find_rule(channel, rules.blacklist) == 1
+    assert rules.find_rule(make_channel(5), rules.blacklist) is None
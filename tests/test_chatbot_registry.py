@@ -0,0 +1,69 @@
+import asyncio
+import time
+
+from chatbot_registry import ChatBotRegistry
+
+
+class CountingFactory:
+    """
+    A chatbot factory failing until told to succeed, counting its calls.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.succeed = False
+
+    async def __call__(self, bot, model):
+        self.calls += 1
+        return object() if self.succeed else None
+
+
+def test_failed_creation_is_not_retried_right_away():
+    async def run():
+        factory = CountingFactory()
+        registry = ChatBotRegistry(factory, retry_delay=60.0)
+
+        assert await registry.get("poe", "Broken") is None
+        assert await registry.get("poe", "Broken") is None
+        assert factory.calls == 1
+
+        # Retry once the delay has passed
+        failures, _ = registry.failures[registry.make_key("poe", "Broken")]
+        registry.failures[registry.make_key("poe", "Broken")] = (failures, 0.0)
+        factory.succeed = True
+        assert await registry.get("poe", "Broken") is not None
+        assert factory.calls == 2
+        assert not registry.failures
+
+    asyncio.run(run())
+
+
+def test_retry_delay_backs_off():
+    async def run():
+        registry = ChatBotRegistry(CountingFactory(), retry_delay=10.0, max_retry_delay=25.0)
+        key = registry.make_key("poe", "Broken")
+
+        delays = []
+        for _ in range(3):
+            await registry.get("poe", "Broken")
+            failures, retry_at = registry.failures[key]
+            delays.append(round(retry_at - time.monotonic()))
+            registry.failures[key] = (failures, 0.0)
+
+        assert delays == [10, 20, 25]
+
+    asyncio.run(run())
+
+
+def test_peek_never_creates():
+    async def run():
+        factory = CountingFactory()
+        factory.succeed = True
+        registry = ChatBotRegistry(factory)
+
+        assert registry.peek("poe", "ChatGPT") is None
+        instance = await registry.get("poe", "chatgpt")
+        assert registry.peek("poe", "ChatGPT") is instance
+        assert factory.calls == 1
+
+    asyncio.run(run())
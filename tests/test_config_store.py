@@ -0,0 +1,156 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+from config_store import SqliteConfigStore, apply_config_changes, diff_config
+
+# Same as config.RELOADABLE_KEYS, config can't be imported without its environment
+RELOADABLE_KEYS = ("nicknames", "channel_whitelist", "channel_blacklist",
+                   "response_cache_blacklist", "bot_bindings")
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def apply_reload(store, data, keys):
+    """
+    Merges the reloaded keys into the configuration in memory, like config.reload_config does.
+    """
+    old, new = store.reload(keys)
+    changes = diff_config(old, new, keys)
+    apply_config_changes(data, changes)
+    return changes
+
+
+def run_worker(path, code):
+    """
+    Runs the given code in another process, with `store` and `data` loaded from the database.
+    """
+    script = f"from config_store import SqliteConfigStore\nstore = SqliteConfigStore({path!r})\ndata = store.load()\n"
+    subprocess.run([sys.executable, "-c", script + textwrap.dedent(code)], cwd=REPO_ROOT, check=True)
+
+
+def make_config():
+    return {
+        "nicknames": {},
+        "channel_whitelist": [],
+        "channel_blacklist": [],
+        "response_cache_blacklist": [],
+        "bot_bindings": {"guilds": {}, "channels": {}},
+        "rate_limits": {"user_rate": 1},
+    }
+
+
+def test_save_only_writes_changes(tmp_path):
+    store = SqliteConfigStore(str(tmp_path / "config.db"))
+    store.save({"nicknames": {"1": "a"}, "channel_whitelist": ["10"], "rate_limits": {"user_rate": 1}})
+
+    data = store.load()
+    data["nicknames"]["2"] = "b"
+    del data["nicknames"]["1"]
+    data["channel_whitelist"].append("11")
+    store.save(data)
+
+    assert SqliteConfigStore(str(tmp_path / "config.db")).load() == data
+
+
+def test_two_workers_keep_each_other_rows(tmp_path):
+    path = str(tmp_path / "config.db")
+    SqliteConfigStore(path).save(make_config())
+
+    first = SqliteConfigStore(path)
+    first_data = first.load()
+    second = SqliteConfigStore(path)
+    second_data = second.load()
+
+    # The second worker changes keys the first one doesn't reload
+    second_data["bot_bindings"]["guilds"]["1"] = {"bot": "poe", "model": "ChatGPT"}
+    second_data["response_cache_blacklist"].append("20")
+    second_data["rate_limits"] = {"user_rate": 2}
+    second_data["nicknames"]["5"] = "five"
+    second.save(second_data)
+
+    # The first worker only merges some of the keys
+    assert first.has_external_changes()
+    apply_reload(first, first_data, ("nicknames", "channel_whitelist", "channel_blacklist"))
+    assert first_data["nicknames"] == {"5": "five"}
+
+    # The first worker saves its own change, which must not delete the rows of the second one
+    first_data["channel_blacklist"].append("30")
+    first.save(first_data)
+
+    stored = SqliteConfigStore(path).load()
+    assert stored["bot_bindings"]["guilds"] == {"1": {"bot": "poe", "model": "ChatGPT"}}
+    assert stored["response_cache_blacklist"] == ["20"]
+    assert stored["rate_limits"] == {"user_rate": 2}
+    assert stored["nicknames"] == {"5": "five"}
+    assert stored["channel_blacklist"] == ["30"]
+
+
+def test_own_saves_are_not_external_changes(tmp_path):
+    store = SqliteConfigStore(str(tmp_path / "config.db"))
+    data = store.load()
+    data["nicknames"] = {"1": "a"}
+    store.save(data)
+
+    assert not store.has_external_changes()
+
+
+def test_workers_share_bindings_and_cache_blacklist(tmp_path):
+    path = str(tmp_path / "config.db")
+    SqliteConfigStore(path).save(make_config())
+
+    first = SqliteConfigStore(path)
+    first_data = first.load()
+    first_data["bot_bindings"]["guilds"]["1"] = {"bot": "poe", "model": "ChatGPT"}
+    first.save(first_data)
+
+    # Another worker binds a channel, unbinds the server and disables the cache of a channel
+    run_worker(path, """
+        data["bot_bindings"]["channels"]["2"] = {"bot": "huggingface", "model": "gpt2"}
+        del data["bot_bindings"]["guilds"]["1"]
+        data["response_cache_blacklist"].append("3")
+        store.save(data)
+    """)
+
+    assert first.has_external_changes()
+    changes = apply_reload(first, first_data, RELOADABLE_KEYS)
+    assert changes["bot_bindings"] == {
+        "added": {("channels", "2"): {"bot": "huggingface", "model": "gpt2"}},
+        "removed": [("guilds", "1")],
+    }
+    assert first_data["bot_bindings"] == {"guilds": {}, "channels": {"2": {"bot": "huggingface", "model": "gpt2"}}}
+    assert first_data["response_cache_blacklist"] == ["3"]
+
+    # Saving the first worker's own change keeps the other worker's ones
+    first_data["nicknames"]["4"] = "four"
+    first.save(first_data)
+    run_worker(path, """
+        assert data["bot_bindings"]["channels"] == {"2": {"bot": "huggingface", "model": "gpt2"}}
+        assert data["bot_bindings"]["guilds"] == {}
+        assert data["response_cache_blacklist"] == ["3"]
+        assert data["nicknames"] == {"4": "four"}
+    """)
+
+
+def test_saving_keeps_other_workers_changes_pending(tmp_path):
+    path = str(tmp_path / "config.db")
+    SqliteConfigStore(path).save(make_config())
+
+    first = SqliteConfigStore(path)
+    first_data = first.load()
+    second = SqliteConfigStore(path)
+    second_data = second.load()
+
+    second_data["nicknames"]["1"] = "bob"
+    second.save(second_data)
+    assert first.has_external_changes()
+
+    # A save of the first worker, e.g. pending while the second one saved, doesn't hide its change
+    first_data["channel_whitelist"].append("10")
+    first.save(first_data)
+    assert first.has_external_changes()
+
+    apply_reload(first, first_data, RELOADABLE_KEYS)
+    assert first_data["nicknames"] == {"1": "bob"}
+    assert first_data["channel_whitelist"] == ["10"]
+    assert not first.has_external_changes()
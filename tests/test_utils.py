@@ -0,0 +1,76 @@
+import asyncio
+import gc
+import threading
+
+from utils import AsyncIterBridge
+
+
+class ClosableIterator:
+    """
+    A blocking iterator recording whether it was closed.
+    """
+
+    def __init__(self, items):
+        self.items = iter(items)
+        self.closed = threading.Event()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.items)
+
+    def close(self):
+        self.closed.set()
+
+
+def test_wrap_yields_all_items():
+    async def run():
+        bridge = AsyncIterBridge(max_workers=1, buffer_size=2)
+        try:
+            return [item async for item in bridge.wrap(iter(range(10)))]
+        finally:
+            bridge.shutdown()
+
+    assert asyncio.run(run()) == list(range(10))
+
+
+def test_close_before_first_step_closes_iterator():
+    async def run():
+        bridge = AsyncIterBridge(max_workers=1, buffer_size=1)
+        it = ClosableIterator(range(100))
+        ait = bridge.wrap(it)
+        await ait.aclose()
+        bridge.shutdown(wait=True)
+        return it
+
+    it = asyncio.run(run())
+    assert it.closed.is_set()
+
+
+def test_drop_before_first_step_closes_iterator():
+    async def run():
+        bridge = AsyncIterBridge(max_workers=1, buffer_size=1)
+        it = ClosableIterator(range(100))
+        bridge.wrap(it)
+        gc.collect()
+        bridge.shutdown(wait=True)
+        return it
+
+    it = asyncio.run(run())
+    assert it.closed.is_set()
+
+
+def test_close_after_first_step_stops_producer():
+    async def run():
+        bridge = AsyncIterBridge(max_workers=1, buffer_size=1)
+        it = ClosableIterator(range(100))
+        ait = bridge.wrap(it)
+        assert await ait.__anext__() == 0
+        await ait.aclose()
+        # The producer blocked on a full buffer must exit, or this waits forever
+        await asyncio.get_running_loop().run_in_executor(None, bridge.shutdown, True)
+        return it
+
+    it = asyncio.run(asyncio.wait_for(run(), 5))
+    assert it.closed.is_set()
@@ -1,43 +1,217 @@
 import asyncio
+import collections
 import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class BridgedAsyncIterator:
+    """
+    A class that iterates asynchronously over the items of a blocking iterator, as returned by AsyncIterBridge.wrap.
+
+    The producer thread only starts on the first step. Closing the iterator, or dropping it,
+    stops the producer and closes the blocking iterator, even if it was never stepped.
+    """
+
+    def __init__(self, items, start, stop):
+        """
+        Initializes a new BridgedAsyncIterator instance.
+
+        Args:
+            items: The asynchronous generator yielding the buffered items.
+            start: A function without arguments starting the producer thread.
+            stop: A function taking whether the producer was started, stopping it and closing the blocking iterator.
+        """
+        self.items = items
+        self.start = start
+        self.stop = stop
+        self.started = False
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.closed:
+            raise StopAsyncIteration
+        if not self.started:
+            self.started = True
+            self.start()
+        return await self.items.__anext__()
+
+    async def aclose(self):
+        """
+        Stops the producer thread and closes the blocking iterator.
+        """
+        if not self.closed:
+            self.closed = True
+            self.stop(self.started)
+            await self.items.aclose()
+
+    def __del__(self):
+        # Dropped without being closed, e.g. cancelled before its first step
+        if not self.closed:
+            self.closed = True
+            self.stop(self.started)
+
+
+class AsyncIterBridge:
+    """
+    A class that wraps blocking iterators into asynchronous ones.
+
+    The blocking iterators are consumed by a bounded pool of named threads, and the items
+    are handed over to the event loop in batches through a bounded buffer.
+    """
+
+    def __init__(self, max_workers=16, buffer_size=64, thread_name_prefix="async-iter"):
+        """
+        Initializes a new AsyncIterBridge instance.
+
+        Args:
+            max_workers (int): The maximum number of iterators consumed at the same time.
+            buffer_size (int): The maximum number of items buffered per iterator before the producer thread waits.
+            thread_name_prefix (str): The name prefix of the producer threads.
+
+        Raises:
+            ValueError: If `max_workers` or `buffer_size` is smaller than 1.
+        """
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+        if buffer_size < 1:
+            raise ValueError("buffer_size must be at least 1")
+
+        self.buffer_size = buffer_size
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+
+    def wrap(self, it):
+        """
+        Wrap blocking iterator into an asynchronous one
+
+        The producer thread starts on the first step. It stops, and closes the iterator if
+        possible, once the returned asynchronous iterator is closed or garbage collected.
+
+        Args:
+            it: The blocking iterator to wrap.
+
+        Returns:
+            BridgedAsyncIterator: An asynchronous iterator yielding the items of `it`.
+        """
+        loop = asyncio.get_running_loop()
+        buffer = collections.deque()
+        slots = threading.Semaphore(self.buffer_size)
+        lock = threading.Lock()
+        stopped = threading.Event()
+        ready = asyncio.Event()
+        wakeup_pending = False
+        exception = None
+        _END = object()
+
+        def notify():
+            # Wake the consumer once per batch rather than once per item
+            nonlocal wakeup_pending
+            with lock:
+                if wakeup_pending:
+                    return
+                wakeup_pending = True
+            try:
+                loop.call_soon_threadsafe(ready.set)
+            except RuntimeError:
+                # The event loop is closed, nobody is listening anymore
+                stopped.set()
+
+        def iter_to_buffer():
+            nonlocal exception
+            try:
+                # Skip iterators whose consumer went away while waiting for a thread
+                if stopped.is_set():
+                    return
+                for item in it:
+                    # This runs outside the event loop thread, so we wait for
+                    # a free slot with a thread-safe primitive
+                    slots.acquire()
+                    if stopped.is_set():
+                        break
+                    buffer.append(item)
+                    notify()
+            except Exception as e:
+                exception = e
+            finally:
+                if stopped.is_set() and hasattr(it, "close"):
+                    it.close()
+                buffer.append(_END)
+                notify()
+
+        async def yield_buffer_items():
+            nonlocal wakeup_pending
+            try:
+                while True:
+                    await ready.wait()
+                    ready.clear()
+                    with lock:
+                        wakeup_pending = False
+
+                    while buffer:
+                        next_item = buffer.popleft()
+                        if next_item is _END:
+                            if exception is not None:
+                                # the iterator has raised, propagate the exception
+                                raise exception
+                            return
+                        slots.release()
+                        yield next_item
+            finally:
+                # Stop the producer thread if the consumer goes away early
+                stopped.set()
+                slots.release()
+
+        def start():
+            self.executor.submit(iter_to_buffer)
+
+        def stop(started):
+            stopped.set()
+            slots.release()
+            # Without a producer, nobody else closes the iterator
+            if not started and hasattr(it, "close"):
+                it.close()
+
+        return BridgedAsyncIterator(yield_buffer_items(), start, stop)
+
+    def shutdown(self, wait=False):
+        """
+        Shuts down the producer threads.
+
+        Args:
+            wait (bool): Whether to wait for the running producers to finish.
+        """
+        self.executor.shutdown(wait=wait)
+
+
+# Shared bridge used by async_wrap_iter
+async_iter_bridge = AsyncIterBridge()
+
+
+def configure_async_wrap_iter(max_workers: int, buffer_size: int):
+    """
+    Replaces the shared bridge used by async_wrap_iter with one of the given size
+
+    Args:
+        max_workers (int): The maximum number of iterators consumed at the same time.
+        buffer_size (int): The maximum number of items buffered per iterator.
+    """
+    global async_iter_bridge
+
+    old_bridge = async_iter_bridge
+    async_iter_bridge = AsyncIterBridge(max_workers, buffer_size)
+    old_bridge.shutdown(wait=False)
 
 
 def async_wrap_iter(it):
     """
-    Wrap blocking iterator into an asynchronous one
+    Wrap blocking iterator into an asynchronous one, using the shared bridge
 
     Reference: https://stackoverflow.com/questions/62294385/synchronous-generator-in-asyncio
     """
-    loop = asyncio.get_event_loop()
-    q = asyncio.Queue(1)
-    exception = None
-    _END = object()
-
-    async def yield_queue_items():
-        while True:
-            next_item = await q.get()
-            if next_item is _END:
-                break
-            yield next_item
-        if exception is not None:
-            # the iterator has raised, propagate the exception
-            raise exception
-
-    def iter_to_queue():
-        nonlocal exception
-        try:
-            for item in it:
-                # This runs outside the event loop thread, so we
-                # must use thread-safe API to talk to the queue.
-                asyncio.run_coroutine_threadsafe(
-                    q.put(item), loop).result()
-        except Exception as e:
-            exception = e
-        finally:
-            asyncio.run_coroutine_threadsafe(q.put(_END), loop).result()
-
-    threading.Thread(target=iter_to_queue).start()
-    return yield_queue_items()
+    return async_iter_bridge.wrap(it)
 
 
 def normalize_text(text: str):
@@ -47,4 +221,4 @@ def normalize_text(text: str):
     Args:
         text (str): The text to normalize.
     """
-    return text.strip().lower() if text is not None else ""    
\ No newline at end of file
+    return text.strip().lower() if text is not None else ""
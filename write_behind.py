@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import os
+import tempfile
+import threading
+
+logger = logging.getLogger('discord')
+
+
+def write_file_atomically(path, content):
+    """
+    Replaces the file with the given content atomically.
+
+    The content goes to a temporary file in the same directory, which is synced to disk and then
+    renamed over the file, so a crash leaves either the previous or the new content, never a
+    truncated one.
+
+    Args:
+        path (str): The path of the file to write.
+        content (str): The content to write.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(
+        dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    # Sync the directory so the rename survives a crash, where the platform allows it
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class WriteBehind:
+    """
+    A class that coalesces changes and writes them after a debounce window, in a thread.
+    """
+
+    def __init__(self, write, delay=1.0):
+        """
+        Initializes a new WriteBehind instance.
+
+        Args:
+            write: A blocking function taking the serialized content and writing it, e.g. `write_file_atomically`.
+                   Calls never overlap.
+            delay (float): The number of seconds to wait for more changes before writing, 0 to write right away.
+        """
+        self.write = write
+        self.delay = delay
+        self.serialize = None  # Returns the content to write, called when the write happens
+        self.version = 0  # Incremented on every change
+        self.written_version = 0
+        self.handle = None  # The pending delayed write
+        self.lock = threading.Lock()  # Serializes the writes of the executor threads and flush
+        self.writes = 0
+        self.coalesced = 0
+
+    def is_dirty(self):
+        """
+        Returns whether some changes have not been written yet.
+        """
+        return self.written_version < self.version
+
+    def schedule(self, serialize):
+        """
+        Records a change and schedules a write, unless one is already pending.
+
+        Without a running event loop, the content is written right away.
+
+        Args:
+            serialize: A function without arguments returning the content to write.
+                       It is called on the event loop when the write happens, so it sees the latest changes.
+        """
+        self.serialize = serialize
+        self.version += 1
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+
+        if self.delay <= 0:
+            self.__write_in_background(loop)
+        elif self.handle is None:
+            self.handle = loop.call_later(
+                self.delay, self.__write_in_background, loop)
+        else:
+            self.coalesced += 1
+
+    def flush(self):
+        """
+        Writes the pending changes right away, cancelling the delayed write.
+        """
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+
+        if self.is_dirty():
+            self.__write(self.serialize(), self.version)
+
+    def get_stats(self):
+        """
+        Returns a dictionary of writer statistics.
+        """
+        return {
+            "dirty": self.is_dirty(),
+            "writes": self.writes,
+            "coalesced": self.coalesced,
+        }
+
+    def __write_in_background(self, loop):
+        """
+        Serializes the content on the event loop and writes it in a thread.
+        """
+        self.handle = None
+        if not self.is_dirty():
+            return
+
+        future = loop.run_in_executor(
+            None, self.__write, self.serialize(), self.version)
+        future.add_done_callback(self.__log_error)
+
+    def __write(self, content, version):
+        """
+        Writes the given content, unless a newer version was written.
+        """
+        with self.lock:
+            if version <= self.written_version:
+                return
+
+            self.write(content)
+            self.written_version = version
+            self.writes += 1
+
+    @staticmethod
+    def __log_error(future):
+        """
+        Logs the error of a background write, the changes stay pending until the next write.
+        """
+        if not future.cancelled() and future.exception() is not None:
+            e = future.exception()
+            logger.error(f"Write behind error:  {type(e).__name__} - {e}")